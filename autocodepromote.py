@@ -4,31 +4,96 @@ Created on Mar 13, 2018
 @author: nseden
 '''
 
+import os
+import re
+
 from bambooci import utils
 from scmlib.errors import ScmError
+from scmlib.filelock import FileLock
 
 logger = utils.get_logger("autocodepromote")
 
 class AutoCodePromote(object):
 
-    def __init__(self, local_git_repo, disable_lfs=False, promote_retry_count=3):
+    def __init__(self, local_git_repo, disable_lfs=False, promote_retry_count=3, worktree_root=None, change_in_worktree=False):
         self.local_git_repo = local_git_repo
         self.git = utils.get_git_scm(local_git_repo, config_init=True)
         self.promote_retry_count = promote_retry_count
 
+        # Linked worktrees of the repository the merges are made in, one per branch and reused between runs.
+        # With change_in_worktree, the change is made in one as well instead of in the main checkout, and the handler
+        # gets the worktree path: handlers must then only write under the path they are passed.
+        self.change_in_worktree = change_in_worktree
+        if worktree_root is None:
+            worktree_root = os.path.abspath(local_git_repo).rstrip("\\/") + "_worktrees"
+        self.worktree_root = worktree_root
+        self.worktree_locks = []
+
         if disable_lfs:
             # Local command, not catching exceptions
             logger.info("Disabling LFS hooks...")
             self.git.runRawCommand(['lfs', 'uninstall'])
 
+    def _worktree(self, name, revision, branch=None, submodules=False):
+        """
+        Creates or reuses the linked worktree 'name' checked out at revision and locks it until _release_worktrees.
+        A promotion using the same worktree in another process is waited for.
+
+        :return: GitScm for the worktree
+        """
+        path = os.path.join(self.worktree_root, re.sub(r"[^A-Za-z0-9._-]+", "_", name))
+        lock = FileLock(path + ".lock")
+        lock.acquire()
+        try:
+            # The file lock is released if a process dies, the git lock (which keeps the worktree from being pruned) is not.
+            try:
+                self.git.unlockWorktree(path)
+            except ScmError:
+                pass
+            worktree = self.git.getWorktree(path, revision, branch=branch, lock="autocodepromote pid {}".format(os.getpid()),
+                                            submodules=submodules)
+        except:
+            lock.release()
+            raise
+        self.worktree_locks.append((path, lock))
+        return worktree
+
+    def _change_checkout(self, target_branch, branch):
+        """
+        Checks out 'branch' at origin's target_branch where the change is made: a linked worktree with change_in_worktree,
+        otherwise the main checkout (left on that branch afterwards).
+
+        :return: GitScm and path of the checkout to change
+        """
+        if self.change_in_worktree:
+            change = self._worktree("change_" + target_branch, "origin/" + target_branch, branch=branch, submodules=True)
+            return change, change.localpath
+        self.git.runRawCommand(["checkout", "--no-track", "-B", branch, "origin/" + target_branch])
+        self.git.gotoBranch(branch)
+        return self.git, self.local_git_repo
+
+    def _release_worktrees(self):
+        for path, lock in self.worktree_locks:
+            try:
+                self.git.unlockWorktree(path)
+            except ScmError as e:
+                logger.warning("Unable to unlock worktree {}: {}".format(path, e.msg))
+            lock.release()
+        self.worktree_locks = []
+
     def promote_change(self, onChangeSourceHandlerFunc, target_branch, commit_msg, ff_ancestor_branch=None, tmp_local_banch_name="tmp"):
         """
         Promotes a set of file modifications to the target branch with the option of additionally merging the change to a GIT fast-forward branch.
 
+        The merges are made in linked worktrees of the repository (one per branch, see worktree_root) rather than by switching the main
+        checkout between branches. The change is made in the main checkout, switched to the temporary branch, unless change_in_worktree is
+        set: the change is then made in a worktree too, so the main checkout is left alone and promotions to other target branches can run
+        at the same time. The merges into the target and ff ancestor branches of one promotion still run one after the other.
+
         WARNING: This code expects the file modifications to cause NO merge conflicts with the remote origin.  This code will fail ungracefully if
         multiple clients are pushing changes to the same files being modified by the handler function.
 
-        :param onChangeSourceHandlerFunc: Functional handler that does the actual source code file modifications.
+        :param onChangeSourceHandlerFunc: Functional handler that does the actual source code file modifications. It is passed the path of the checkout to modify: the local repository, or the worktree with change_in_worktree.
         :param target_branct: The GIT branch to promote the file changes too.
         :param commit_msg: The message to include in the GIT commit representing the file changes.
 
@@ -45,53 +110,51 @@ class AutoCodePromote(object):
         push_successful = False
 
         # Create temporary branch off the target branch.
-        self.git.gotoBranch(target_branch)
-        self.git.createBranch(tmp_local_banch_name)
-        self.git.gotoBranch(tmp_local_banch_name)
-
-        onChangeSourceHandlerFunc(self.local_git_repo)
-
-        modfiles = self.git.status("modified")
-        if len(modfiles) > 0:
-            self.git.addFile()
-            logger.info("Committing local file modifications...")
-            self.git.commit(commit_msg)
-            commit_hash = self.git.getCurrentRevision()
+        self.git.update()
+        try:
+            change, change_path = self._change_checkout(target_branch, tmp_local_banch_name)
 
-            #merge back to target target_branch.
-            logger.info("Merging local file modifications to branch {}...".format(target_branch))
-            self.git.gotoBranch(target_branch)
-            self.git.merge(tmp_local_banch_name)
-            if ff_ancestor_branch_set:
-                logger.info("Merging local file modifications to branch {}...".format(ff_ancestor_branch))
-                self.git.gotoBranch(ff_ancestor_branch)
-                self.git.merge(tmp_local_banch_name)
+            onChangeSourceHandlerFunc(change_path)
 
+            modfiles = change.status("modified")
+            if len(modfiles) > 0:
+                change.addFile()
+                logger.info("Committing local file modifications...")
+                change.commit(commit_msg)
+                commit_hash = change.getCurrentRevision()
+        finally:
+            self._release_worktrees()
 
+        if len(modfiles) > 0:
             for i in range(0, self.promote_retry_count):
                 try:
-                    logger.info("Pulling target branches locally to pick up remote commits...")
+                    logger.info("Fetching target branches to pick up remote commits...")
+                    self.git.update()
 
                     # The file modifications should cause NO merge conflicts.
-                    self.git.gotoBranch(target_branch)
-                    self.git.updateAndMerge()
-                    if ff_ancestor_branch_set:
-                        self.git.gotoBranch(ff_ancestor_branch)
-                        self.git.updateAndMerge()
-
-                    logger.info("Pushing to remote origin attempt {}/{}...".format((i+1), self.promote_retry_count))
-
-                    if ff_ancestor_branch_set:
-                        # Update/merge operations are atomic.  Either we update both, or we don't update at all.
-                        self.git.runRawCommand(["push", "--atomic", "origin", target_branch, ff_ancestor_branch])
-                    else:
-                        self.git.runRawCommand(["push", "--atomic", "origin", target_branch])
+                    logger.info("Merging local file modifications to branch {}...".format(target_branch))
+                    # Update/merge operations are atomic.  Either we update both, or we don't update at all.
+                    # Each branch is only updated if origin still has the commit the merge was made on.
+                    with self.git.refTransaction(push=True, local=False) as refs:
+                        target = self._worktree("merge_" + target_branch, "origin/" + target_branch)
+                        target.merge(commit_hash)
+                        refs.update("refs/heads/" + target_branch, target.getCurrentRevision(), old="origin/" + target_branch)
+                        if ff_ancestor_branch_set:
+                            logger.info("Merging local file modifications to branch {}...".format(ff_ancestor_branch))
+                            ff_ancestor = self._worktree("merge_" + ff_ancestor_branch, "origin/" + ff_ancestor_branch)
+                            ff_ancestor.merge(commit_hash)
+                            refs.update("refs/heads/" + ff_ancestor_branch, ff_ancestor.getCurrentRevision(),
+                                        old="origin/" + ff_ancestor_branch)
+
+                        logger.info("Pushing to remote origin attempt {}/{}...".format((i+1), self.promote_retry_count))
 
                     push_successful = True
                     logger.info("Remote origin push successful.")
                     break
                 except ScmError as e:
                     logger.error("The following error was encountered while pushing the file modifications to remote origin: {}".format(e.msg))
+                finally:
+                    self._release_worktrees()
 
 
         else:
@@ -8,22 +8,26 @@ import sys
 import argparse
 
 from scmlib.errors import ScmError
+from scmlib import workspaces
 from bambooci.exception import PassThroughException
 from bambooci import utils
 
 logger = utils.get_logger("checkoutSubmoduleBranch")
 
-def main(local_parent_repo_dir, parent_repo_commit_hash, parent_repo_url, submodule_mount_dir, submodule_commit_hash):
+def main(local_parent_repo_dir, parent_repo_commit_hash, parent_repo_url, submodule_mount_dir, submodule_commit_hash, mirror_cache=None, clone_options=None):
     if not os.path.isdir(local_parent_repo_dir):
         os.makedirs(local_parent_repo_dir)
     
     try:
         git = utils.get_git_scm(local_parent_repo_dir, remoterepo=parent_repo_url, config_init=False)
-        logger.info("Cloning {}...".format(parent_repo_url))
-        git.clone()
-        
-        logger.info("Checking out parent repository revision {}...".format(parent_repo_commit_hash))
-        git.gotoRevision(parent_repo_commit_hash)
+        if mirror_cache:
+            git.setMirrorCache(mirror_cache)
+        if clone_options:
+            git.setCloneOptions(**clone_options)
+        #a previous clone in the directory is reset to the revision (fetch, forced checkout, clean) instead of cloned again
+        logger.info("Checking out {} at parent repository revision {}...".format(parent_repo_url, parent_repo_commit_hash))
+        if workspaces.checkoutWorkspace(git, parent_repo_commit_hash):
+            logger.info("Reused the existing clone in {}".format(local_parent_repo_dir))
         
         if not os.path.isdir(submodule_mount_dir):
             logger.error("The expected submodule path {} does not exist.".format(submodule_mount_dir))
@@ -44,6 +48,8 @@ if __name__ == '__main__':
     parser.add_argument('--parent_commit_hash', required=True, help='The commit hash to checkout in the parent repository.')
     parser.add_argument('--local_submodule_path', required=True, help='Full path to the expected submodule mount within the parent repository.')
     parser.add_argument('--submodule_commit_hash', required=True, help='The commit hash to checkout in the mounted submodule.')
+    parser.add_argument('--mirror_cache', required=False, help='Shared directory of bare mirrors to clone the parent repository from.')
+    utils.add_clone_arguments(parser)
     
     args = parser.parse_known_args()[0]
 
@@ -53,7 +59,9 @@ if __name__ == '__main__':
              args.parent_commit_hash, 
              args.parent_repo_url, 
              args.local_submodule_path, 
-             args.submodule_commit_hash)
+             args.submodule_commit_hash,
+             args.mirror_cache,
+             utils.get_clone_options(args))
         exit_code = 0
     except PassThroughException:
         pass
@@ -9,6 +9,10 @@ import shutil
 import argparse
 import error
 
+from scmlib.git import GitScm
+from scmlib.errors import ScmError
+from scmlib import workspaces
+
 #####################################################################################################################################################################################################################
 #
 # Intel Corporation - Copyright 2016
@@ -43,6 +47,7 @@ parser.add_argument('--artifactory_pswd', required=True, help='Artifactory user
 parser.add_argument('-s','--artifactory_url', default='https://ubit-artifactory-or.intel.com/artifactory/', help='Artifactory URL to use')
 parser.add_argument('-o', '--out', default='C:\\temp', help='Location where binaries should be placed in')
 parser.add_argument('-e', '--env', default='DEV', help='Environment, e.g. DEV or PROD to execute this script in')
+parser.add_argument('--mirror_cache', default=None, help='Shared directory of bare mirrors; when set we pull from a local mirror of the repo instead of the network')
 args = vars(parser.parse_args())
 
 GIT_USER = args['git_user']  #this is used for REST API call
@@ -57,6 +62,7 @@ ARTIFACTORY_USER = args['artifactory_user'] #user login for artifactory
 ARTIFACTORY_PSWD = args['artifactory_pswd'] # URL encoding friendly string for the above user
 OUTPUT_PATH = args['out'] #we need to post the collateral from the retrieved artifacts in the network share for yet.py to consume
 ENVIRONMENT = args['env'] #environment we are using (DEV or PROD)
+MIRROR_CACHE = args['mirror_cache'] #shared mirror directory, concurrent builds on the host fetch the remote only once
 
 #--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 # END ARGUMENTS
@@ -129,36 +135,44 @@ def RunCommand(command):
 #
 # def Clone()
 #
-# Description: This method takes no parameters and performs a shallow clone of the branch and repo we need in order to checkout 
-# and build the source code. We get to this point if we are unable to download artifacts from artifactory
+# Description: This method takes no parameters and performs a shallow clone (through scmlib) of the branch and repo we need in order 
+# to checkout and build the source code, or resets the previous clone left in the working directory. We get to this point if we 
+# are unable to download artifacts from artifactory
 #
 #--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 def Clone():
 
-	try:
-		print ("DEBUG - Cleaning Current Directory: " + os.getcwd())
-		CleanDir()
-	except:
-		print ("DEBUG - cloning failed")
-		raise
+	git = GitScm(os.getcwd(), remoterepo=GIT_URL)
+
+	#a previous clone of the repo is reset in place (fetch, forced checkout, clean) instead of wiped and cloned again
+	if not workspaces.isCloneOf(git):
+		try:
+			print ("DEBUG - Cleaning Current Directory: " + os.getcwd())
+			CleanDir()
+		except:
+			print ("DEBUG - cloning failed")
+			raise
 
 	try:
-		#we'll do a shallow clone by creating a local repo - this is faster than cloning the entire thing
-		print ("DEBUG - git init .")
-		RunCommand("git init .")
+		#we'll do a shallow clone of the branch we are working on - this is faster than cloning the entire thing
+		git.setCloneOptions(depth=1, branch=CURRENT_BRANCH, singleBranch=True)
+
+		#with a mirror cache the objects come from a local mirror of the repo (only one build at a time fetches it)
+		if MIRROR_CACHE:
+			git.setMirrorCache(MIRROR_CACHE)
 
 		#we're gonna ignore self-signed certificates
 		print ("DEBUG - git config --global http.sslVerify false")
-		RunCommand("git config --global http.sslVerify false")
-	
-		#we pull what we need from the branch that we are working on
-		print ("DEBUG - git pull --depth 1 " + GIT_URL + " " + CURRENT_BRANCH)
-		RunCommand("git pull --depth 1 " + GIT_URL + " " + CURRENT_BRANCH)
-	
-		#we pull subrepos - bening if none exist
-		print ("DEBUG - git submodule update --init")
-		RunCommand("git submodule update --init")
-	
+		git.runRawCommand(['config', '--global', 'http.sslVerify', 'false'])
+
+		#we check out the branch that we are working on, along with the subrepos - benign if none exist
+		print ("DEBUG - checking out branch " + CURRENT_BRANCH + " with depth 1")
+		if workspaces.checkoutWorkspace(git, CURRENT_BRANCH):
+			print ("DEBUG - reused the existing clone")
+
+	except ScmError as e:
+		print ("DEBUG - cloning failed: " + str(e))
+		raise
 	except:
 		print ("DEBUG - cloning failed")
 		raise
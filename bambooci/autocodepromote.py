@@ -4,35 +4,100 @@ Created on Mar 13, 2018
 @author: nseden
 '''
 
+import os
+import re
+
 from bambooci import utils
 from scmlib.errors import ScmError
+from scmlib.filelock import FileLock
 from bambooci.exception import PassThroughException
 
 logger = utils.get_logger("autocodepromote")
 
 class AutoCodePromote(object):
     
-    def __init__(self, local_git_repo, disable_lfs=False, promote_retry_count=3):
+    def __init__(self, local_git_repo, disable_lfs=False, promote_retry_count=3, worktree_root=None, change_in_worktree=False):
         self.local_git_repo = local_git_repo
         self.git = utils.get_git_scm(local_git_repo, config_init=True)
         self.promote_retry_count = promote_retry_count
         
+        # Linked worktrees of the repository the merges are made in, one per branch and reused between runs.
+        # With change_in_worktree, the change is made in one as well instead of in the main checkout, and the handler
+        # gets the worktree path: handlers must then only write under the path they are passed.
+        self.change_in_worktree = change_in_worktree
+        if worktree_root is None:
+            worktree_root = os.path.abspath(local_git_repo).rstrip("\\/") + "_worktrees"
+        self.worktree_root = worktree_root
+        self.worktree_locks = []
+        
         if disable_lfs:
             # Local command, not catching exceptions
             logger.info("Disabling LFS hooks...")
             self.git.runRawCommand(['lfs', 'uninstall'])
             
+    def _worktree(self, name, revision, branch=None, submodules=False):
+        """
+        Creates or reuses the linked worktree 'name' checked out at revision and locks it until _release_worktrees.
+        A promotion using the same worktree in another process is waited for.
+        
+        :return: GitScm for the worktree
+        """
+        path = os.path.join(self.worktree_root, re.sub(r"[^A-Za-z0-9._-]+", "_", name))
+        lock = FileLock(path + ".lock")
+        lock.acquire()
+        try:
+            # The file lock is released if a process dies, the git lock (which keeps the worktree from being pruned) is not.
+            try:
+                self.git.unlockWorktree(path)
+            except ScmError:
+                pass
+            worktree = self.git.getWorktree(path, revision, branch=branch, lock="autocodepromote pid {}".format(os.getpid()),
+                                            submodules=submodules)
+        except:
+            lock.release()
+            raise
+        self.worktree_locks.append((path, lock))
+        return worktree
+        
+    def _change_checkout(self, target_branch, branch):
+        """
+        Checks out 'branch' at origin's target_branch where the change is made: a linked worktree with change_in_worktree,
+        otherwise the main checkout (left on that branch afterwards).
+
+        :return: GitScm and path of the checkout to change
+        """
+        if self.change_in_worktree:
+            change = self._worktree("change_" + target_branch, "origin/" + target_branch, branch=branch, submodules=True)
+            return change, change.localpath
+        self.git.runRawCommand(["checkout", "--no-track", "-B", branch, "origin/" + target_branch])
+        self.git.gotoBranch(branch)
+        return self.git, self.local_git_repo
+
+    def _release_worktrees(self):
+        for path, lock in self.worktree_locks:
+            try:
+                self.git.unlockWorktree(path)
+            except ScmError as e:
+                logger.warning("Unable to unlock worktree {}: {}".format(path, e.msg))
+            lock.release()
+        self.worktree_locks = []
+            
     def promote_change(self, onChangeSourceHandlerFunc, target_branch, commit_msg, ff_ancestor_branch=None, tmp_banch_prefix="tmp"):
         """
         Promotes a set of file modifications to the target branch with the option of additionally merging the change to a GIT fast-forward branch.
         
-        :param onChangeSourceHandlerFunc: Functional handler that does the actual source code file modifications.
+        The merges are made in linked worktrees of the repository (one per branch, see worktree_root) rather than by switching the main
+        checkout between branches. The change is made in the main checkout, switched to the temporary branch, unless change_in_worktree is
+        set: the change is then made in a worktree too, so the main checkout is left alone and promotions to other target branches can run
+        at the same time. The merges into the target and ff ancestor branches of one promotion still run one after the other.
+        
+        :param onChangeSourceHandlerFunc: Functional handler that does the actual source code file modifications. It is passed the path of the checkout to modify: the local repository, or the worktree with change_in_worktree.
         :param target_branct: The GIT branch to promote the file changes too.
         :param commit_msg: The message to include in the GIT commit representing the file changes.
         
         :param ff_ancestor_branch: Optional parameter specifying an additional branch to promote the change too.  Used common in repositories that fast-forward
         from an integration branch to a stable\release branch.
-        :param tmp_banch_prefix: Local name of branch used to do the actual file modifications on.
+        :param tmp_banch_prefix: Prefix of the local branch used to do the actual file modifications on.
         
         """
         
@@ -44,48 +109,36 @@ class AutoCodePromote(object):
         for i in range(0, self.promote_retry_count):
             logger.info("Updating repository files attempt {}/{}".format((i+1), self.promote_retry_count))
             
-            target_branch_merged = False
-            ff_ancestor_branch_merged = False
-            
             try:
-                tmp_branch = "{}_{}".format(tmp_banch_prefix, i)
-                
-                # Pull latest changes from origin
-                self.git.gotoBranch(target_branch)
-                self.git.createBranch(tmp_branch)
-                self.git.gotoBranch(tmp_branch)
-            
+                tmp_branch = "{}_{}".format(tmp_banch_prefix, target_branch)
                 
-                onChangeSourceHandlerFunc(self.local_git_repo)
+                # Pull latest changes from origin, the worktrees share the repository's objects and refs
+                self.git.update()
+                change, change_path = self._change_checkout(target_branch, tmp_branch)
                 
+                onChangeSourceHandlerFunc(change_path)
                 
-                modfiles = self.git.status("modified")
+                modfiles = change.status("modified")
                 if len(modfiles) > 0:
-                    self.git.addFile()
+                    change.addFile()
                     logger.info("Committing local revision update.")
-                    self.git.commit(commit_msg)
+                    change.commit(commit_msg)
                     logger.info("Local revision update committed.")
                     
-                    commit_hash = self.git.getCurrentRevision()
+                    commit_hash = change.getCurrentRevision()
                     
-                    #merge back to target target_branch.
-                    self.git.gotoBranch(target_branch)
-                    self.git.updateAndMerge()  #to fix issues with merge conflicts when pushing to master
-                    self.git.merge(tmp_branch)
-                    target_branch_merged = True
-                    
-                    if ff_ancestor_branch_set:
-                        #try to merge into git ff ancestor target_branch
-                        self.git.gotoBranch(ff_ancestor_branch)
-                        self.git.updateAndMerge()
-                        self.git.merge(tmp_branch)
-                        ff_ancestor_branch_merged = True
-                    
-                    if ff_ancestor_branch_set:
-                        # Update/merge operations are atomic.  Either we update both, or we don't update at all.                
-                        self.git.runRawCommand(["push", "--atomic", "origin", target_branch, ff_ancestor_branch])
-                    else:
-                        self.git.runRawCommand(["push", "--atomic", "origin", target_branch])
+                    # Update/merge operations are atomic.  Either we update both, or we don't update at all.
+                    # Each branch is only updated if origin still has the commit the change or merge was made on.
+                    with self.git.refTransaction(push=True, local=False) as refs:
+                        #the change is on top of origin's target_branch, so it is pushed to it as is.
+                        refs.update("refs/heads/" + target_branch, commit_hash, old="origin/" + target_branch)
+                        
+                        if ff_ancestor_branch_set:
+                            #try to merge into git ff ancestor target_branch
+                            ff_ancestor = self._worktree("merge_" + ff_ancestor_branch, "origin/" + ff_ancestor_branch)
+                            ff_ancestor.merge(commit_hash)
+                            refs.update("refs/heads/" + ff_ancestor_branch, ff_ancestor.getCurrentRevision(),
+                                        old="origin/" + ff_ancestor_branch)
                         
                     merge_successful = True
                     
@@ -97,17 +150,11 @@ class AutoCodePromote(object):
             except ScmError as e:
                 logger.error("SCM exception caught: {}".format(e.msg))
                 
-                # Reset the integration branches back to original state.  
-                # Both should either be updated or not updated together.
-                if ff_ancestor_branch_merged:
-                    self.git.gotoBranch(ff_ancestor_branch)
-                    self.git.runRawCommand(["reset", "--hard", "HEAD~1"])
-                    
-                if target_branch_merged:
-                    self.git.gotoBranch(target_branch)
-                    self.git.runRawCommand(["reset", "--hard", "HEAD~1"])
-            
-            if not merge_successful:
-                raise Exception()
+                # Nothing to reset: the branches were only merged in the worktrees, which are reset on the next attempt.
+            finally:
+                self._release_worktrees()
             
-            return commit_hash
\ No newline at end of file
+        if not merge_successful:
+            raise Exception()
+        
+        return commit_hash
\ No newline at end of file
@@ -13,22 +13,26 @@ import sys
 import argparse
 
 from scmlib.errors import ScmError
+from scmlib import workspaces
 from bambooci.exception import PassThroughException
 from bambooci import utils
 
 logger = utils.get_logger("clone_git_repo")
 
-def main(local_repo_path, repo_url, commit_hash):
+def main(local_repo_path, repo_url, commit_hash, mirror_cache=None, clone_options=None):
     if not os.path.isdir(local_repo_path):
         os.makedirs(local_repo_path)
     
     try:
         git = utils.get_git_scm(local_repo_path, remoterepo=repo_url, config_init=False)
-        logger.info("Cloning {}...".format(repo_url))
-        git.clone()
-        
-        logger.info("Checking out repository revision {}...".format(commit_hash))
-        git.gotoRevision(commit_hash)
+        if mirror_cache:
+            git.setMirrorCache(mirror_cache)
+        if clone_options:
+            git.setCloneOptions(**clone_options)
+        #a previous clone in the directory is reset to the revision (fetch, forced checkout, clean) instead of cloned again
+        logger.info("Checking out {} at revision {}...".format(repo_url, commit_hash))
+        if workspaces.checkoutWorkspace(git, commit_hash):
+            logger.info("Reused the existing clone in {}".format(local_repo_path))
     except ScmError, e:
         logger.error("The following unexpected exception occurred while cloning the repository:\n{}".format(e.msg))
         raise PassThroughException()
@@ -38,6 +42,8 @@ if __name__ == '__main__':
     parser.add_argument('--local_repo_path', required=True, help='Local path where the repository should clone too.')
     parser.add_argument('--repo_url', required=True, help='The clone URL of the repository.')
     parser.add_argument('--commit_hash', required=False, help='The commit hash (or branch) to checkout.')
+    parser.add_argument('--mirror_cache', required=False, help='Shared directory of bare mirrors to clone from (fetched once per remote).')
+    utils.add_clone_arguments(parser)
     
     args = parser.parse_known_args()[0]
 
@@ -45,7 +51,9 @@ if __name__ == '__main__':
     try:
         main(args.local_repo_path, 
              args.repo_url, 
-             args.commit_hash)
+             args.commit_hash,
+             args.mirror_cache,
+             utils.get_clone_options(args))
         exit_code = 0
     except PassThroughException:
         pass
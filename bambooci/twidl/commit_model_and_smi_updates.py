@@ -5,6 +5,8 @@ Created on Mar 13, 2018
 '''
 
 import argparse
+import glob
+import os
 import sys
 
 from scmlib.errors import ScmError
@@ -13,51 +15,78 @@ from bambooci.exception import PassThroughException
 
 PUSH_RETRY = 3
 MODEL_FILE_PATH = "drive_detect.xml"
+SMI_FILE_PATTERNS = ["data/SMI/*.ini", "data/SMI/*.dat"]
 
 logger = utils.get_logger("commit_model_updates")
 
+def read_files(git, patterns):
+    '''
+    Reads the files matching the patterns from the working tree, for GitScm.commitFiles.
+    Tracked files matching the patterns which are no longer on disk are mapped to None (deleted).
+    @return: dict of repo relative path to file contents
+    '''
+    files = {}
+    tracked = git.runRawCommand(['ls-files', '-z', '--'] + patterns).split("\0")
+    for path in tracked:
+        if path and not os.path.exists(os.path.join(git.localpath, path)):
+            files[path] = None
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(git.localpath, pattern)):
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, git.localpath).replace(os.sep, "/")] = f.read()
+    return files
+
 def main(local_git_repo, model_update_commit_msg, smi_files_update_commit_msg):
     try:
         git = utils.get_git_scm(local_git_repo)
         git.setDebug(True)
-        should_push_changes = False
         
         # Required for passwordless pushes over SSH!
         git.runRawCommand(['lfs', 'uninstall'])
         
-        git.addFile(MODEL_FILE_PATH)
-        if len(git.status("modified")) > 0:
-            git.commit(model_update_commit_msg)
-            should_push_changes = True
-        else:
-            logger.info("No changes detected to file {}.".format(MODEL_FILE_PATH))
-            
-        git.addFile(r"data/SMI/\*.ini")
-        git.addFile(r"data/SMI/\*.dat")
-        if len(git.status("modified")) > 0:
-            git.commit(smi_files_update_commit_msg)
-            should_push_changes = True
-        else:
-            logger.info("No changes detected to SMI files.")
-            
-        if should_push_changes:
-            push_success = False
-            
-            for i in range(0, PUSH_RETRY):
-                try:
-                    logger.info("Pushing model file and SMI file updates to origin attempt {}/{}".format((i+1), PUSH_RETRY))
-                    # We expect no merge conflicts against the file this process updates.
-                    git.updateAndMerge()
-                    git.push()
+        # The commits are built from the files on disk on top of origin's branch, without touching the index or
+        # the working tree, and pushed only if nobody pushed in between, so a retry never needs a merge.
+        # The checked out branch is moved to the new commits, the index is synced with it at the end.
+        branch = git.getCurrentBranch()
+        if branch == "HEAD":
+            logger.error("The repository is not on a branch, not committing the model and SMI file updates.")
+            raise PassThroughException()
+        model_files = read_files(git, [MODEL_FILE_PATH])
+        smi_files = read_files(git, SMI_FILE_PATTERNS)
+        push_success = False
+        committed = False
+        
+        for i in range(0, PUSH_RETRY):
+            try:
+                git.runRawCommand(['fetch', '--quiet', 'origin', branch])
+                upstream = "origin/" + branch
+                model_commit = git.commitFiles(branch, model_files, model_update_commit_msg, parent=upstream)
+                if model_commit is None:
+                    logger.info("No changes detected to file {}.".format(MODEL_FILE_PATH))
+                smi_commit = git.commitFiles(branch, smi_files, smi_files_update_commit_msg,
+                                             parent=model_commit or upstream)
+                if smi_commit is None:
+                    logger.info("No changes detected to SMI files.")
+                if model_commit is None and smi_commit is None:
                     push_success = True
                     break
-                except ScmError as e:
-                    logger.error("SCM exception caught: {}".format(e.msg))
-                    
-            if not push_success:
-                raise PassThroughException()
-            
-            logger.info("Successfully pushed updated files to origin.  Exiting.")
+                committed = True
+                
+                logger.info("Pushing model file and SMI file updates to origin attempt {}/{}".format((i+1), PUSH_RETRY))
+                git.pushBranch(branch)
+                push_success = True
+                logger.info("Successfully pushed updated files to origin.  Exiting.")
+                break
+            except ScmError as e:
+                logger.error("SCM exception caught: {}".format(e.msg))
+        
+        if committed:
+            # The working tree already has the committed contents: only the index still has the old ones, which would
+            # show the update as reverted and undo it on the next commit in this workspace.
+            git.runRawCommand(['reset', '--quiet', '--mixed', branch])
+                
+        if not push_success:
+            raise PassThroughException()
     except ScmError as e:
         logger.error("SCM exception caught: {}".format(e))
         raise e
@@ -53,3 +53,37 @@ def get_git_scm(local_repo_path=os.getcwd(), remoterepo=None, config_init=True):
         ret_val.runRawCommand(['config', 'user.email', 'sys_nsgCIAutomation@intel.com'])
     
     return ret_val
+
+
+def add_clone_arguments(parser):
+    '''
+    Adds the arguments selecting a shallow, partial or sparse clone (see get_clone_options) to an argparse parser.
+    '''
+    parser.add_argument('--depth', type=int, required=False, help='Only clone the last N commits (checking out an older commit fetches it).')
+    parser.add_argument('--filter', required=False, help='Partial clone filter, e.g. blob:none or tree:0.')
+    parser.add_argument('--single_branch', action='store_true', help='Only clone the default branch.')
+    parser.add_argument('--sparse', nargs='+', required=False, help='Only check out these directories (plus the top level files).')
+    parser.add_argument('--shallow_submodules', action='store_true', help='Clone the submodules with a depth of 1.')
+    parser.add_argument('--submodule_filter', action='append', required=False,
+                        help='Partial clone filter for all submodules (e.g. blob:none), or path=filter for one submodule (repeatable).')
+
+
+def get_clone_options(args):
+    '''
+    @return: dict of keyword arguments for GitScm.setCloneOptions from the arguments added by add_clone_arguments
+    '''
+    submodule_filter = None
+    for value in args.submodule_filter or []:
+        path, sep, spec = value.partition('=')
+        if sep:
+            if not isinstance(submodule_filter, dict):
+                submodule_filter = {}
+            submodule_filter[path.strip('/')] = spec
+        else:
+            submodule_filter = value
+    return dict(depth=args.depth,
+                filter=args.filter,
+                singleBranch=args.single_branch,
+                sparse=args.sparse,
+                shallowSubmodules=args.shallow_submodules,
+                submoduleFilter=submodule_filter)
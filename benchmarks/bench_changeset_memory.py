@@ -0,0 +1,81 @@
+'''
+Memory benchmark of the changeset records returned by log: the eager dictionaries scmlib used to build
+against the lazy changeset.Changeset objects. Builds synthetic changesets (1M by default) both ways,
+measures the allocated memory with tracemalloc and reports the bytes per changeset and the total per 1M.
+The Changeset figures are given before and after reading the derived date fields of every changeset.
+
+usage: python benchmarks/bench_changeset_memory.py [--count N]
+'''
+import argparse
+import datetime
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from scmlib.basescm import BaseScm
+from scmlib.changeset import Changeset
+
+START = 1262304000
+
+'''
+Build a changeset dictionary the way the log parsers used to, computing every date field up front
+'''
+def eagerChangeset(i):
+    dobj = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=START + i * 1020 - 25200)
+    dobj_aligned = BaseScm.alignTimestamp(dobj)
+    return {
+        'hash': "%040x" % i,
+        'parents': ["%040x" % (i - 1)],
+        'idsid': "Doe, John",
+        'timestamp': str(dobj),
+        'date': dobj.strftime("%a %b %d %H:%M:%S %Y"),
+        'iso': dobj.isocalendar(),
+        'ts_aligned': str(dobj_aligned),
+        'iso_aligned': dobj_aligned.isocalendar(),
+        'message': "change {0}".format(i),
+    }
+
+def lazyChangeset(i):
+    return Changeset("%040x" % i, ["%040x" % (i - 1)], "Doe, John", START + i * 1020, -25200, "change {0}".format(i))
+
+'''
+Returns the number of bytes still allocated after calling func, along with its result
+'''
+def measure(func):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+def report(name, size, count):
+    print("{0:<28} {1:8.1f} bytes/changeset {2:10.1f} MB per 1M".format(name, float(size) / count, size * 1000000.0 / count / (1024 * 1024)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the memory used by changeset records")
+    parser.add_argument("--count", type=int, default=1000000, help="number of changesets to build")
+    args = parser.parse_args()
+    count = args.count
+
+    size, eager = measure(lambda: [eagerChangeset(i) for i in range(count)])
+    report("dict (eager)", size, count)
+    del eager
+
+    size, lazy = measure(lambda: [lazyChangeset(i) for i in range(count)])
+    report("Changeset", size, count)
+
+    #reading the date views caches the broken down time in each object; the strings are built per access
+    def touch():
+        for changeset in lazy:
+            changeset['iso_aligned']
+    extra, result = measure(touch)
+    report("Changeset (dates read)", size + extra, count)
+
+if __name__ == "__main__":
+    main()
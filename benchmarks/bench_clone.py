@@ -0,0 +1,119 @@
+'''
+Benchmark of the GitScm.clone modes (see GitScm.setCloneOptions): a full clone, a shallow clone (depth 1), blobless
+and treeless partial clones, a single branch clone and a sparse checkout of one directory of a blobless clone.
+Reports the best clone time of each mode and the disk used by the clone (working tree and git directory).
+Clones a generated repo (2000 commits touching 2000 files in 20 directories, on 10 branches) over file:// unless
+--url is given, so the server side (upload-pack) does the same work as for a remote.
+
+usage: python benchmarks/bench_clone.py [--commits N] [--files N] [--url URL] [--sparse DIR] [--repeat N]
+'''
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from scmlib.git import GitScm
+
+#clone modes measured: name and GitScm.setCloneOptions arguments ("sparse" is filled in from --sparse)
+MODES = [
+    ("full", {}),
+    ("depth=1", {'depth': 1}),
+    ("blob:none", {'filter': "blob:none"}),
+    ("tree:0", {'filter': "tree:0"}),
+    ("single branch", {'singleBranch': True}),
+    ("sparse+blob:none", {'filter': "blob:none", 'sparse': None}),
+]
+
+'''
+Create a repo where each of 'commits' commits rewrites a few of 'files' files spread over 20 directories, with
+10 branches pointing along the history. Uses fast-import so large histories are built quickly.
+'''
+def buildRepo(path, commits, files):
+    subprocess.check_call(['git', 'init', '-q', path])
+    subprocess.check_call(['git', 'config', 'uploadpack.allowFilter', 'true'], cwd=path)
+    stream = []
+    for i in range(commits):
+        stream.append("commit refs/heads/master\n")
+        stream.append("committer bench <bench@example.com> {0} +0000\n".format(1500000000 + i * 60))
+        stream.append("data 10\ncommit {0:03d}\n".format(i % 1000))
+        touched = range(files) if i == 0 else [(i * 7 + k * 131) % files for k in range(5)]
+        for f in touched:
+            content = "file {0} revision {1}\n".format(f, i) * 40
+            stream.append("M 644 inline dir{0:02d}/f{1}.txt\ndata {2}\n{3}\n".format(f % 20, f, len(content), content))
+        if (i + 1) % max(1, commits // 10) == 0:
+            stream.append("reset refs/heads/branch{0}\nfrom refs/heads/master\n\n".format(i * 10 // commits))
+    importer = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=path, stdin=subprocess.PIPE)
+    importer.communicate("".join(stream).encode('utf-8'))
+    if importer.returncode != 0:
+        raise RuntimeError("git fast-import failed")
+    subprocess.check_call(['git', 'checkout', '-q', 'master'], cwd=path)
+
+'''
+Returns the number of bytes used by the files under 'path', split into the working tree and the .git directory
+'''
+def diskUsage(path):
+    tree = gitdir = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        size = sum(os.lstat(os.path.join(dirpath, name)).st_size for name in filenames)
+        if os.path.relpath(dirpath, path).split(os.sep)[0] == ".git":
+            gitdir += size
+        else:
+            tree += size
+    return tree, gitdir
+
+'''
+Run func 'repeat' times and return the best time in seconds along with its result
+'''
+def timeCall(func, repeat):
+    best = None
+    result = None
+    for i in range(repeat):
+        timer = timeit.default_timer()
+        result = func()
+        elapsed = timeit.default_timer() - timer
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GitScm.clone modes")
+    parser.add_argument("--commits", type=int, default=2000, help="number of commits in the generated repo")
+    parser.add_argument("--files", type=int, default=2000, help="number of files in the generated repo")
+    parser.add_argument("--url", help="clone an existing repo instead of generating one")
+    parser.add_argument("--sparse", default="dir00", help="directory checked out by the sparse mode")
+    parser.add_argument("--repeat", type=int, default=3, help="number of clones per mode (best is reported)")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_clone")
+    url = args.url
+    try:
+        if url is None:
+            repo = os.path.join(tmpdir, "repo")
+            print("generating {0} commits of {1} files in {2}".format(args.commits, args.files, repo))
+            buildRepo(repo, args.commits, args.files)
+            url = "file://" + repo.replace(os.sep, "/")
+
+        print("{0:18} {1:>9} {2:>12} {3:>12}".format("mode", "time", "worktree", "git dir"))
+        for name, options in MODES:
+            options = dict(options)
+            if 'sparse' in options:
+                options['sparse'] = [args.sparse]
+            target = os.path.join(tmpdir, "clone")
+            def cloneOnce():
+                shutil.rmtree(target, ignore_errors=True)
+                scm = GitScm(target, remoterepo=url)
+                scm.setCloneOptions(**options)
+                scm.clone()
+                return diskUsage(target)
+            elapsed, (tree, gitdir) = timeCall(cloneOnce, args.repeat)
+            print("{0:18} {1:8.3f}s {2:10.1f}MB {3:10.1f}MB".format(name, elapsed, tree / 1048576.0, gitdir / 1048576.0))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
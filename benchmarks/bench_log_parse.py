@@ -0,0 +1,127 @@
+'''
+Benchmark of the git log parsers: the NUL separated machine format used by GitScm (see git.LOG_FORMAT)
+against the previous line based parser of the '--format=medium' output.
+Builds a synthetic history with 'git fast-import' (100k commits by default) unless --repo is given,
+captures the log output once in both formats and reports the commits parsed per second.
+
+usage: python benchmarks/bench_log_parse.py [--commits N] [--repo PATH] [--repeat N]
+'''
+import argparse
+import datetime
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from scmlib.basescm import BaseScm
+from scmlib.git import GitScm
+
+'''
+The line based '--format=medium' parser GitScm used before the machine format, kept here as the baseline
+'''
+def parseMedium(output):
+    changesets = []
+    changeset = None
+    for line in output.splitlines():
+        line = line.rstrip()
+        if line.startswith("commit "):
+            if changeset is not None:
+                changesets.append(changeset)
+            ids = line[len("commit "):].strip().split()
+            changeset = dict()
+            changeset['hash'] = ids[0]
+            changeset['parents'] = [p for p in ids if p != ids[0]]
+        elif line.startswith("Author: "):
+            changeset['idsid'] = line[len("Author: "):].strip().split("<")[0].strip()
+        elif line.startswith("Date: "):
+            dstr = line[len("Date: "):].strip()[:-5].strip()
+            dobj = datetime.datetime.strptime(dstr, "%a %b %d %H:%M:%S %Y")
+            dobj_aligned = BaseScm.alignTimestamp(dobj)
+            changeset['timestamp'] = str(dobj)
+            changeset['date'] = dstr
+            changeset['iso'] = dobj.isocalendar()
+            changeset['ts_aligned'] = str(dobj_aligned)
+            changeset['iso_aligned'] = dobj_aligned.isocalendar()
+        else:
+            line = line.strip()
+            if len(line) > 0:
+                changeset['message'] = line
+    if changeset is not None:
+        changesets.append(changeset)
+    return changesets
+
+'''
+Create a repo with a linear history of 'count' commits (one every 17 minutes, alternating timezones)
+'''
+def buildRepo(path, count):
+    subprocess.check_call(['git', 'init', '-q', path])
+    proc = subprocess.Popen(['git', 'fast-import', '--quiet'], stdin=subprocess.PIPE, cwd=path)
+    start = 1262304000
+    for i in range(count):
+        tz = "-0700" if i % 2 == 0 else "+0530"
+        message = "change {0}\n\ndetails for change {0}\n".format(i).encode('utf-8')
+        data = "line {0}\n".format(i).encode('utf-8')
+        cmd = b"commit refs/heads/master\n"
+        cmd += "author Doe, John <jdoe@example.com> {0} {1}\n".format(start + i * 1020, tz).encode('utf-8')
+        cmd += "committer Doe, John <jdoe@example.com> {0} {1}\n".format(start + i * 1020, tz).encode('utf-8')
+        cmd += b"data " + str(len(message)).encode('utf-8') + b"\n" + message
+        cmd += b"M 644 inline file.txt\ndata " + str(len(data)).encode('utf-8') + b"\n" + data + b"\n"
+        proc.stdin.write(cmd)
+    proc.stdin.close()
+    if proc.wait() != 0:
+        raise RuntimeError("git fast-import failed")
+    subprocess.check_call(['git', 'symbolic-ref', 'HEAD', 'refs/heads/master'], cwd=path)
+
+'''
+Run the parser 'repeat' times and return the best time in seconds along with the parsed changesets
+'''
+def timeParser(parser, output, repeat):
+    best = None
+    result = None
+    for i in range(repeat):
+        timer = timeit.default_timer()
+        result = parser(output)
+        elapsed = timeit.default_timer() - timer
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the git log parsers")
+    parser.add_argument("--commits", type=int, default=100000, help="number of commits in the generated history")
+    parser.add_argument("--repo", help="use an existing repo instead of generating one")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs per parser (best is reported)")
+    args = parser.parse_args()
+
+    tmpdir = None
+    repo = args.repo
+    if repo is None:
+        tmpdir = tempfile.mkdtemp(prefix="bench_log_parse")
+        repo = os.path.join(tmpdir, "repo")
+        print("generating {0} commits in {1}".format(args.commits, repo))
+        buildRepo(repo, args.commits)
+
+    try:
+        scm = GitScm(repo)
+        medium = scm._processScmCommand(['log', '--parents', '--format=medium'])
+        machine = scm._processScmCommand(scm._logArgs())
+
+        oldTime, old = timeParser(parseMedium, medium, args.repeat)
+        newTime, new = timeParser(scm._parseChangesets, machine, args.repeat)
+        if old != new:
+            print("WARNING: parsers returned different results")
+
+        print("{0} commits, {1} bytes medium / {2} bytes machine output".format(len(new), len(medium), len(machine)))
+        print("medium parser:  {0:8.3f}s {1:12.0f} commits/s".format(oldTime, len(old) / oldTime))
+        print("machine parser: {0:8.3f}s {1:12.0f} commits/s".format(newTime, len(new) / newTime))
+        print("speedup: {0:.1f}x".format(oldTime / newTime))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
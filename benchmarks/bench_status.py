@@ -0,0 +1,107 @@
+'''
+Benchmark of GitScm.status on a large working tree: the full scan (tracked and untracked files), the same scan
+with the untracked cache, the tracked-only fast mode used for status("modified"), and status("modified") with the
+working copy watcher (Linux only) after touching one file.
+Builds a tree of files (200k by default, 100 per directory) with a few modified and untracked files unless --repo
+is given, and reports the best time of each mode.
+
+usage: python benchmarks/bench_status.py [--files N] [--repo PATH] [--repeat N]
+'''
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from scmlib.git import GitScm
+
+'''
+Create a repo with 'count' committed files, then modify and add a handful of files
+'''
+def buildRepo(path, count):
+    subprocess.check_call(['git', 'init', '-q', path])
+    for i in range(count):
+        directory = os.path.join(path, "d{0:04d}".format(i // 100))
+        if i % 100 == 0:
+            os.makedirs(directory)
+        with open(os.path.join(directory, "f{0}.txt".format(i)), "w") as f:
+            f.write("file {0}\n".format(i))
+    subprocess.check_call(['git', 'add', '.'], cwd=path)
+    subprocess.check_call(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@example.com', 'commit', '-q', '-m', 'files'], cwd=path)
+    for i in range(0, count, max(1, count // 10)):
+        with open(os.path.join(path, "d{0:04d}".format(i // 100), "f{0}.txt".format(i)), "a") as f:
+            f.write("modified\n")
+        with open(os.path.join(path, "d{0:04d}".format(i // 100), "new{0}.txt".format(i)), "w") as f:
+            f.write("new\n")
+
+'''
+Run func 'repeat' times and return the best time in seconds along with its result
+'''
+def timeCall(func, repeat):
+    best = None
+    result = None
+    for i in range(repeat):
+        timer = timeit.default_timer()
+        result = func()
+        elapsed = timeit.default_timer() - timer
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GitScm.status modes")
+    parser.add_argument("--files", type=int, default=200000, help="number of files in the generated tree")
+    parser.add_argument("--repo", help="use an existing repo instead of generating one")
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs per mode (best is reported)")
+    args = parser.parse_args()
+
+    tmpdir = None
+    repo = args.repo
+    if repo is None:
+        tmpdir = tempfile.mkdtemp(prefix="bench_status")
+        repo = os.path.join(tmpdir, "repo")
+        print("generating {0} files in {1}".format(args.files, repo))
+        buildRepo(repo, args.files)
+
+    try:
+        scm = GitScm(repo)
+        #the first status refreshes the index stat data, as a long lived checkout would have it
+        scm.status()
+
+        full, entries = timeCall(lambda: scm.status(untracked="all"), args.repeat)
+        print("full scan:              {0:8.3f}s {1} entries".format(full, len(entries)))
+        scm.setUntrackedCache(True)
+        scm.status(untracked="all")
+        cached, entries = timeCall(lambda: scm.status(untracked="all"), args.repeat)
+        print("untracked cache:        {0:8.3f}s {1} entries".format(cached, len(entries)))
+        scm.setUntrackedCache(False)
+        tracked, entries = timeCall(lambda: scm.status("modified"), args.repeat)
+        print("status(\"modified\"):     {0:8.3f}s {1} entries".format(tracked, len(entries)))
+
+        scm.setWatcher(True)
+        scm.status("modified")
+        if scm.useWatcher:
+            touched = os.path.join(repo, scm.getFiles()[0])
+            with open(touched, "rb") as f:
+                original = f.read()
+            def touchAndQuery():
+                with open(touched, "ab") as f:
+                    f.write(b"touched\n")
+                return scm.status("modified")
+            try:
+                watched, entries = timeCall(touchAndQuery, args.repeat)
+            finally:
+                with open(touched, "wb") as f:
+                    f.write(original)
+            print("watched \"modified\":      {0:8.3f}s {1} entries".format(watched, len(entries)))
+        scm.close()
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -52,10 +52,9 @@ class AutoCodePromote(object):
             try:
                 tmp_branch = "{}_{}".format(tmp_banch_prefix, i)
 
-                # Pull latest changes from origin
-                self.git.gotoBranch(target_branch)
-                self.git.createBranch(tmp_branch)
-                self.git.gotoBranch(tmp_branch)
+                # Pull latest changes from origin and make the change on top of origin's target branch
+                self.git.update()
+                self.git.runRawCommand(["checkout", "--force", "-B", tmp_branch, "origin/" + target_branch])
 
                 onChangeSourceHandlerFunc(self.local_git_repo)
 
@@ -68,24 +67,18 @@ class AutoCodePromote(object):
 
                     commit_hash = self.git.getCurrentRevision()
 
-                    # merge back to target target_branch.
-                    self.git.gotoBranch(target_branch)
-                    self.git.updateAndMerge()  # to fix issues with merge conflicts when pushing to master
-                    self.git.merge(tmp_branch)
-                    target_branch_merged = True
-
-                    if ff_ancestor_branch_set:
-                        # try to merge into git ff ancestor target_branch
-                        self.git.gotoBranch(ff_ancestor_branch)
-                        self.git.updateAndMerge()
-                        self.git.merge(tmp_branch)
-                        ff_ancestor_branch_merged = True
-
-                    if ff_ancestor_branch_set:
-                        # Update/merge operations are atomic.  Either we update both, or we don't update at all.
-                        self.git.runRawCommand(["push", "--atomic", "origin", target_branch, ff_ancestor_branch])
-                    else:
-                        self.git.runRawCommand(["push", "--atomic", "origin", target_branch])
+                    # Update/merge operations are atomic.  Either we update both, or we don't update at all.
+                    # The branches are only updated on origin, and only if nobody pushed to them since the fetch.
+                    with self.git.refTransaction(push=True, local=False) as refs:
+                        # the change is on top of origin's target branch, so it is pushed to it as is.
+                        refs.update("refs/heads/" + target_branch, commit_hash, old="origin/" + target_branch)
+
+                        if ff_ancestor_branch_set:
+                            # try to merge into git ff ancestor target_branch
+                            self.git.gotoRevision("origin/" + ff_ancestor_branch)
+                            self.git.merge(commit_hash)
+                            refs.update("refs/heads/" + ff_ancestor_branch, self.git.getCurrentRevision(),
+                                        old="origin/" + ff_ancestor_branch)
 
                     merge_successful = True
 
@@ -98,17 +91,10 @@ class AutoCodePromote(object):
             except ScmError as e:
                 logger.error("SCM exception caught: {}".format(e.msg))
 
-                # Reset the integration branches back to original state.
-                # Both should either be updated or not updated together.
-                if ff_ancestor_branch_merged:
-                    self.git.gotoBranch(ff_ancestor_branch)
-                    self.git.runRawCommand(["reset", "--hard", "HEAD~1"])
-
-                if target_branch_merged:
-                    self.git.gotoBranch(target_branch)
-                    self.git.runRawCommand(["reset", "--hard", "HEAD~1"])
+                # Nothing to reset: a failed merge or push leaves the branches untouched, and the next attempt
+                # checks out origin's target branch again with --force.
 
-            if not merge_successful:
-                raise Exception()
+        if not merge_successful:
+            raise Exception()
 
-            return commit_hash
\ No newline at end of file
+        return commit_hash
\ No newline at end of file
@@ -0,0 +1,400 @@
+import asyncio
+import codecs
+import time
+import timeit
+import weakref
+
+from .basescm import BaseScm
+from .git import GitScm
+from .hg import HgScm
+from .patch import Patch
+from .submodules import parseGitlinks
+from .scm import ScmFactory
+from .errors import ScmError
+from .errors import ScmCommandError
+
+#default number of scm processes allowed to run at the same time on one event loop
+DEFAULT_CONCURRENCY = 32
+
+class AsyncBaseScm(object):
+    '''
+    Awaitable versions of the scm commands, built on asyncio subprocesses.
+    Wraps a synchronous scm object (GitScm, HgScm) and reuses its argument building and output parsing,
+    so results match the synchronous methods. The number of tool processes running at the same time is
+    limited per event loop (see setConcurrency).
+    '''
+    concurrency = DEFAULT_CONCURRENCY
+    _limiters = weakref.WeakKeyDictionary()
+
+    def __init__(self, scm):
+        if not isinstance(scm, BaseScm):
+            raise ScmError("Async scm requires an scm object, got {0}".format(type(scm).__name__))
+        self.scm = scm
+        self.rawoutput = ""
+
+    '''
+    Set the maximum number of scm processes allowed to run at the same time on each event loop.
+    Applies to event loops that have not run a command yet.
+    '''
+    @classmethod
+    def setConcurrency(cls, limit):
+        if limit < 1:
+            raise ScmError("Concurrency limit must be at least 1")
+        cls.concurrency = int(limit)
+
+    '''
+    Private function to get the concurrency limiter for the running event loop
+    '''
+    @classmethod
+    def _getLimiter(cls):
+        loop = asyncio.get_running_loop()
+        limiter = AsyncBaseScm._limiters.get(loop)
+        if limiter is None:
+            limiter = asyncio.Semaphore(cls.concurrency)
+            AsyncBaseScm._limiters[loop] = limiter
+        return limiter
+
+    def scmType(self):
+        return self.scm.scmType()
+
+    def debugPrint(self, msg):
+        self.scm.debugPrint(msg)
+
+    '''
+    Execute the underlying SCM tool with the given argument list. If specified, will use 'cwd' as
+    the directory to execute from. Executes from the local repo path by default. If specified, 'input' (bytes) is
+    written to the command's standard input.
+    Returns the text output from the command on success.
+    Raises ScmError with the failing output message along with the failing command (if applicable) if the command does not succeed.
+    '''
+    async def _processScmCommand(self, args, cwd=None, outfile=None, input=None):
+        if not isinstance(args, list):
+            raise ScmError("Arguments to SCM tool not specified as a list")
+
+        strargs = [str(a) for a in args]
+
+        if cwd is None:
+            cwd = self.scm.localpath
+
+        if self.scm.toolpath is None:
+            raise ScmError("Tool executable is not set. Cannot execute command.")
+
+        cmd = [self.scm.toolpath] + strargs
+        async with self._getLimiter():
+            self.debugPrint("running command {0}".format(" ".join(cmd)))
+            start = time.time()
+            timer = timeit.default_timer()
+            stdin = asyncio.subprocess.DEVNULL if input is None else asyncio.subprocess.PIPE
+            scmprocess = await asyncio.create_subprocess_exec(*cmd, stdin=stdin, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, cwd=cwd)
+            cout, cerr = await scmprocess.communicate(input)
+            self.scm._recordCommand(cmd, cwd, start, timeit.default_timer() - timer, scmprocess.returncode, len(cout), len(cerr))
+
+        output = cout.decode('utf-8', 'replace')
+        self.rawoutput = output
+
+        if scmprocess.returncode != 0:
+            raise ScmCommandError(cerr.decode('utf-8', 'replace'), " ".join(cmd), scmprocess.returncode)
+
+        if outfile is not None:
+            with codecs.open(outfile, mode='w', encoding='utf-8', errors='replace') as f:
+                f.write(output)
+
+        return output
+
+    '''
+    Allows running a raw command through the wrapped scm
+    '''
+    async def runRawCommand(self, arglist, cwd=None, outfile=None):
+        return await self._processScmCommand(arglist, cwd, outfile)
+
+    '''
+    Private function to run a command fetching from the remote, then drop the wrapped scm's query cache like its
+    synchronous update does
+    '''
+    async def _fetchCommand(self, args):
+        try:
+            return await self._processScmCommand(args)
+        finally:
+            if self.scm.cache is not None:
+                self.scm.cache.invalidate()
+
+    '''
+    Return the raw text output from the last command. Intended for debug only.
+    '''
+    def getRawOutput(self):
+        return self.rawoutput
+
+    '''
+    Add a file to be tracked by the repo (see BaseScm.addFile)
+    '''
+    async def addFile(self, filename=None):
+        args = ['add']
+        if filename is not None:
+            if isinstance(filename, list):
+                args.extend(filename)
+            else:
+                args.append(filename)
+        elif self.scm.scmType() == "git":
+            args.append(".")
+        await self._processScmCommand(args)
+
+    '''
+    Commit changes to the repository (see BaseScm.commit)
+    '''
+    async def commit(self, message):
+        args = ['commit']
+        if self.scm.username:
+            args.extend(['-u', self.scm.username])
+        args.extend(['-m', message])
+        await self._processScmCommand(args)
+
+    '''
+    Return the current state of files in the repository (see BaseScm.status)
+    '''
+    async def status(self, type=None, include=None, exclude=None, untracked=None):
+        output = await self._processScmCommand(self.scm._statusArgs(type, include, exclude, untracked))
+        return self.scm._parseStatus(output, type)
+
+    '''
+    Get the patch output (diff) for the given revision id (see BaseScm.getPatch)
+    '''
+    async def getPatch(self, rev1=None, rev2=None, outfile=None, context=5, stat=False, include=None, exclude=None, submodules=True):
+        return await self._processScmCommand(self.scm._patchArgs(rev1, rev2, context, stat, include, exclude, submodules), outfile=outfile)
+
+    '''
+    Get the patch output for the given revision id as a Patch (see BaseScm.getStructuredPatch)
+    '''
+    async def getStructuredPatch(self, rev1=None, rev2=None, context=5, include=None, exclude=None, submodules=True):
+        return Patch(await self._processScmCommand(self.scm._patchArgs(rev1, rev2, context, False, include, exclude, submodules)))
+
+    '''
+    Get the line churn of a diff (see BaseScm.getChurn)
+    '''
+    async def getChurn(self, rev1=None, rev2=None, include=None, exclude=None):
+        output = await self._processScmCommand(self.scm._churnArgs(rev1, rev2, include, exclude))
+        return self._parseChurn(output, False)
+
+    '''
+    Get the line churn of each commit in a revision range (see BaseScm.getChurnLog)
+    '''
+    async def getChurnLog(self, rev1=None, rev2=None, startdate=None, enddate=None, include=None, exclude=None):
+        output = await self._processScmCommand(self.scm._churnLogArgs(rev1, rev2, startdate, enddate, include, exclude))
+        return self._parseChurn(output, True)
+
+    '''
+    Get log information for one or more revisions (see BaseScm.log)
+    '''
+    async def log(self, revision=None, limit=None, file=None, startdate=None, enddate=None, author=None):
+        output = await self._processScmCommand(self.scm._logArgs(revision, limit, file, startdate, enddate, author))
+        return self.scm._parseChangesets(output)
+
+    '''
+    Get log information for the first-parent ancestor path of a revision (see BaseScm.getAncestors)
+    '''
+    async def getAncestors(self, revision=None, limit=None):
+        output = await self._processScmCommand(self.scm._ancestorsArgs(revision, limit))
+        return self.scm._parseChangesets(output)
+
+    '''
+    Returns a list of all the tracked files in the repository (see BaseScm.getFiles)
+    '''
+    async def getFiles(self):
+        output = await self._processScmCommand(self._filesArgs())
+        return self.scm._parseFiles(output)
+
+    '''
+    Change to the requested branch name in the repository (see BaseScm.gotoBranch)
+    '''
+    async def gotoBranch(self, branch):
+        await self.gotoRevision(branch)
+
+class AsyncGitScm(AsyncBaseScm):
+    '''
+    Awaitable git commands. See GitScm for the synchronous versions.
+    '''
+    def __init__(self, scm):
+        if not isinstance(scm, GitScm):
+            raise ScmError("AsyncGitScm requires a GitScm object")
+        super(AsyncGitScm, self).__init__(scm)
+
+    def _filesArgs(self):
+        return self.scm._filesArgs()
+
+    def _parseChurn(self, output, authors):
+        return self.scm._parseChurn(output.split("\0"))
+
+    async def status(self, type=None, include=None, exclude=None, untracked=None):
+        if type != "clean":
+            return await super(AsyncGitScm, self).status(type, include, exclude, untracked)
+        #git status does not list clean files: they are the tracked files without a status entry
+        output = await self._processScmCommand(self.scm._statusArgs(type, include, exclude, untracked))
+        files = await self._processScmCommand(['ls-files', '-z'] + self.scm._getPathspecArgs(include, exclude))
+        entries = GitScm._iterCleanEntries(GitScm._iterStatusEntries(output.split("\0")), files.split("\0"))
+        return GitScm._statusTuples(entries, type)
+
+    '''
+    Clone the remote repo into the local path, through the mirror cache like GitScm.clone. The mirror is updated by
+    the synchronous GitScm.updateMirror (it holds a file lock while it fetches) on the loop's default executor.
+    '''
+    async def clone(self):
+        if self.scm.remotepath is None:
+            raise ScmError("No remote SCM path specified.")
+        mirror = None
+        try:
+            mirror = await asyncio.get_running_loop().run_in_executor(None, self.scm.updateMirror)
+        except ScmError as e:
+            self.debugPrint("mirror update failed, falling back: {0}".format(e))
+        await self._processScmCommand(self.scm._cloneArgs(mirror), cwd='.')
+        if self.scm.cloneSparse is not None:
+            await self._processScmCommand(self.scm._sparseCheckoutArgs())
+        if self.scm.submoduleFilter is not None:
+            gitlinks = await self._getGitlinks("HEAD", self.scm.getSubrepos())
+            for args in self.scm._submoduleCloneArgs(gitlinks):
+                await self._processScmCommand(args)
+
+    async def push(self):
+        if self.scm.remotepath is None:
+            raise ScmError("No remote SCM path specified.")
+        await self._processScmCommand(['push', self.scm.remotepath])
+        await self._processScmCommand(['push', '--tags', self.scm.remotepath])
+
+    async def update(self):
+        if self.scm.remotepath is None:
+            raise ScmError("No remote SCM path specified.")
+        await self._fetchCommand(['fetch'])
+
+    async def updateAndMerge(self):
+        if self.scm.remotepath is None:
+            raise ScmError("No remote SCM path specified.")
+        await self._fetchCommand(['pull'])
+
+    async def merge(self, revision):
+        await self._processScmCommand(['merge', revision])
+
+    async def gotoRevision(self, revision=None):
+        if revision is None:
+            revision = "master"
+        old = await self._getGitlinks("HEAD", self.scm.getSubrepos())
+        try:
+            await self._processScmCommand(['checkout', revision])
+        except ScmCommandError:
+            if self.scm.cloneDepth is None and not self.scm.cloneSingleBranch and not self.scm._isShallow():
+                raise
+            for args in self.scm._fetchRevisionCommands(revision):
+                await self._processScmCommand(args)
+        subrepos = self.scm.getSubrepos()
+        if len(subrepos) > 0:
+            changed = self.scm._changedSubmodules(old, await self._getGitlinks("HEAD", subrepos))
+            if len(changed) > 0:
+                await self._processScmCommand(self.scm._submoduleUpdateArgs(changed))
+
+    async def _getGitlinks(self, revision, paths):
+        if len(paths) == 0:
+            return {}
+        try:
+            return parseGitlinks(await self._processScmCommand(self.scm._gitlinksArgs(revision, paths)))
+        except ScmError as e:
+            self.debugPrint("no submodule commits for {0}: {1}".format(revision, e))
+            return {}
+
+    async def getCurrentRevision(self, showmod=False, length=None):
+        output = await self._processScmCommand(['rev-parse', 'HEAD'])
+        rev = output.strip()
+        if len(rev) == 0:
+            raise ScmError("Current revision not found")
+        if length:
+            rev = rev[:length]
+        if showmod == True:
+            output = await self._processScmCommand(['describe', '--always', '--dirty'])
+            if "-dirty" in output:
+                rev = rev + "+"
+        return rev
+
+    async def getCurrentBranch(self):
+        output = await self._processScmCommand(['rev-parse', '--abbrev-ref', 'HEAD'])
+        brname = output.strip()
+        if len(brname) == 0:
+            raise ScmError("Current branch name not found")
+        return brname
+
+class AsyncHgScm(AsyncBaseScm):
+    '''
+    Awaitable mercurial commands. See HgScm for the synchronous versions.
+    '''
+    def __init__(self, scm):
+        if not isinstance(scm, HgScm):
+            raise ScmError("AsyncHgScm requires an HgScm object")
+        super(AsyncHgScm, self).__init__(scm)
+
+    def _filesArgs(self):
+        return ['manifest']
+
+    def _parseChurn(self, output, authors):
+        return self.scm._parseChurn(output, authors)
+
+    async def clone(self):
+        if self.scm.remotepath is None:
+            raise ScmError("No remote SCM path specified.")
+        await self._processScmCommand(['clone', self.scm.remotepath, self.scm.localpath], cwd='.')
+
+    async def push(self):
+        if self.scm.remotepath is None:
+            raise ScmError("No remote SCM path specified.")
+        await self._processScmCommand(['push', self.scm.remotepath])
+
+    async def update(self):
+        if self.scm.remotepath is None:
+            raise ScmError("No remote SCM path specified.")
+        await self._fetchCommand(['pull'])
+
+    async def updateAndMerge(self):
+        if self.scm.remotepath is None:
+            raise ScmError("No remote SCM path specified.")
+        await self._fetchCommand(['pull', '-u'])
+
+    async def merge(self, revision):
+        await self._processScmCommand(['merge', '-r', revision])
+
+    async def gotoRevision(self, revision=None):
+        if revision is None:
+            revision = "default"
+        await self._processScmCommand(['update', '-r', revision])
+
+    async def getCurrentRevision(self, showmod=False, length=None):
+        output = await self._processScmCommand(['identify', '-i'])
+        rev = output.strip()
+        if len(rev) == 0:
+            raise ScmError("Current revision not found")
+        if length:
+            rev = rev[:length]
+        if showmod == False:
+            rev = rev.rstrip("+")
+        return rev
+
+    async def getCurrentBranch(self):
+        output = await self._processScmCommand(['identify', '-b'])
+        brname = output.strip()
+        if len(brname) == 0:
+            raise ScmError("Current branch name not found")
+        return brname
+
+'''
+Wrap an existing scm object with the matching async class.
+Raises ScmError if the scm type has no async support.
+'''
+def AsyncScm(scm):
+    if isinstance(scm, GitScm):
+        return AsyncGitScm(scm)
+    if isinstance(scm, HgScm):
+        return AsyncHgScm(scm)
+    raise ScmError("No async support for scm type {0}".format(scm.scmType()))
+
+'''
+Create an async scm object for the given repo (see ScmFactory).
+Returns None if the repository type cannot be determined.
+'''
+def AsyncScmFactory(localpath, remotepath=None, user=None, pw=None):
+    scm = ScmFactory(localpath, remotepath, user, pw)
+    if scm is None:
+        return None
+    return AsyncScm(scm)
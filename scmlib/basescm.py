@@ -6,13 +6,34 @@ import os
 import datetime
 import sys
 import codecs
+import collections
+import copy
+import tempfile
+import threading
+import time
+import timeit
 
 from .errors import ScmError
 from .errors import ScmCommandError
+from .cache import ScmCache
+from .cache import DEFAULT_CACHE_SIZE
+from .instrument import CommandRecord
+from .batch import BatchItem
+from .batch import BatchResult
+from .batch import DEFAULT_BATCH_WIDTH
+
+#number of bytes read from the tool at a time when streaming command output
+STREAM_CHUNK_SIZE = 65536
+
+#most paths a watched status passes to the tool; more changes than this fall back to a full scan
+WATCH_MAX_PATHS = 1000
 
 #abstract class which other Scm classes will inherit from
 class BaseScm(object):
     __metaclass__ = ABCMeta
+
+    #callables notified with a CommandRecord after every tool command (see addCommandHook)
+    commandHooks = []
     
     def __init__(self):
         self.localpath = None
@@ -22,6 +43,10 @@ class BaseScm(object):
         self.username = None
         self.password = None
         self.rawoutput = ""
+        self.cache = None
+        self.useWatcher = False
+        self.watcher = None
+        self.watchState = None
 
     '''
     Decorator to indicate that the remote repo path is required before running. If the remote path is not specified, ScmError will be raised.
@@ -36,6 +61,52 @@ class BaseScm(object):
             return f(*args, **kwargs)
         return wrap
 
+    '''
+    Decorator to memoize the result of a read-only query while the cache is enabled (see enableCache).
+    Results are keyed by the method name, its arguments and the repository state returned by _getRepoState,
+    so a cached result is never returned once the repo has changed. Callers get a copy of the cached result.
+    '''
+    @staticmethod
+    def cachedQuery(f):
+        @functools.wraps(f)
+        def wrap(*args, **kwargs):
+            self = args[0]
+            if self.cache is None:
+                return f(*args, **kwargs)
+            state = self._getRepoState()
+            if state is None:
+                return f(*args, **kwargs)
+            key = (f.__name__, args[1:], tuple(sorted(kwargs.items())), state)
+            try:
+                found, value = self.cache.get(key)
+            except TypeError:
+                #unhashable arguments (e.g. lists), cannot be cached
+                return f(*args, **kwargs)
+            if found:
+                return copy.deepcopy(value)
+            value = f(*args, **kwargs)
+            self.cache.put(key, copy.deepcopy(value))
+            return value
+        return wrap
+
+    '''
+    Decorator factory for methods which change the repository. After the method runs (successfully or not),
+    the cached results of the named queries are dropped. If no names are given, the whole cache is dropped.
+    '''
+    @staticmethod
+    def invalidatesCache(*names):
+        def decorator(f):
+            @functools.wraps(f)
+            def wrap(*args, **kwargs):
+                self = args[0]
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    if self.cache is not None:
+                        self.cache.invalidate(names)
+            return wrap
+        return decorator
+
     '''
     Static scm function to find the given tool name in the users environment PATH.
     exeName is the name of the tool executable to find. e.g. hg.exe, git.exe, etc.
@@ -50,6 +121,53 @@ class BaseScm(object):
                 return toolpath
         return None
         
+    '''
+    Register a callable to be notified after every scm tool command run by any scm object in this process.
+    The hook is called with an instrument.CommandRecord holding the argv, cwd, wall time, exit code,
+    stdout/stderr byte counts and the calling scmlib method. Exceptions raised by hooks are ignored.
+    '''
+    @staticmethod
+    def addCommandHook(hook):
+        if hook not in BaseScm.commandHooks:
+            BaseScm.commandHooks.append(hook)
+
+    '''
+    Unregister a command hook added with addCommandHook
+    '''
+    @staticmethod
+    def removeCommandHook(hook):
+        if hook in BaseScm.commandHooks:
+            BaseScm.commandHooks.remove(hook)
+
+    '''
+    Private function to find the public scmlib method that led to the current tool command
+    '''
+    @staticmethod
+    def _callerMethod():
+        package = BaseScm.__module__.rpartition(".")[0]
+        frame = sys._getframe(2)
+        while frame is not None:
+            name = frame.f_code.co_name
+            obj = frame.f_locals.get('self')
+            #scm objects and their wrappers (e.g. the async classes), skipping private helpers and decorators
+            if obj is not None and type(obj).__module__.startswith(package) and not name.startswith("_") and name != "wrap":
+                return name
+            frame = frame.f_back
+        return None
+
+    '''
+    Private function to pass the details of a finished tool command to the registered command hooks
+    '''
+    def _recordCommand(self, cmd, cwd, start, elapsed, returncode, stdoutBytes, stderrBytes):
+        if len(BaseScm.commandHooks) == 0:
+            return
+        record = CommandRecord(cmd, cwd, start, elapsed, returncode, stdoutBytes, stderrBytes, BaseScm._callerMethod())
+        for hook in list(BaseScm.commandHooks):
+            try:
+                hook(record)
+            except Exception as e:
+                self.debugPrint("command hook {0} failed: {1}".format(hook, e))
+
     '''
     Set the debug state of this scm object to the given boolean value. If no value is specified, the current state will toggle.
     '''
@@ -60,6 +178,35 @@ class BaseScm(object):
         self.debug = bool(value)
         print("Debugging printing is {0}".format(self.debug))
         
+    '''
+    Enable memoization of read-only queries (current revision/branch, log, tags, files, subrepos, etc.),
+    keeping at most maxsize results. Replaces any existing cache.
+    '''
+    def enableCache(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.cache = ScmCache(maxsize)
+
+    '''
+    Disable memoization of read-only queries and drop all cached results.
+    '''
+    def disableCache(self):
+        self.cache = None
+
+    '''
+    Returns a dictionary with the query cache counters (see ScmCache.stats), or None if the cache is not enabled.
+    '''
+    def getCacheStats(self):
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    '''
+    Private function returning a hashable snapshot of the repository state used to key cached queries.
+    Must change whenever the result of a cached query could change. Returns None if the state cannot be
+    determined, which disables caching for that call.
+    '''
+    def _getRepoState(self):
+        return None
+
     '''
     Print the given debug message to the screen. Only prints if the current debug state of the scm object is set to True. (see setDebug function)
     '''
@@ -69,29 +216,20 @@ class BaseScm(object):
 
     '''
     Execute the the underlying SCM tool with the given argument list. If specified, will use 'cwd' as
-    the directory to execute from. Executes from the local repo path by default.
+    the directory to execute from. Executes from the local repo path by default. If specified, 'input' (bytes) is
+    written to the command's standard input.
     Returns the text output from the command on success.
     Raises ScmError with the failing output message along with the failing command (if applicable) if the command does not succeed.
     '''
-    def _processScmCommand(self, args, cwd=None, outfile=None):
-        if not isinstance(args, list):
-            raise ScmError("Arguments to SCM tool not specified as a list")
-            
-        #subprocess doesn't like other types. Make everything a string.
-        strargs = [str(a) for a in args]
-
-        #unless told otherwise, execute the command in the repo
-        if cwd is None:
-            cwd = self.localpath
-            
-        if self.toolpath is None:
-            raise ScmError("Tool executable is not set. Cannot execute command.")
-            
-        cmd = [self.toolpath] + strargs
+    def _processScmCommand(self, args, cwd=None, outfile=None, input=None):
+        cmd, cwd = self._buildScmCommand(args, cwd)
         self.debugPrint("running command {0}".format(" ".join(cmd)))
         self.debugPrint(cmd)
+        start = time.time()
+        timer = timeit.default_timer()
         scmprocess = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
-        cout, cerr = scmprocess.communicate()
+        cout, cerr = scmprocess.communicate(input)
+        self._recordCommand(cmd, cwd, start, timeit.default_timer() - timer, scmprocess.returncode, len(cout), len(cerr))
 
         #decode the program output, replacing characters which cannot be converted
         #without this, output is not compatible between python 3.x and python 2.7
@@ -108,12 +246,156 @@ class BaseScm(object):
                 f.write(self.rawoutput.decode('utf-8'))
 
         return self.rawoutput
+
+    '''
+    Private function to validate the argument list and build the full command line for the underlying SCM tool.
+    Returns the command list and the directory to execute from.
+    '''
+    def _buildScmCommand(self, args, cwd=None):
+        if not isinstance(args, list):
+            raise ScmError("Arguments to SCM tool not specified as a list")
+            
+        #subprocess doesn't like other types. Make everything a string.
+        strargs = [str(a) for a in args]
+
+        #unless told otherwise, execute the command in the repo
+        if cwd is None:
+            cwd = self.localpath
+            
+        if self.toolpath is None:
+            raise ScmError("Tool executable is not set. Cannot execute command.")
+            
+        return [self.toolpath] + strargs, cwd
+
+    '''
+    Execute the underlying SCM tool like _processScmCommand, but read the output incrementally instead of buffering it.
+    Generator yielding one record at a time as soon as it is read from the tool. Records are split on 'separator'
+    (newline by default, not included in the record) and decoded as utf-8 text. If separator is None, the raw
+    output chunks are yielded as bytes instead.
+    The output is not kept in rawoutput. Raises ScmCommandError after the last record if the command does not succeed.
+    If the generator is closed before the output is exhausted, the tool process is killed.
+    '''
+    def _streamScmCommand(self, args, cwd=None, separator="\n", chunksize=STREAM_CHUNK_SIZE):
+        cmd, cwd = self._buildScmCommand(args, cwd)
+        self.debugPrint("streaming command {0}".format(" ".join(cmd)))
+
+        if separator is not None and not isinstance(separator, bytes):
+            separator = separator.encode('utf-8')
+
+        #stderr goes to a temporary file so a chatty tool cannot block on a full pipe while we read stdout
+        errfile = tempfile.TemporaryFile()
+        start = time.time()
+        timer = timeit.default_timer()
+        outbytes = 0
+        scmprocess = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errfile, cwd=cwd)
+        try:
+            scmprocess.stdin.close()
+            fd = scmprocess.stdout.fileno()
+            pending = b""
+            while True:
+                chunk = os.read(fd, chunksize)
+                if not chunk:
+                    break
+                outbytes += len(chunk)
+                if separator is None:
+                    yield chunk
+                    continue
+                records = (pending + chunk).split(separator)
+                pending = records.pop()
+                for record in records:
+                    yield record.decode('utf-8', 'replace')
+            if separator is not None and len(pending) > 0:
+                yield pending.decode('utf-8', 'replace')
+
+            scmprocess.wait()
+            if scmprocess.returncode != 0:
+                errfile.seek(0)
+                raise ScmCommandError(errfile.read().decode('utf-8', 'replace'), " ".join(cmd), scmprocess.returncode)
+        finally:
+            if scmprocess.poll() is None:
+                scmprocess.kill()
+                scmprocess.wait()
+            scmprocess.stdout.close()
+            errfile.seek(0, os.SEEK_END)
+            self._recordCommand(cmd, cwd, start, timeit.default_timer() - timer, scmprocess.returncode, outbytes, errfile.tell())
+            errfile.close()
         
     '''
     Allows running a raw command through the inherited class
     '''
     def runRawCommand(self, arglist, cwd=None, outfile=None):
-        return self._processScmCommand(arglist, cwd, outfile)
+        try:
+            return self._processScmCommand(arglist, cwd, outfile)
+        finally:
+            #a raw command may change anything in the repo
+            if self.cache is not None:
+                self.cache.invalidate()
+        
+    '''
+    Run a list of independent commands on a thread pool, at most 'width' at a time.
+    Each spec is an argument list (as for runRawCommand) or a dictionary with 'args' and optional 'cwd' and 'mutates'.
+    Returns a BatchResult holding one BatchItem per spec in submission order. A failing command does not stop
+    the batch; its ScmError is kept in the item's 'error' (use BatchResult.check() to raise it).
+    Intended for read-only commands: the commands must not depend on each other's effects. The query cache is kept,
+    unless a spec is marked with 'mutates': True, in which case it is dropped after the batch like runRawCommand does.
+    '''
+    def runBatch(self, specs, width=DEFAULT_BATCH_WIDTH):
+        items = []
+        mutates = False
+        for spec in specs:
+            if isinstance(spec, dict):
+                items.append(BatchItem(spec['args'], spec.get('cwd')))
+                mutates = mutates or bool(spec.get('mutates'))
+            else:
+                items.append(BatchItem(spec))
+
+        timer = timeit.default_timer()
+        try:
+            if len(items) > 0:
+                workers = max(1, min(int(width), len(items)))
+                pending = collections.deque(items)
+                failures = []
+                threads = [threading.Thread(target=self._runBatchWorker, args=(pending, failures)) for i in range(workers)]
+                for thread in threads:
+                    thread.daemon = True
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                #anything but an ScmError is a bug, raise it like a sequential loop would
+                if len(failures) > 0:
+                    raise failures[0]
+        finally:
+            #a mutating command may have changed anything in the repo
+            if mutates and self.cache is not None:
+                self.cache.invalidate()
+        return BatchResult(items, timeit.default_timer() - timer)
+
+    '''
+    Private function run by each thread of a batch, taking the next command from the shared queue until it is empty.
+    Unexpected exceptions are added to 'failures' and stop the thread.
+    '''
+    def _runBatchWorker(self, pending, failures):
+        while True:
+            try:
+                item = pending.popleft()
+            except IndexError:
+                return
+            try:
+                self._runBatchItem(item)
+            except Exception as e:
+                failures.append(e)
+                return
+
+    '''
+    Private function to run one command of a batch, storing its output or error in the item
+    '''
+    def _runBatchItem(self, item):
+        timer = timeit.default_timer()
+        try:
+            item.output = self._processScmCommand(item.args, item.cwd)
+        except ScmError as e:
+            item.error = e
+        item.elapsed = timeit.default_timer() - timer
         
     '''
     Return the raw text output from the last command. Intended for debug only.
@@ -121,6 +403,103 @@ class BaseScm(object):
     def getRawOutput(self):
         return self.rawoutput
 
+    '''
+    Release any background resources (e.g. persistent tool processes) held by this scm object.
+    The object remains usable; resources are acquired again when needed.
+    '''
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+            self.watchState = None
+
+    '''
+    Enable or disable the working copy watcher (see watcher.DirtyTracker, Linux only). If no value is specified,
+    the current state will toggle. When enabled, status queries without include/exclude filters only ask the tool
+    about the files touched since the previous status and the files that were changed then, instead of scanning
+    the whole working copy. Untracked files are listed one by one in that mode (never as collapsed directories).
+    The whole working copy is still scanned on the first query, when the repository state (HEAD, index, etc.)
+    changed, when an ignore file was touched, when there are too many changes or when the watcher missed events.
+    '''
+    def setWatcher(self, value=None):
+        if value is None:
+            value = not self.useWatcher
+        self.useWatcher = bool(value)
+        if not self.useWatcher and self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+            self.watchState = None
+
+    '''
+    Private function to get the working copy watcher.
+    Returns None if the watcher is disabled or not available on this system (which disables it).
+    '''
+    def _getWatcher(self):
+        if not self.useWatcher or self.localpath is None or not os.path.isdir(self.localpath):
+            return None
+        if self.watcher is None:
+            try:
+                #imported here, the inotify watcher is optional and Linux only
+                from .watcher import DirtyTracker
+                self.watcher = DirtyTracker(self.localpath)
+            except (ImportError, ScmError, OSError) as e:
+                self.debugPrint("working copy watcher not available: {0}".format(e))
+                self.useWatcher = False
+                return None
+        return self.watcher
+
+    '''
+    Private function returning the status entries of the whole working copy (changes, and every untracked file if
+    untracked is set) through the watcher, scanning only the touched and previously changed paths when possible
+    (see setWatcher). Returns None if the watcher is disabled or not available.
+    '''
+    def _watchedStatus(self, untracked=True):
+        watcher = self._getWatcher()
+        if watcher is None:
+            return None
+        from .watcher import IGNORE_FILES
+        touched = watcher.collect()
+        paths = None
+        state = self.watchState
+        #a checkpoint without the untracked files cannot answer for them
+        if touched is not None and state is not None and (state[1] or not untracked) and state[0] == self._getRepoState():
+            if not any(path.rpartition("/")[2] in IGNORE_FILES for path in touched):
+                subrepos = self.getSubrepos()
+                paths = set(state[2])
+                for path in touched:
+                    #the tool does not take paths inside a subrepo, ask about the subrepo itself
+                    for subrepo in subrepos:
+                        if path.startswith(subrepo + "/"):
+                            path = subrepo
+                            break
+                    paths.add(path)
+                if len(paths) > WATCH_MAX_PATHS:
+                    paths = None
+        if paths is None:
+            self.debugPrint("no usable watcher checkpoint, scanning the whole working copy")
+            entries = list(self._scanStatus(None, untracked))
+        elif len(paths) > 0:
+            entries = list(self._scanStatus(sorted(paths), untracked))
+        else:
+            entries = []
+
+        changed = set()
+        for entry in entries:
+            changed.add(entry.path)
+            if entry.origPath is not None:
+                changed.add(entry.origPath)
+        #taken after the scan, since the tool may refresh its own state (e.g. the git index) while scanning
+        self.watchState = (self._getRepoState(), untracked, changed)
+        return entries
+
+    '''
+    Private generator yielding the status entries (see status.StatusEntry) of every changed file (and untracked file
+    if untracked is set), or only of the given paths (relative to the repo root, a directory covers everything below it).
+    Used by the watched status; implemented by the scm classes that support it.
+    '''
+    def _scanStatus(self, paths=None, untracked=True):
+        raise ScmError("{0} does not support watched status".format(self.scmType()))
+
     '''
     Align a datetime object to the Monday of that work week.
     '''
@@ -189,11 +568,20 @@ class BaseScm(object):
     '''
     Return the current state of files in the repository.
     If type is specified ("modified", "added", "removed", "deleted", "unknown", "clean", "ignored"), only return status for the requested type.
-    If type is not specified, will return status for all types.
-    Returns a list of tuples for the requested file types on success. Raises ScmError on error. List can be empty if there are no modified files.
+    If type is not specified, will return status for all types except clean and ignored files.
+    untracked selects how untracked files are scanned ("all", "normal" or "no" to skip them); None uses the tool default.
+    Returns a list of (state, filename) tuples for the requested file types on success. Raises ScmError on error. List can be empty if there are no modified files.
     '''
     @abstractmethod
-    def status(self, type=None, include=None, exclude=None):
+    def status(self, type=None, include=None, exclude=None, untracked=None):
+        pass
+
+    '''
+    Generator version of status, yielding a StatusEntry (see status.StatusEntry) per file.
+    Raises ScmError on error.
+    '''
+    @abstractmethod
+    def iterStatus(self, type=None, include=None, exclude=None, untracked=None):
         pass
         
     '''
@@ -229,10 +617,12 @@ class BaseScm(object):
         pass
         
     '''
-    Return a list of the local branches.
+    Return a list of the local branches, as the head changeset of each with its 'branch' name set.
+    If remotes is set, the remote tracking branches are listed as well. If aheadBehind is set, each branch also
+    has the number of commits it is 'ahead' of and 'behind' the main branch (see getMainBranchName), where supported.
     '''
     @abstractmethod
-    def getBranches(self):
+    def getBranches(self, remotes=False, aheadBehind=False):
         pass
         
     '''
@@ -280,24 +670,71 @@ class BaseScm(object):
     @abstractmethod
     def getPatch(self, rev1=None, rev2=None, outfile=None, context=5, stat=False, include=None, exclude=None, submodules=True):
         pass
+
+    '''
+    Streaming version of getPatch. Takes the same arguments (except outfile), but returns a generator which yields the
+    patch text one line at a time (without line endings) as it is read from the tool.
+    Raises ScmError on error.
+    '''
+    @abstractmethod
+    def iterPatch(self, rev1=None, rev2=None, context=5, stat=False, include=None, exclude=None, submodules=True):
+        pass
+
+    '''
+    Structured version of getPatch. Takes the same arguments (except outfile and stat), but returns a Patch (see
+    scmlib.patch) indexing the files and hunks of the diff, whose per-file and per-hunk views are created on demand.
+    Raises ScmError on error.
+    '''
+    @abstractmethod
+    def getStructuredPatch(self, rev1=None, rev2=None, context=5, include=None, exclude=None, submodules=True):
+        pass
+
+    '''
+    Get the number of added and deleted lines per changed file between two revisions (arguments as for getPatch).
+    Returns a Churn (see scmlib.churn), with columns of path ids, added and deleted line counts and binary flags.
+    Raises ScmError on error.
+    '''
+    @abstractmethod
+    def getChurn(self, rev1=None, rev2=None, include=None, exclude=None):
+        pass
+
+    '''
+    Get the line churn of each commit in the range rev1..rev2, with the commit authors, optionally limited by date
+    and paths. Returns a Churn (see scmlib.churn) which aggregates by author, directory and extension.
+    Raises ScmError on error.
+    '''
+    @abstractmethod
+    def getChurnLog(self, rev1=None, rev2=None, startdate=None, enddate=None, include=None, exclude=None):
+        pass
         
     '''
     Get log information for one or more revisions. Gets log data for all revisions by default.
     If revision is specified, get log data for only the specified revision.
     If limit is specified, only return at most <limit> log entries.
-    Returns a list of dictionaries containing log data. Each dictionary contains the revision ('hash'),
+    If startdate/enddate are specified, only return changesets committed in that date range.
+    If author is specified, only return changesets whose author contains the given text.
+    Returns a list of Changeset objects (see changeset.Changeset, accessed like dictionaries). Each contains the revision ('hash'),
     commiting user id ('idsid'), date of the change ('date'), and commit message ('message')
     Raises ScmError on error
     '''
     @abstractmethod
-    def log(self, revision=None, limit=None, file=None, startdate=None, enddate=None):
+    def log(self, revision=None, limit=None, file=None, startdate=None, enddate=None, author=None):
+        pass
+
+    '''
+    Streaming version of log. Takes the same arguments, but returns a generator which yields each changeset
+    as soon as it has been read from the tool, without buffering the whole log output.
+    Raises ScmError on error (after the changesets read so far have been yielded).
+    '''
+    @abstractmethod
+    def iterLog(self, revision=None, limit=None, file=None, startdate=None, enddate=None, author=None):
         pass
         
     '''
     Get log information for the first-parent ancestor path of a revision.
     If revision is specified, get log data for only the specified revision.
     If limit is specified, only return at most <limit> log entries.
-    Returns a list of dictionaries containing log data. Each dictionary contains the revision ('hash'),
+    Returns a list of Changeset objects (see changeset.Changeset, accessed like dictionaries). Each contains the revision ('hash'),
     commiting user id ('idsid'), date of the change ('date'), and commit message ('message')
     Raises ScmError on error
     '''
@@ -307,6 +744,7 @@ class BaseScm(object):
         
     '''
     Returns a list of tags that have been committed, ordered from newest to oldest.
+    If filter is set, only the tags matching the glob pattern (as for 'git tag -l <pattern>') are returned.
     Raises ScmError on error.
     '''
     @abstractmethod
@@ -329,6 +767,14 @@ class BaseScm(object):
     def getLatestTag(self):
         pass
 
+    '''
+    Returns the list of tags (newest first) whose commit contains the given revision (the tagged commit itself or one of
+    its descendants). Raises ScmError on error.
+    '''
+    @abstractmethod
+    def getTagsContaining(self, revision):
+        pass
+
     '''
     Returns a list of all the tracked files in the repository.
     Raises ScmError on error.
@@ -336,6 +782,24 @@ class BaseScm(object):
     @abstractmethod
     def getFiles(self):
         pass
+
+    '''
+    Generator version of getFiles, yielding the tracked files of the given revision (the current one by default)
+    one at a time, without building the whole list.
+    Raises ScmError on error.
+    '''
+    @abstractmethod
+    def iterFiles(self, revision=None):
+        pass
+
+    '''
+    Returns a FileIndex (see fileindex.FileIndex) of the tracked files of the given revision (the current one by default),
+    a compact sorted list of the paths answering prefix, glob and extension queries by bisection.
+    Raises ScmError on error.
+    '''
+    @abstractmethod
+    def getFileIndex(self, revision=None):
+        pass
         
     '''
     Revert changes to one or more files.
@@ -0,0 +1,66 @@
+#default number of commands run at the same time by BaseScm.runBatch
+DEFAULT_BATCH_WIDTH = 8
+
+class BatchItem(object):
+    '''
+    The outcome of one command in a batch (see BaseScm.runBatch).
+    'output' holds the command output on success, 'error' the ScmError raised on failure.
+    'elapsed' is the wall time of the command in seconds.
+    '''
+    __slots__ = ('args', 'cwd', 'output', 'error', 'elapsed')
+
+    def __init__(self, args, cwd=None):
+        self.args = args
+        self.cwd = cwd
+        self.output = None
+        self.error = None
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+class BatchResult(object):
+    '''
+    The results of a batch of commands, in submission order.
+    totalTime is the sum of the wall time of every command (the cost of running them one after another),
+    criticalPathTime is the wall time of the slowest command (the lower bound for the batch) and
+    wallTime is how long the batch actually took.
+    '''
+    def __init__(self, items, wallTime):
+        self.items = items
+        self.wallTime = wallTime
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    @property
+    def totalTime(self):
+        return sum(item.elapsed for item in self.items)
+
+    @property
+    def criticalPathTime(self):
+        return max([item.elapsed for item in self.items] or [0.0])
+
+    @property
+    def outputs(self):
+        return [item.output for item in self.items]
+
+    @property
+    def errors(self):
+        return [item.error for item in self.items if item.error is not None]
+
+    '''
+    Raise the error of the first failed command, if any. Returns self otherwise.
+    '''
+    def check(self):
+        for item in self.items:
+            if item.error is not None:
+                raise item.error
+        return self
@@ -0,0 +1,88 @@
+import collections
+import threading
+
+#default number of query results kept by a cache
+DEFAULT_CACHE_SIZE = 256
+
+class ScmCache(object):
+    '''
+    Least-recently-used store for the results of read-only scm queries.
+    Keys are built by BaseScm.cachedQuery from the query name, its arguments and the repository state,
+    so a result is only reused while the repository is unchanged. Mutating scm methods drop the entries
+    of the queries they affect (see BaseScm.invalidatesCache).
+    '''
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        if maxsize < 1:
+            raise ValueError("Cache size must be at least 1")
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    '''
+    Look up a key. Returns a (found, value) tuple and updates the hit/miss counters.
+    '''
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                value = self.entries.pop(key)
+                self.entries[key] = value
+                self.hits += 1
+                return (True, value)
+            self.misses += 1
+            return (False, None)
+
+    '''
+    Store a value, evicting the least recently used entries if the cache is full.
+    '''
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                del self.entries[key]
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    '''
+    Drop the cached results of the given query names. If names is empty or None, drop everything.
+    '''
+    def invalidate(self, names=None):
+        with self.lock:
+            if not names:
+                dropped = len(self.entries)
+                self.entries.clear()
+            else:
+                stale = [key for key in self.entries if key[0] in names]
+                dropped = len(stale)
+                for key in stale:
+                    del self.entries[key]
+            self.invalidations += dropped
+
+    '''
+    Drop all entries and reset the counters.
+    '''
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.invalidations = 0
+
+    '''
+    Returns a dictionary with the cache counters: hits, misses, evictions, invalidations, size and maxsize
+    '''
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+            }
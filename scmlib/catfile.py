@@ -0,0 +1,191 @@
+import os
+import subprocess
+import threading
+
+from .errors import ScmError
+
+'''
+Parse the raw contents of a git commit object.
+Returns a dictionary with the tree id ('tree'), parent ids ('parents'), the raw author and committer
+identities ('author', 'committer') split into (name, email, epoch, offset) and the message text ('message').
+The offset is the timezone offset of the identity in seconds east of UTC.
+'''
+def parseCommit(data):
+    if not isinstance(data, str):
+        data = data.decode('utf-8', 'replace')
+
+    header, sep, message = data.partition("\n\n")
+    commit = {
+        'tree': None,
+        'parents': [],
+        'author': None,
+        'committer': None,
+        'message': message,
+    }
+    for line in header.splitlines():
+        if line.startswith(" "):
+            #continuation line of a multi-line header (gpgsig, mergetag, etc.)
+            continue
+        key, sep, value = line.partition(" ")
+        if key == "tree":
+            commit['tree'] = value
+        elif key == "parent":
+            commit['parents'].append(value)
+        elif key in ("author", "committer"):
+            commit[key] = parseIdentity(value)
+    return commit
+
+'''
+Parse a git identity line ("Name <email> epoch +hhmm") into a (name, email, epoch, offset) tuple.
+The offset is returned in seconds east of UTC.
+'''
+def parseIdentity(value):
+    name, sep, rest = value.partition("<")
+    email, sep, stamp = rest.partition(">")
+    parts = stamp.split()
+    epoch = int(parts[0]) if len(parts) > 0 else 0
+    offset = 0
+    if len(parts) > 1:
+        tz = parts[1]
+        sign = -1 if tz.startswith("-") else 1
+        tz = tz.lstrip("+-")
+        offset = sign * (int(tz[:-2] or 0) * 3600 + int(tz[-2:]) * 60)
+    return (name.strip(), email.strip(), epoch, offset)
+
+class GitCatFile(object):
+    '''
+    A long-lived 'git cat-file --batch' co-process used to look up objects and resolve revisions
+    without starting a new git process for every query.
+    Requests are written one per line to the process stdin and the response is read back from stdout,
+    so queries are serialized with a lock.
+    '''
+    def __init__(self, toolpath, cwd):
+        self.toolpath = toolpath
+        self.cwd = cwd
+        self.lock = threading.Lock()
+        self.batch = None
+        self.check = None
+
+    '''
+    Private function to start one of the cat-file co-processes ('--batch' or '--batch-check')
+    '''
+    def _start(self, mode):
+        cmd = [self.toolpath, 'cat-file', mode]
+        #stderr is discarded: nothing reads it while the process runs, so warnings could fill the pipe and block git
+        devnull = open(os.devnull, 'wb')
+        try:
+            return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull, cwd=self.cwd)
+        except OSError as e:
+            raise ScmError("Unable to start {0}: {1}".format(" ".join(cmd), e))
+        finally:
+            devnull.close()
+
+    '''
+    Private function to send a single request to a co-process and read back the response header line.
+    Returns the co-process and the header split into fields.
+    Raises ScmError if the co-process has died, after which the worker is closed.
+    '''
+    def _request(self, mode, name):
+        if "\n" in name:
+            raise ScmError("Invalid object name {0!r}".format(name))
+
+        attr = "batch" if mode == "--batch" else "check"
+        proc = getattr(self, attr)
+        if proc is None or proc.poll() is not None:
+            proc = self._start(mode)
+            setattr(self, attr, proc)
+
+        try:
+            proc.stdin.write((name + "\n").encode('utf-8'))
+            proc.stdin.flush()
+            header = proc.stdout.readline()
+        except (IOError, OSError, ValueError) as e:
+            self._close()
+            raise ScmError("git cat-file co-process failed: {0}".format(e))
+
+        if not header:
+            self._close()
+            raise ScmError("git cat-file co-process exited unexpectedly")
+        return proc, header.decode('utf-8', 'replace').split()
+
+    '''
+    Resolve a revision expression (e.g. "HEAD", a branch name or an abbreviated hash) to an object id.
+    Returns a (oid, type, size) tuple or None if the object does not exist.
+    Raises ScmError if the co-process cannot be used.
+    '''
+    def info(self, name):
+        with self.lock:
+            proc, fields = self._request("--batch-check", name)
+        if len(fields) < 3 or fields[-1] in ("missing", "ambiguous"):
+            return None
+        return (fields[0], fields[1], int(fields[2]))
+
+    '''
+    Read the object for the given revision expression.
+    Returns a (oid, type, data) tuple, where data is the raw object content in bytes, or None if the object does not exist.
+    Raises ScmError if the co-process cannot be used.
+    '''
+    def read(self, name):
+        with self.lock:
+            proc, fields = self._request("--batch", name)
+            if len(fields) < 3 or fields[-1] in ("missing", "ambiguous"):
+                return None
+            size = int(fields[2])
+            try:
+                data = proc.stdout.read(size)
+                proc.stdout.read(1) #trailing newline after the object content
+            except (IOError, OSError, ValueError) as e:
+                self._close()
+                raise ScmError("git cat-file co-process failed: {0}".format(e))
+            if len(data) != size:
+                self._close()
+                raise ScmError("git cat-file co-process returned a truncated object")
+        return (fields[0], fields[1], data)
+
+    '''
+    Read and parse the commit for the given revision expression (see parseCommit).
+    Returns a (oid, commit) tuple or None if the revision does not resolve to a commit.
+    '''
+    def readCommit(self, name):
+        result = self.read(name + "^{commit}")
+        if result is None:
+            return None
+        oid, objtype, data = result
+        if objtype != "commit":
+            return None
+        return (oid, parseCommit(data))
+
+    '''
+    Private function to stop the co-processes. Caller must handle locking.
+    '''
+    def _close(self):
+        for attr in ("batch", "check"):
+            proc = getattr(self, attr)
+            setattr(self, attr, None)
+            if proc is None:
+                continue
+            try:
+                proc.stdin.close()
+            except (IOError, OSError):
+                pass
+            try:
+                proc.wait()
+            except OSError:
+                pass
+            try:
+                proc.stdout.close()
+            except (IOError, OSError):
+                pass
+
+    '''
+    Stop the co-processes. They will be restarted on the next request.
+    '''
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def __del__(self):
+        try:
+            self._close()
+        except Exception:
+            pass
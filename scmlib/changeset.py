@@ -0,0 +1,196 @@
+import datetime
+import time
+
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+#most calendar days kept by _dayValues; the cache is emptied when it is full
+DAY_CACHE_SIZE = 4096
+
+#ordinal -> (iso, ts_aligned, iso_aligned), see _dayValues
+_dayCache = {}
+
+'''
+Private function returning the (iso, ts_aligned, iso_aligned) values for a calendar day, given as a proleptic
+Gregorian ordinal. Cached, since the changesets of a log share few distinct days.
+'''
+def _dayValues(ordinal):
+    values = _dayCache.get(ordinal)
+    if values is None:
+        day = datetime.datetime.fromordinal(ordinal)
+        #same as BaseScm.alignTimestamp: the Monday of the work week
+        aligned = day - datetime.timedelta(days=day.weekday())
+        values = (day.isocalendar(), str(aligned), aligned.isocalendar())
+        if len(_dayCache) >= DAY_CACHE_SIZE:
+            _dayCache.clear()
+        _dayCache[ordinal] = values
+    return values
+
+class Changeset(object):
+    '''
+    A single changeset returned by log and getAncestors.
+    Stores the raw commit date as a unix epoch plus the timezone offset (seconds east of UTC). The derived date
+    views ('timestamp', 'date', 'iso', 'ts_aligned', 'iso_aligned') are computed on first access, in the
+    timezone given by the offset.
+    Supports read access like the dictionaries previously returned (changeset['hash'], 'message' in changeset,
+    changeset.get('branch'), etc.) and compares equal to a dictionary with the same keys and values.
+    Optional fields ('id', 'message', 'branch') are left out of the keys when they are not set.
+    '''
+    __slots__ = ('hash', 'parents', 'idsid', 'epoch', 'offset', 'message', 'id', 'branch', '_tm')
+
+    #keys in the order the dictionaries used to be filled in
+    KEYS = ('id', 'hash', 'parents', 'idsid', 'timestamp', 'date', 'iso', 'ts_aligned', 'iso_aligned', 'message', 'branch')
+    OPTIONAL = ('id', 'message', 'branch')
+    STORED = ('hash', 'parents', 'idsid', 'epoch', 'offset', 'message', 'id', 'branch')
+
+    def __init__(self, hash, parents, idsid, epoch, offset=0, message=None, id=None, branch=None):
+        self.hash = hash
+        self.parents = parents
+        self.idsid = idsid
+        self.epoch = epoch
+        self.offset = offset
+        self.message = message
+        self.id = id
+        self.branch = branch
+        self._tm = None
+
+    '''
+    Private function returning the commit date in its own timezone as a time.struct_time
+    '''
+    def _local(self):
+        tm = self._tm
+        if tm is None:
+            tm = time.gmtime(self.epoch + self.offset)
+            self._tm = tm
+        return tm
+
+    @property
+    def datetime(self):
+        return datetime.datetime(*self._local()[:6])
+
+    @property
+    def timestamp(self):
+        return "%04d-%02d-%02d %02d:%02d:%02d" % self._local()[:6]
+
+    @property
+    def date(self):
+        tm = self._local()
+        return "%s %s %d %02d:%02d:%02d %d" % (DAY_NAMES[tm.tm_wday], MONTH_NAMES[tm.tm_mon - 1], tm.tm_mday, tm.tm_hour, tm.tm_min, tm.tm_sec, tm.tm_year)
+
+    @property
+    def iso(self):
+        return self._dayValues()[0]
+
+    @property
+    def ts_aligned(self):
+        return self._dayValues()[1]
+
+    @property
+    def iso_aligned(self):
+        return self._dayValues()[2]
+
+    def _dayValues(self):
+        tm = self._local()
+        return _dayValues(datetime.date(tm.tm_year, tm.tm_mon, tm.tm_mday).toordinal())
+
+    def keys(self):
+        return [key for key in self.KEYS if key not in self.OPTIONAL or getattr(self, key) is not None]
+
+    def values(self):
+        return [getattr(self, key) for key in self.keys()]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def get(self, key, default=None):
+        if key in self.KEYS:
+            value = getattr(self, key)
+            if value is not None or key not in self.OPTIONAL:
+                return value
+        return default
+
+    '''
+    Returns the changeset as a plain dictionary (e.g. for JSON output)
+    '''
+    def asDict(self):
+        return dict(self.items())
+
+    def __getitem__(self, key):
+        if key in self.KEYS:
+            value = getattr(self, key)
+            if value is not None or key not in self.OPTIONAL:
+                return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.STORED:
+            raise KeyError("Changeset field {0} cannot be set".format(key))
+        setattr(self, key, value)
+        if key in ('epoch', 'offset'):
+            self._tm = None
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, Changeset):
+            other = other.asDict()
+        elif not isinstance(other, dict):
+            return NotImplemented
+        return self.asDict() == other
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __copy__(self):
+        return self.__deepcopy__()
+
+    def __deepcopy__(self, memo=None):
+        result = self.__class__.__new__(self.__class__)
+        for cls in self.__class__.__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                setattr(result, name, getattr(self, name))
+        result.parents = list(self.parents)
+        return result
+
+    def __repr__(self):
+        return "{0}({1!r})".format(self.__class__.__name__, self.asDict())
+
+class HgChangeset(Changeset):
+    '''
+    A mercurial changeset. Same as Changeset, but 'date' zero-pads the day of the month like mercurial's date filter.
+    '''
+    __slots__ = ()
+
+    @property
+    def date(self):
+        tm = self._local()
+        return "%s %s %02d %02d:%02d:%02d %d" % (DAY_NAMES[tm.tm_wday], MONTH_NAMES[tm.tm_mon - 1], tm.tm_mday, tm.tm_hour, tm.tm_min, tm.tm_sec, tm.tm_year)
+
+class BranchChangeset(Changeset):
+    '''
+    The head changeset of a branch, returned by getBranches. Same as Changeset, plus the full ref name ('ref') and,
+    when requested, the number of commits the branch is ahead of and behind the main branch ('ahead', 'behind').
+    '''
+    __slots__ = ('ref', 'ahead', 'behind')
+
+    KEYS = Changeset.KEYS + ('ref', 'ahead', 'behind')
+    OPTIONAL = Changeset.OPTIONAL + ('ref', 'ahead', 'behind')
+    STORED = Changeset.STORED + ('ref', 'ahead', 'behind')
+
+    def __init__(self, hash, parents, idsid, epoch, offset=0, message=None, id=None, branch=None, ref=None, ahead=None, behind=None):
+        super(BranchChangeset, self).__init__(hash, parents, idsid, epoch, offset, message, id, branch)
+        self.ref = ref
+        self.ahead = ahead
+        self.behind = behind
@@ -0,0 +1,122 @@
+import array
+import posixpath
+
+from .fileindex import FileIndex
+
+class Churn(object):
+    '''
+    Line churn statistics returned by getChurn and getChurnLog, stored as columns with one row per changed file
+    (per commit, for getChurnLog):
+      'pathId'   - index of the file path in 'paths' (the new path of a renamed file)
+      'added'    - number of added lines
+      'deleted'  - number of deleted lines
+      'binary'   - 1 for a binary file (no line counts), 0 otherwise
+      'authorId' - index of the commit author in 'authors', -1 when the rows do not come from commits
+    The columns are array.array objects, which NumPy can wrap without a copy (numpy.frombuffer(churn.added, ...)).
+    The aggregations (byPath, byDirectory, byExtension, byAuthor) sum the rows per path once, then group the
+    distinct paths, so the group key is computed once per path rather than once per row.
+    '''
+    def __init__(self):
+        self.paths = []
+        self.authors = []
+        self.pathId = array.array('L')
+        self.added = array.array('L')
+        self.deleted = array.array('L')
+        self.binary = array.array('B')
+        self.authorId = array.array('l')
+        self.pathIds = {}
+        self.authorIds = {}
+
+    '''
+    Append a row for a changed file. 'added' and 'deleted' are None for a binary file.
+    '''
+    def add(self, path, added, deleted, author=None):
+        pathId = self.pathIds.get(path)
+        if pathId is None:
+            pathId = len(self.paths)
+            self.pathIds[path] = pathId
+            self.paths.append(path)
+        authorId = -1
+        if author is not None:
+            authorId = self.authorIds.get(author)
+            if authorId is None:
+                authorId = len(self.authors)
+                self.authorIds[author] = authorId
+                self.authors.append(author)
+        self.pathId.append(pathId)
+        self.added.append(added or 0)
+        self.deleted.append(deleted or 0)
+        self.binary.append(1 if added is None else 0)
+        self.authorId.append(authorId)
+
+    def __len__(self):
+        return len(self.pathId)
+
+    '''
+    Returns the (added, deleted) line totals of all the rows
+    '''
+    def totals(self):
+        return sum(self.added), sum(self.deleted)
+
+    '''
+    Private function returning the added and deleted line sums per path id, as two arrays indexed by path id
+    '''
+    def _sumByPath(self):
+        added = array.array('L', [0]) * len(self.paths)
+        deleted = array.array('L', added)
+        for pathId, a, d in zip(self.pathId, self.added, self.deleted):
+            added[pathId] += a
+            deleted[pathId] += d
+        return added, deleted
+
+    '''
+    Private function to sum the per path totals by group: 'key' maps a path to its group name
+    Returns a dictionary of group name -> (added, deleted)
+    '''
+    def _groupPaths(self, key):
+        added, deleted = self._sumByPath()
+        groups = {}
+        for pathId, path in enumerate(self.paths):
+            name = key(path)
+            total = groups.get(name, (0, 0))
+            groups[name] = (total[0] + added[pathId], total[1] + deleted[pathId])
+        return groups
+
+    '''
+    Returns a dictionary of path -> (added, deleted)
+    '''
+    def byPath(self):
+        added, deleted = self._sumByPath()
+        return dict((path, (added[i], deleted[i])) for i, path in enumerate(self.paths))
+
+    '''
+    Returns a dictionary of directory -> (added, deleted). With 'depth', the directories are truncated to their
+    first 'depth' levels (depth=1 groups by top level directory); otherwise each file counts for its own directory.
+    Files at the root of the repo are grouped under "".
+    '''
+    def byDirectory(self, depth=None):
+        if depth is None:
+            return self._groupPaths(posixpath.dirname)
+        return self._groupPaths(lambda path: "/".join(path.split("/")[:-1][:depth]))
+
+    '''
+    Returns a dictionary of extension (including the dot, "" for none) -> (added, deleted)
+    '''
+    def byExtension(self):
+        return self._groupPaths(FileIndex._extension)
+
+    '''
+    Returns a dictionary of author -> (added, deleted). Rows without an author are left out.
+    '''
+    def byAuthor(self):
+        added = array.array('L', [0]) * len(self.authors)
+        deleted = array.array('L', added)
+        for authorId, a, d in zip(self.authorId, self.added, self.deleted):
+            if authorId >= 0:
+                added[authorId] += a
+                deleted[authorId] += d
+        return dict((author, (added[i], deleted[i])) for i, author in enumerate(self.authors))
+
+    def __repr__(self):
+        added, deleted = self.totals()
+        return "Churn({0} rows, {1} files, +{2} -{3})".format(len(self), len(self.paths), added, deleted)
@@ -0,0 +1,271 @@
+import calendar
+import datetime
+import sqlite3
+import threading
+import time
+
+from .errors import ScmError
+
+#name of the index database, kept in the .git or .hg directory of the repo
+INDEX_FILENAME = "scmlib-commitindex.sqlite"
+
+#bump when the schema changes; an index with a different version is rebuilt from scratch
+SCHEMA_VERSION = 1
+
+#date strings with an explicit time of day; interpreted as local time, the same as git and mercurial do
+_DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S")
+
+'''
+Convert a log date bound to a unix epoch for an index query.
+Accepts an epoch (int/float), a datetime (naive values are local time) or a "YYYY-MM-DD HH:MM:SS" string.
+Returns None for anything else (relative dates, dates without a time, etc.), which the caller should leave to the scm tool.
+'''
+def parseDateBound(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, datetime.datetime):
+        #datetime.timestamp is Python 3 only
+        if value.utcoffset() is not None:
+            return calendar.timegm(value.utctimetuple())
+        return int(time.mktime(value.timetuple()))
+    if isinstance(value, str):
+        for fmt in _DATE_FORMATS:
+            try:
+                return int(time.mktime(time.strptime(value.strip(), fmt)))
+            except ValueError:
+                continue
+    return None
+
+class CommitIndex(object):
+    '''
+    Persistent index of the commits of a repo, stored in an SQLite database.
+    Holds one row per commit with its hash, parents, author, dates (author epoch and offset, commit time and
+    ISO week), branch and message summary, and answers date/author/limit and first-parent ancestor queries.
+    The scm classes fill the index incrementally (see GitScm.updateCommitIndex, HgScm.updateCommitIndex) and keep
+    their own bookkeeping in the meta table. Git indexes also track which commits are reachable from HEAD, in log order.
+    Access is serialized with a lock, so an index can be shared between threads.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self._createSchema()
+        except sqlite3.Error as e:
+            raise ScmError("Unable to open commit index {0}: {1}".format(path, e))
+
+    '''
+    Private function to create the tables, dropping an index built with a different schema version
+    '''
+    def _createSchema(self):
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+            if row is not None and row[0] != str(SCHEMA_VERSION):
+                self.db.execute("DROP TABLE IF EXISTS commits")
+                self.db.execute("DROP TABLE IF EXISTS reachable")
+                self.db.execute("DELETE FROM meta")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS commits (
+                seq INTEGER PRIMARY KEY,
+                hash TEXT UNIQUE NOT NULL,
+                rev INTEGER,
+                parent1 TEXT,
+                parents TEXT NOT NULL,
+                author TEXT,
+                email TEXT,
+                epoch INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                ctime INTEGER NOT NULL,
+                isoyear INTEGER,
+                isoweek INTEGER,
+                branch TEXT,
+                message TEXT)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS commits_ctime ON commits (ctime)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS commits_rev ON commits (rev)")
+            #commits reachable from HEAD (git), numbered in log order
+            self.db.execute("CREATE TABLE IF NOT EXISTS reachable (hash TEXT PRIMARY KEY, pos INTEGER NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS reachable_pos ON reachable (pos)")
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+
+    def getMeta(self, key, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def setMeta(self, key, value):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    '''
+    Add commits to the index. Each commit is a dictionary with 'hash', 'parents' (list), 'author', 'epoch',
+    'offset' (seconds east of UTC) and optionally 'email', 'ctime' (defaults to epoch), 'rev', 'branch' and 'message'.
+    Commits already in the index are left unchanged. Returns the number of new commits.
+    '''
+    def addCommits(self, commits):
+        rows = []
+        for c in commits:
+            parents = c['parents']
+            tm = time.gmtime(c['epoch'] + c['offset'])
+            iso = datetime.date(tm.tm_year, tm.tm_mon, tm.tm_mday).isocalendar()
+            rows.append((c['hash'], c.get('rev'), parents[0] if len(parents) > 0 else None, " ".join(parents),
+                         c['author'], c.get('email'), c['epoch'], c['offset'], c.get('ctime', c['epoch']),
+                         iso[0], iso[1], c.get('branch'), c.get('message')))
+        with self.lock, self.db:
+            before = self.db.total_changes
+            self.db.executemany("""INSERT OR IGNORE INTO commits
+                (hash, rev, parent1, parents, author, email, epoch, offset, ctime, isoyear, isoweek, branch, message)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+            return self.db.total_changes - before
+
+    '''
+    Replace the list of commits reachable from HEAD. 'hashes' must be in the order git log lists them (newest first),
+    which is the order reachable queries return them in.
+    '''
+    def setReachable(self, hashes):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM reachable")
+            count = len(hashes)
+            self.db.executemany("INSERT OR IGNORE INTO reachable (hash, pos) VALUES (?, ?)",
+                                [(hash, count - i) for i, hash in enumerate(hashes)])
+
+    '''
+    Add commits on top of the list of commits reachable from HEAD, after HEAD moved forward.
+    'hashes' must be in git log order (newest first).
+    '''
+    def addReachable(self, hashes):
+        with self.lock, self.db:
+            top = self.db.execute("SELECT COALESCE(MAX(pos), 0) FROM reachable").fetchone()[0]
+            count = len(hashes)
+            self.db.executemany("INSERT OR IGNORE INTO reachable (hash, pos) VALUES (?, ?)",
+                                [(hash, top + count - i) for i, hash in enumerate(hashes)])
+
+    '''
+    Returns True if the commit is in the index
+    '''
+    def contains(self, hash):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM commits WHERE hash = ?", (hash,)).fetchone() is not None
+
+    '''
+    Returns the row dictionary of an indexed commit (see _rowDict), or None if it is not in the index
+    '''
+    def get(self, hash):
+        with self.lock:
+            cursor = self.db.execute("SELECT * FROM commits WHERE hash = ?", (hash,))
+            cursor.row_factory = sqlite3.Row
+            row = cursor.fetchone()
+        return None if row is None else CommitIndex._rowDict(row)
+
+    '''
+    Returns the full hash of the indexed commit starting with the given (lowercase hex) prefix, or None if there is not exactly one
+    '''
+    def expand(self, prefix):
+        with self.lock:
+            rows = self.db.execute("SELECT hash FROM commits WHERE hash >= ? AND hash < ? LIMIT 2", (prefix, prefix + "g")).fetchall()
+        return rows[0][0] if len(rows) == 1 else None
+
+    '''
+    Returns the number of indexed commits
+    '''
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM commits").fetchone()[0]
+
+    '''
+    Query the index. Returns a list of row dictionaries (see _rowDict), newest first.
+    'start' and 'end' are inclusive unix epoch bounds on the commit time. 'author' is matched as a substring of
+    "name <email>" (case-insensitive if ignoreCase is set). If reachableOnly is set, only commits reachable from
+    HEAD are returned, in git log order (git). Otherwise all commits are returned by descending revision number (hg).
+    '''
+    def query(self, start=None, end=None, author=None, ignoreCase=False, limit=None, reachableOnly=False):
+        sql = "SELECT c.* FROM commits c"
+        where = []
+        params = []
+        if reachableOnly:
+            sql += " JOIN reachable r ON r.hash = c.hash"
+        if start is not None:
+            where.append("c.ctime >= ?")
+            params.append(int(start))
+        if end is not None:
+            where.append("c.ctime <= ?")
+            params.append(int(end))
+        if len(where) > 0:
+            sql += " WHERE " + " AND ".join(where)
+        if reachableOnly:
+            sql += " ORDER BY r.pos DESC"
+        else:
+            sql += " ORDER BY c.rev DESC, c.seq DESC"
+
+        if author is not None:
+            needle = author.lower() if ignoreCase else author
+            rows = []
+            with self.lock:
+                cursor = self.db.execute(sql, params)
+                cursor.row_factory = sqlite3.Row
+                for row in cursor:
+                    ident = "{0} <{1}>".format(row['author'], row['email']) if row['email'] is not None else row['author']
+                    if ignoreCase:
+                        ident = ident.lower()
+                    if needle in ident:
+                        rows.append(CommitIndex._rowDict(row))
+                        if limit is not None and len(rows) >= int(limit):
+                            break
+            return rows
+
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self.lock:
+            cursor = self.db.execute(sql, params)
+            cursor.row_factory = sqlite3.Row
+            return [CommitIndex._rowDict(row) for row in cursor]
+
+    '''
+    Returns the first-parent chain starting at the given commit as a list of row dictionaries, at most 'limit' long.
+    Returns None if the chain leaves the index before reaching a root commit or the limit.
+    '''
+    def ancestors(self, hash, limit=None):
+        limit = -1 if limit is None else int(limit)
+        if limit == 0:
+            return []
+        with self.lock:
+            cursor = self.db.execute("""
+                WITH RECURSIVE chain(hash, depth) AS (
+                    SELECT ?, 0
+                    UNION ALL
+                    SELECT c.parent1, chain.depth + 1 FROM chain JOIN commits c ON c.hash = chain.hash
+                    WHERE c.parent1 IS NOT NULL LIMIT ?)
+                SELECT c.* FROM chain LEFT JOIN commits c ON c.hash = chain.hash ORDER BY chain.depth""", (hash, limit))
+            cursor.row_factory = sqlite3.Row
+            rows = cursor.fetchall()
+        if len(rows) == 0 or any(row['hash'] is None for row in rows):
+            return None
+        if limit < 0 or len(rows) < limit:
+            #the chain must end at a root commit, not at a commit missing from the index
+            if rows[-1]['parent1'] is not None:
+                return None
+        return [CommitIndex._rowDict(row) for row in rows]
+
+    '''
+    Private function to convert a database row into a dictionary
+    '''
+    @staticmethod
+    def _rowDict(row):
+        result = dict(zip(row.keys(), row))
+        result['parents'] = result['parents'].split() if result['parents'] else []
+        return result
+
+    '''
+    Drop every indexed commit and all bookkeeping
+    '''
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM commits")
+            self.db.execute("DELETE FROM reachable")
+            self.db.execute("DELETE FROM meta WHERE key != 'schema'")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,5 +1,8 @@
 from .basescm import BaseScm
 from .errors import ScmError
+from .churn import Churn
+from .fileindex import FileIndex
+from .patch import Patch
 
 class DummyScm(BaseScm):
     '''
@@ -33,10 +36,14 @@ class DummyScm(BaseScm):
     def push(self):
         self.debugPrint("Pushing to repo")
         
-    def status(self, type=None, include=None, exclude=None):
+    def status(self, type=None, include=None, exclude=None, untracked=None):
         self.debugPrint("Getting status")
         return []
 
+    def iterStatus(self, type=None, include=None, exclude=None, untracked=None):
+        self.debugPrint("Getting status")
+        return iter([])
+
     def gotoRevision(self, revision=None):
         self.debugPrint("Going to revision {0}".format(revision))
 
@@ -53,7 +60,7 @@ class DummyScm(BaseScm):
         self.debugPrint("Getting branch {0}".format(branch))
         return branch
         
-    def getBranches(self):
+    def getBranches(self, remotes=False, aheadBehind=False):
         self.debugPrint("Getting list of branches")
         return ["dummyBranch"]
         
@@ -77,10 +84,30 @@ class DummyScm(BaseScm):
     def getPatch(self, rev1=None, rev2=None, outfile=None, context=5, stat=False, include=None, exclude=None, submodules=True):
         self.debugPrint("Getting patch")
         return ""
+
+    def iterPatch(self, rev1=None, rev2=None, context=5, stat=False, include=None, exclude=None, submodules=True):
+        self.debugPrint("Streaming patch")
+        return iter([])
+
+    def getStructuredPatch(self, rev1=None, rev2=None, context=5, include=None, exclude=None, submodules=True):
+        self.debugPrint("Getting structured patch")
+        return Patch()
+
+    def getChurn(self, rev1=None, rev2=None, include=None, exclude=None):
+        self.debugPrint("Getting churn")
+        return Churn()
+
+    def getChurnLog(self, rev1=None, rev2=None, startdate=None, enddate=None, include=None, exclude=None):
+        self.debugPrint("Getting churn log")
+        return Churn()
         
     def log(self, revision=None, limit=None):
         self.debugPrint("Getting log for revision {0} with limit {1}".format(revision, limit))
         return []
+
+    def iterLog(self, revision=None, limit=None, file=None, startdate=None, enddate=None, author=None):
+        self.debugPrint("Streaming log for revision {0} with limit {1}".format(revision, limit))
+        return iter([])
         
     def getTags(self, filter=None):
         self.debugPrint("Getting tags for dummy repo")
@@ -93,9 +120,21 @@ class DummyScm(BaseScm):
         self.debugPrint("Getting latest tag in repo")
         return []
 
+    def getTagsContaining(self, revision):
+        self.debugPrint("Getting tags containing revision {0}".format(revision))
+        return []
+
     def getFiles(self):
         self.debugPrint("Getting list of all files in repo")
         return []
+
+    def iterFiles(self, revision=None):
+        self.debugPrint("Getting list of all files in repo")
+        return iter([])
+
+    def getFileIndex(self, revision=None):
+        self.debugPrint("Getting index of all files in repo")
+        return FileIndex("")
         
     def revertFile(self, filename=None):
         self.debugPrint("Reverting changes to files {0}".format(filename))
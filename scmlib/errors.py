@@ -17,3 +17,7 @@ class ScmCommandError(ScmError):
         errstr += "\n" + "Command=" + str(self.cmd)
         errstr += "\n" + "Return code=" + str(self.rc)
         return errstr
+
+#raised by the in-process git object reader when it cannot answer a query (missing object, unsupported repo format, etc.)
+class ScmObjectError(ScmError):
+    pass
@@ -0,0 +1,194 @@
+import array
+import fnmatch
+import re
+
+#characters that start a wildcard in a glob pattern (see fnmatch)
+GLOB_CHARS = "*?["
+
+class FileIndex(object):
+    '''
+    Sorted, compact list of the tracked file paths of a revision, returned by getFileIndex.
+    The paths are kept in one NUL separated string with an array of offsets (instead of one string object per path),
+    sorted by code point, which is the order git lists them in. Prefix and glob queries find the matching range by
+    bisection; extension queries use a second array of positions sorted by extension, built on first use.
+    'key' identifies what the index was built from (the git tree id or mercurial changeset id).
+    Supports len(), iteration, indexing and 'in' like the list returned by getFiles.
+    '''
+    def __init__(self, data, key=None):
+        #data holds the NUL terminated paths, in order
+        if len(data) > 0 and not data.endswith("\0"):
+            data += "\0"
+        self.data = data
+        self.key = key
+        self.offsets = FileIndex._offsets(data)
+        self.byExtension = None
+        if not self._isSorted():
+            self.data = "".join(path + "\0" for path in sorted(self))
+            self.offsets = FileIndex._offsets(self.data)
+
+    '''
+    Build an index from an iterable of paths, in any order
+    '''
+    @classmethod
+    def fromPaths(cls, paths, key=None):
+        return cls("".join(path + "\0" for path in sorted(paths)), key)
+
+    '''
+    Private function returning the array of the offsets where each path of 'data' starts, and the end of the data
+    '''
+    @staticmethod
+    def _offsets(data):
+        offsets = array.array('L', [0])
+        end = 0
+        for path in data.split("\0")[:-1]:
+            end += len(path) + 1
+            offsets.append(end)
+        return offsets
+
+    '''
+    Private function returning True if the paths are in order
+    '''
+    def _isSorted(self):
+        previous = None
+        for path in self:
+            if previous is not None and path < previous:
+                return False
+            previous = path
+        return True
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("file index out of range")
+        return self.data[self.offsets[index]:self.offsets[index + 1] - 1]
+
+    def __iter__(self):
+        offsets = self.offsets
+        data = self.data
+        for i in range(len(offsets) - 1):
+            yield data[offsets[i]:offsets[i + 1] - 1]
+
+    def __contains__(self, path):
+        index = self._bisect(path)
+        return index < len(self) and self[index] == path
+
+    def __repr__(self):
+        return "FileIndex({0} files, key={1!r})".format(len(self), self.key)
+
+    '''
+    Private function returning the position of the first path not less than 'value'
+    '''
+    def _bisect(self, value, lo=0, hi=None):
+        if hi is None:
+            hi = len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    '''
+    Private function returning the (start, end) positions of the paths starting with 'prefix'
+    '''
+    def _prefixRange(self, prefix):
+        if len(prefix) == 0:
+            return 0, len(self)
+        start = self._bisect(prefix)
+        #the paths from 'start' on do not sort before the prefix, so the ones starting with it come first
+        end = start
+        hi = len(self)
+        while end < hi:
+            mid = (end + hi) // 2
+            if self[mid].startswith(prefix):
+                end = mid + 1
+            else:
+                hi = mid
+        return start, end
+
+    '''
+    Generator yielding the paths starting with 'prefix', in order. Use a trailing '/' to list a directory.
+    '''
+    def iterPrefix(self, prefix):
+        start, end = self._prefixRange(prefix)
+        for i in range(start, end):
+            yield self[i]
+
+    '''
+    Returns the list of paths starting with 'prefix' (see iterPrefix)
+    '''
+    def prefix(self, prefix):
+        return list(self.iterPrefix(prefix))
+
+    '''
+    Generator yielding the paths matching a glob pattern (fnmatch syntax, case-sensitive; '*' also matches '/').
+    Only the paths sharing the literal part of the pattern before the first wildcard are tested.
+    '''
+    def iterGlob(self, pattern):
+        literal = pattern
+        for i, c in enumerate(pattern):
+            if c in GLOB_CHARS:
+                literal = pattern[:i]
+                break
+        match = re.compile(fnmatch.translate(pattern)).match
+        for path in self.iterPrefix(literal):
+            if match(path):
+                yield path
+
+    '''
+    Returns the list of paths matching a glob pattern (see iterGlob)
+    '''
+    def glob(self, pattern):
+        return list(self.iterGlob(pattern))
+
+    '''
+    Private function returning the extension of a path, including the dot ("" if the file name has none)
+    '''
+    @staticmethod
+    def _extension(path):
+        name = path[path.rfind("/") + 1:]
+        dot = name.rfind(".")
+        return name[dot:] if dot > 0 else ""
+
+    '''
+    Generator yielding the paths with the given extension (e.g. ".c"), in path order. Case-sensitive.
+    '''
+    def iterExtension(self, extension):
+        if len(extension) > 0 and not extension.startswith("."):
+            extension = "." + extension
+        if self.byExtension is None:
+            positions = sorted(range(len(self)), key=lambda i: FileIndex._extension(self[i]))
+            self.byExtension = array.array('L', positions)
+        start = self._bisectExtension(extension, False)
+        end = self._bisectExtension(extension, True, start)
+        for i in range(start, end):
+            yield self[self.byExtension[i]]
+
+    '''
+    Private function returning the first position in the extension order whose extension is not less than
+    (or with right set, greater than) 'extension'
+    '''
+    def _bisectExtension(self, extension, right, lo=0):
+        byExtension = self.byExtension
+        hi = len(byExtension)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = FileIndex._extension(self[byExtension[mid]])
+            if value < extension or (right and value == extension):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    '''
+    Returns the list of paths with the given extension (see iterExtension)
+    '''
+    def extension(self, extension):
+        return list(self.iterExtension(extension))
@@ -0,0 +1,103 @@
+import errno
+import os
+import sys
+import time
+
+from .errors import ScmError
+
+if sys.platform.startswith('win'):
+    import msvcrt
+else:
+    import fcntl
+
+#seconds between attempts while waiting for a lock held by another process (Windows) or with a timeout
+LOCK_POLL_INTERVAL = 0.1
+
+class FileLock(object):
+    '''
+    Exclusive lock on a file, held across processes (flock on POSIX, msvcrt.locking on Windows) as well as between
+    threads, since every acquire opens the file again. The lock file is created if needed and left in place.
+    The lock is released by the OS if the process dies, so a crashed job cannot leave it held.
+    'timeout' is the number of seconds acquire waits before raising ScmError (None waits forever).
+    Can be used as a context manager.
+    '''
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.timeout = timeout
+        self.fd = None
+
+    '''
+    Acquire the lock, waiting for it if another process or thread holds it.
+    Raises ScmError if the lock could not be acquired within the timeout.
+    '''
+    def acquire(self):
+        if self.fd is not None:
+            raise ScmError("Lock {0} is already held".format(self.path))
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                #another process may have created it in the meantime
+                if e.errno != errno.EEXIST:
+                    raise
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        try:
+            while not self._tryLock(fd, deadline is None and not sys.platform.startswith('win')):
+                if deadline is not None and time.time() >= deadline:
+                    raise ScmError("Timed out waiting for lock {0}".format(self.path))
+                time.sleep(LOCK_POLL_INTERVAL)
+        except:
+            os.close(fd)
+            raise
+        self.fd = fd
+
+    '''
+    Private function to lock the open file. Returns False if it is held elsewhere and 'block' is not set.
+    '''
+    @staticmethod
+    def _tryLock(fd, block):
+        if sys.platform.startswith('win'):
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            except (IOError, OSError):
+                return False
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if block else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        return True
+
+    '''
+    Release the lock. Does nothing if it is not held.
+    '''
+    def release(self):
+        if self.fd is None:
+            return
+        try:
+            if sys.platform.startswith('win'):
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+    @property
+    def locked(self):
+        return self.fd is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def __repr__(self):
+        return "FileLock({0!r}, locked={1})".format(self.path, self.locked)
@@ -1,10 +1,72 @@
 from .basescm import BaseScm
 from .errors import ScmError
+from .errors import ScmCommandError
+from .catfile import GitCatFile
+from .changeset import BranchChangeset
+from .changeset import Changeset
+from .churn import Churn
+from .commitindex import CommitIndex
+from .commitindex import INDEX_FILENAME
+from .commitindex import parseDateBound
+from .fileindex import FileIndex
+from .gitobjects import GitObjectStore
+from .mirror import MirrorCache
+from .patch import Patch
+from .reftransaction import RefTransaction
+from .reftransaction import ZERO_OID
+from .status import StatusEntry
+from .status import TYPE_STATES
+from .submodules import Submodule
+from .submodules import parseGitlinks
+from .submodules import parseGitmodules
+from .tagindex import TagEntry
+from .tagindex import TagIndex
+from .worktrees import parseWorktrees
+from . import gitrefs
 
 import re
 import os
+import collections
 import datetime
 import sys
+import threading
+
+#number of file indexes kept per tree id by getFileIndex
+FILE_INDEX_CACHE_SIZE = 4
+
+#default number of submodules updated (and repositories read by getSubmodules) at the same time
+DEFAULT_SUBMODULE_JOBS = 4
+
+#modes of scanning for untracked files accepted by status (git status --untracked-files)
+UNTRACKED_MODES = ("all", "normal", "no")
+
+#machine readable log format used with -z and --date=raw: hash, parents, author name (mailmap applied),
+#"epoch +hhmm" author date and the raw message, each terminated by a NUL (commit messages cannot contain NUL)
+LOG_FORMAT = "%H%x00%P%x00%aN%x00%ad%x00%B"
+LOG_FIELDS = 5
+
+#log format used by getChurnLog with --numstat -z: \x01 and the hash, then the author name (mailmap applied)
+CHURN_LOG_FORMAT = "%x01%H%x00%aN"
+
+#log format used to fill the commit index: LOG_FORMAT plus the author email and the committer date (used by --after/--before)
+INDEX_FORMAT = "%H%x00%P%x00%aN%x00%aE%x00%ad%x00%ct%x00%B"
+INDEX_FIELDS = 7
+
+#for-each-ref format used by getBranches: ref name, symref target, object type, then the LOG_FORMAT fields plus the
+#author email, each terminated by a NUL. for-each-ref ends every record with a newline, which starts the next ref name
+BRANCH_FORMAT = "%(refname)%00%(symref)%00%(objecttype)%00%(objectname)%00%(parent)%00%(authorname)%00%(authoremail)%00%(authordate:raw)%00%(contents)%00"
+BRANCH_FIELDS = 9
+
+#number of identities passed to each 'git check-mailmap' call
+MAILMAP_CHUNK = 200
+
+#machine readable for-each-ref format used for the tag index: ref name, object type and id, the type and id of the
+#object an annotated tag points to, and the tagger date (unix epoch, empty for lightweight tags), each NUL terminated
+TAG_FORMAT = "%(refname)%00%(objecttype)%00%(objectname)%00%(*objecttype)%00%(*objectname)%00%(taggerdate:unix)%00"
+TAG_FIELDS = 6
+
+#characters with a special meaning in the basic regular expressions used by 'git log --author'
+AUTHOR_PATTERN_CHARS = set(".[]*^$\\")
 
 class GitScm(BaseScm):
     def __init__(self, localrepo, remoterepo=None, username=None, password=None):
@@ -35,10 +97,466 @@ class GitScm(BaseScm):
         self.remotepath = remoterepo
         self.username = username
         self.password = password
+        self.useCatFile = True
+        self.catfile = None
+        #(config file stamps, mailmap settings) read by _getMailmapConfig
+        self.mailmapConfig = None
+        self.useObjectReader = False
+        self.objects = None
+        self.useCommitIndex = False
+        self.commitindex = None
+        #whether for-each-ref supports %(ahead-behind) (git 2.41+); None until getBranches first asks for it
+        self.hasAheadBehindAtom = None
+        self.useUntrackedCache = False
+        self.useFsMonitor = False
+        self.fileindexes = collections.OrderedDict()
+        self.fileindexLock = threading.Lock()
+        self.tagindex = None
+        self.tagindexLock = threading.Lock()
+        self.submoduleJobs = DEFAULT_SUBMODULE_JOBS
+        self.mirrors = None
+        self.mirrorDissociate = False
+        self.cloneDepth = None
+        self.cloneFilter = None
+        self.cloneBranch = None
+        self.cloneSingleBranch = False
+        self.cloneSparse = None
+        self.shallowSubmodules = False
+        self.submoduleFilter = None
 
         self.toolpath = BaseScm.findToolPath("git" + ('.exe' if sys.platform.startswith('win') else ''))
         if self.toolpath is None:
             raise ScmError("Cannot find git executable. Must have git available in your PATH to use commands")
+
+    '''
+    Enable or disable the persistent 'git cat-file' co-process used for object and revision lookups.
+    If no value is specified, the current state will toggle. When disabled, every lookup runs its own git process.
+    '''
+    def setCatFile(self, value=None):
+        if value is None:
+            value = not self.useCatFile
+        self.useCatFile = bool(value)
+        if not self.useCatFile:
+            self.close()
+
+    '''
+    Enable or disable the in-process object reader (see gitobjects.GitObjectStore). If no value is specified,
+    the current state will toggle. When enabled, log, getAncestors, getFiles and getCurrentRevision
+    read refs and objects directly from the git directory instead of running git, falling back to git for
+    anything the reader cannot answer.
+    '''
+    def setObjectReader(self, value=None):
+        if value is None:
+            value = not self.useObjectReader
+        self.useObjectReader = bool(value)
+        if not self.useObjectReader and self.objects is not None:
+            self.objects.close()
+            self.objects = None
+
+    '''
+    Enable or disable the persistent commit index (see commitindex.CommitIndex), stored in the git directory.
+    If no value is specified, the current state will toggle. When enabled, log queries without a revision or file
+    and getAncestors are answered from the index, which is brought up to date with HEAD before each query.
+    '''
+    def setCommitIndex(self, value=None):
+        if value is None:
+            value = not self.useCommitIndex
+        self.useCommitIndex = bool(value)
+        if not self.useCommitIndex and self.commitindex is not None:
+            self.commitindex.close()
+            self.commitindex = None
+
+    '''
+    Use a cache of bare mirrors under the directory 'root' for clone (see mirror.MirrorCache), or stop using it if
+    root is None. With a mirror, clone fetches the remote into the mirror and clones with a reference to it, so the
+    clone borrows the mirror's objects through the alternates file and only fetches what the mirror lacks.
+    With 'dissociate', the borrowed objects are copied into the clone (--dissociate), so it does not depend on the
+    mirror afterwards. 'lockTimeout' is how long to wait (in seconds) for another job updating the same mirror.
+    '''
+    def setMirrorCache(self, root=None, dissociate=False, lockTimeout=None):
+        self.mirrors = MirrorCache(os.path.abspath(root), self, lockTimeout) if root is not None else None
+        self.mirrorDissociate = bool(dissociate)
+
+    '''
+    Fetch the remote repository into its mirror in the mirror cache (see setMirrorCache), creating the mirror if needed.
+    Returns the mirror path, or None if no mirror cache is set. Raises ScmError on error.
+    '''
+    @BaseScm.requiresRemoteRepo
+    def updateMirror(self):
+        if self.mirrors is None:
+            return None
+        return self.mirrors.update(self.remotepath)
+
+    '''
+    Set how clone narrows what it fetches and checks out. Each call replaces all the previous options, so calling it
+    without arguments restores the full clone.
+      'depth'             - only fetch the last 'depth' commits of the history (--depth, which implies 'singleBranch')
+      'filter'            - partial clone filter: "blob:none" fetches file contents when they are checked out,
+                            "tree:0" also fetches trees on demand (--filter)
+      'branch'            - branch (or tag) to check out instead of the remote HEAD (--branch)
+      'singleBranch'      - only fetch 'branch' (or the remote HEAD) and not the other branches (--single-branch)
+      'sparse'            - list of directories checked out in a cone mode sparse checkout, along with the files at
+                            the top level of the repo ([] checks out only those). Submodules are not affected.
+      'shallowSubmodules' - clone the submodules with a depth of 1 (--shallow-submodules)
+      'submoduleFilter'   - partial clone filter for the submodules, either one filter for all of them or a dictionary
+                            of top level submodule path -> filter (the submodules it does not list are cloned in full).
+                            A filter also applies to the submodules nested in the filtered submodule.
+    With a depth or a single branch (and in any shallow repo), gotoRevision fetches a revision that is not in the clone
+    before checking it out.
+    '''
+    def setCloneOptions(self, depth=None, filter=None, branch=None, singleBranch=False, sparse=None,
+                        shallowSubmodules=False, submoduleFilter=None):
+        if depth is not None and int(depth) < 1:
+            raise ScmError("Clone depth must be at least 1: {0}".format(depth))
+        self.cloneDepth = int(depth) if depth is not None else None
+        self.cloneFilter = filter
+        self.cloneBranch = branch
+        self.cloneSingleBranch = bool(singleBranch)
+        self.cloneSparse = [path.strip("/") for path in sparse] if sparse is not None else None
+        self.shallowSubmodules = bool(shallowSubmodules)
+        self.submoduleFilter = submoduleFilter
+
+    '''
+    Stop the 'git cat-file' co-process, if it is running, and release the object reader's open packs, the
+    commit index and the working copy watcher. They are set up again on the next lookup.
+    '''
+    def close(self):
+        super(GitScm, self).close()
+        if self.catfile is not None:
+            self.catfile.close()
+            self.catfile = None
+        if self.objects is not None:
+            self.objects.close()
+            self.objects = None
+        if self.commitindex is not None:
+            self.commitindex.close()
+            self.commitindex = None
+
+    '''
+    Private function to get the commit index for this repo.
+    Returns None if the index is disabled or the repo does not exist yet.
+    '''
+    def _getCommitIndex(self):
+        if not self.useCommitIndex or self.localpath is None:
+            return None
+        if self.commitindex is None:
+            gitdir = gitrefs.findGitDir(self.localpath)
+            if gitdir is None:
+                return None
+            self.commitindex = CommitIndex(os.path.join(gitdir, INDEX_FILENAME))
+        return self.commitindex
+
+    '''
+    Bring the commit index up to date with HEAD. Only the commits reachable from HEAD but not from the
+    previously indexed HEAD are read from git. The index is rebuilt if the mailmap (see _hasMailmap) or shallow file
+    changed.
+    Queries return commits in the order git log lists them, as long as commit times do not go backwards in the history.
+    Returns the number of commits added. Raises ScmError if the index is not enabled or on error.
+    '''
+    def updateCommitIndex(self):
+        index = self._getCommitIndex()
+        if index is None:
+            raise ScmError("Commit index is not enabled")
+
+        gitdir = gitrefs.findGitDir(self.localpath)
+        settings = self._getMailmapConfig()
+        mailmaps = [os.path.join(self.localpath, ".mailmap")]
+        mailmaps.extend(os.path.join(self.localpath, os.path.expanduser(value))
+                        for key, value in settings or [] if key == "mailmap.file")
+        stamp = repr(([gitrefs.fileStamp(path) for path in mailmaps], settings,
+                      gitrefs.fileStamp(os.path.join(gitrefs.findCommonDir(gitdir), "shallow"))))
+        if index.getMeta('stamp') != stamp:
+            index.clear()
+            index.setMeta('stamp', stamp)
+
+        try:
+            head = self._resolveRevision("HEAD")
+        except ScmError:
+            #no commits yet
+            head = None
+        old = index.getMeta('head')
+        if head == old:
+            return 0
+        if head is None:
+            index.setReachable([])
+            index.setMeta('head', "")
+            return 0
+
+        args = ['log', '-z', '--parents', '--date=raw', '--format=' + INDEX_FORMAT, head]
+        incremental = bool(old) and index.contains(old)
+        output = None
+        if incremental:
+            try:
+                output = self._processScmCommand(args + ['--not', old])
+            except ScmError as e:
+                #the old HEAD is gone (e.g. rewritten and garbage collected), read the whole history instead
+                self.debugPrint("incremental index update failed, reading full history: {0}".format(e))
+                incremental = False
+        if output is None:
+            output = self._processScmCommand(args)
+
+        commits = list(self._iterIndexCommits(output.split("\0")))
+        added = index.addCommits(commits)
+
+        if incremental and self._isLinearUpdate(index, old, commits):
+            index.addReachable([c['hash'] for c in commits])
+        elif incremental:
+            #HEAD moved to another line of history or merged older commits, renumber everything in log order
+            output = self._processScmCommand(['rev-list', head])
+            index.setReachable(output.split())
+        else:
+            index.setReachable([c['hash'] for c in commits])
+        index.setMeta('head', head)
+        self.debugPrint("commit index: {0} commits added".format(added))
+        return added
+
+    '''
+    Private function to check whether the new commits read by an incremental index update are listed by git log
+    in front of the previous HEAD and its history, in the same order as before. That is the case when they only
+    build on the previous HEAD and are all newer than it.
+    '''
+    def _isLinearUpdate(self, index, old, commits):
+        if len(commits) == 0:
+            return False
+        hashes = set(c['hash'] for c in commits)
+        boundary = set(p for c in commits for p in c['parents'] if p not in hashes)
+        if boundary != set([old]):
+            return False
+        oldctime = index.get(old)['ctime']
+        return all(c['ctime'] > oldctime for c in commits)
+
+    '''
+    Private generator to parse the commit index log output (see INDEX_FORMAT) into commit dictionaries for
+    CommitIndex.addCommits
+    '''
+    def _iterIndexCommits(self, fields):
+        record = []
+        for field in fields:
+            record.append(field)
+            if len(record) < INDEX_FIELDS:
+                continue
+            oid, parents, name, email, date, ctime, message = record
+            record = []
+            epoch, sep, tz = date.partition(" ")
+            offset = int(tz[1:3] or 0) * 3600 + int(tz[3:5] or 0) * 60
+            if tz.startswith("-"):
+                offset = -offset
+            yield {
+                'hash': oid,
+                'parents': parents.split(),
+                'author': name,
+                'email': email,
+                'epoch': int(epoch),
+                'offset': offset,
+                'ctime': int(ctime),
+                'message': GitScm._summaryLine(message),
+            }
+
+    '''
+    Private function to answer a log query from the commit index.
+    Returns a list of changesets, or None if the index is disabled or cannot answer the query (dates it cannot
+    interpret exactly like git, author regular expressions, errors), in which case the caller should use 'git log'.
+    '''
+    def _queryCommitIndex(self, limit=None, startdate=None, enddate=None, author=None):
+        index = self._getCommitIndex()
+        if index is None:
+            return None
+        start = parseDateBound(startdate) if startdate else None
+        end = parseDateBound(enddate) if enddate else None
+        if (startdate and start is None) or (enddate and end is None):
+            return None
+        if author is not None and len(AUTHOR_PATTERN_CHARS.intersection(author)) > 0:
+            return None
+        try:
+            self.updateCommitIndex()
+            rows = index.query(start, end, author, limit=limit, reachableOnly=True)
+        except ScmError as e:
+            self.debugPrint("commit index query failed, falling back: {0}".format(e))
+            return None
+        return [Changeset(r['hash'], r['parents'], r['author'], r['epoch'], r['offset'], r['message']) for r in rows]
+
+    '''
+    Private function to get the in-process object reader for this repo.
+    Returns None if the reader is disabled, the repo does not exist yet, or the repo uses features the reader does
+    not support. Also returns None for repos with a mailmap (see _hasMailmap), since git applies it to the author names.
+    The reader only speeds queries up: callers fall back to running git on any failure of it, not only ScmObjectError.
+    '''
+    def _getObjectStore(self):
+        if not self.useObjectReader or self.localpath is None:
+            return None
+        if self._hasMailmap():
+            return None
+        if self.objects is None:
+            gitdir = gitrefs.findGitDir(self.localpath)
+            if gitdir is None:
+                return None
+            try:
+                self.objects = GitObjectStore(gitdir)
+            except Exception as e:
+                self.debugPrint("object reader not available: {0}".format(e))
+                self.useObjectReader = False
+                return None
+        return self.objects
+
+    '''
+    Private function to get the 'git cat-file' co-process for this repo.
+    Returns None if the co-process is disabled or the local path does not contain a repo yet.
+    '''
+    def _getCatFile(self):
+        if not self.useCatFile or self.localpath is None:
+            return None
+        if not os.path.exists(os.path.join(self.localpath, ".git")):
+            return None
+        if self.catfile is None:
+            self.catfile = GitCatFile(self.toolpath, self.localpath)
+        return self.catfile
+
+    '''
+    Private function returning True if git applies a mailmap to the author names of this repo: a .mailmap file at the
+    top of the working tree, or a mailmap.file or mailmap.blob setting (also when the settings cannot be read).
+    '''
+    def _hasMailmap(self):
+        if os.path.exists(os.path.join(self.localpath, ".mailmap")):
+            return True
+        settings = self._getMailmapConfig()
+        return settings is None or len(settings) > 0
+
+    '''
+    Private function returning the mailmap.file and mailmap.blob settings of the repo as a list of (key, value) pairs,
+    read with 'git config' and kept until the repo, global or system config file changes.
+    Returns None if the settings cannot be read.
+    '''
+    def _getMailmapConfig(self):
+        paths = [os.path.expanduser(os.path.join("~", ".gitconfig")),
+                 os.path.join(os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser(os.path.join("~", ".config")),
+                              "git", "config"),
+                 os.path.join(os.sep, "etc", "gitconfig")]
+        gitdir = gitrefs.findGitDir(self.localpath)
+        if gitdir is not None:
+            paths.extend([os.path.join(gitrefs.findCommonDir(gitdir), "config"), os.path.join(gitdir, "config.worktree")])
+        key = tuple(gitrefs.fileStamp(path) for path in paths)
+        if self.mailmapConfig is not None and self.mailmapConfig[0] == key:
+            return self.mailmapConfig[1]
+        try:
+            output = self._processScmCommand(['config', '--get-regexp', r'^mailmap\.(file|blob)$'])
+            settings = []
+            for line in output.splitlines():
+                name, sep, value = line.partition(" ")
+                if len(name) > 0:
+                    settings.append((name, value))
+        except ScmCommandError as e:
+            #git config exits with 1 when nothing matches
+            settings = [] if e.rc == 1 else None
+        self.mailmapConfig = (key, settings)
+        return settings
+
+    '''
+    Private function returning a snapshot of the repository state for the query cache (see BaseScm._getRepoState).
+    Reads the git directory directly: HEAD and the oid it points to, and the stamps of the index, packed-refs,
+    the branch, tag and remote ref trees (every directory below them, since moving a nested ref such as
+    refs/remotes/origin/master only changes the stamp of its own directory) and .gitmodules.
+    '''
+    def _getRepoState(self):
+        gitdir = gitrefs.findGitDir(self.localpath)
+        if gitdir is None:
+            return None
+        commondir = gitrefs.findCommonDir(gitdir)
+        head = gitrefs.resolveRef(gitdir, "HEAD", commondir)
+        return (head,
+                gitrefs.fileStamp(os.path.join(gitdir, "index")),
+                gitrefs.fileStamp(os.path.join(commondir, "packed-refs")),
+                gitrefs.treeStamp(os.path.join(commondir, "refs", "heads")),
+                gitrefs.treeStamp(os.path.join(commondir, "refs", "tags")),
+                gitrefs.treeStamp(os.path.join(commondir, "refs", "remotes")),
+                gitrefs.fileStamp(os.path.join(self.localpath, ".gitmodules")))
+
+    '''
+    Private function to resolve a revision expression to a full object id.
+    Uses the 'git cat-file' co-process when available and falls back to 'git rev-parse' otherwise.
+    Raises ScmError if the revision cannot be resolved.
+    '''
+    def _resolveRevision(self, revision):
+        store = self._getObjectStore()
+        if store is not None:
+            try:
+                return store.resolve(revision)
+            except Exception as e:
+                self.debugPrint("object reader lookup failed, falling back: {0}".format(e))
+
+        catfile = self._getCatFile()
+        if catfile is not None:
+            try:
+                info = catfile.info(revision)
+                if info is not None:
+                    return info[0]
+            except ScmError as e:
+                self.debugPrint("cat-file lookup failed, falling back: {0}".format(e))
+
+        output = self._processScmCommand(['rev-parse', '--verify', revision])
+        lines = output.splitlines()
+        if len(lines) == 0 or len(lines[0].strip()) == 0:
+            raise ScmError("Revision {0} not found".format(revision))
+        return lines[0].strip()
+
+    '''
+    Private function to get the changeset for a single revision through the object reader or the 'git cat-file' co-process.
+    Returns None if neither is available or can answer, in which case the caller should use 'git log'.
+    '''
+    def _catFileChangeset(self, revision):
+        store = self._getObjectStore()
+        if store is not None:
+            try:
+                oid = store.peelToCommit(store.resolve(revision))
+                return self._changesetFromCommit(oid, store.readCommit(oid))
+            except Exception as e:
+                self.debugPrint("object reader lookup failed, falling back: {0}".format(e))
+
+        catfile = self._getCatFile()
+        if catfile is None:
+            return None
+        #git log applies the mailmap to author names, the raw commit object does not
+        if self._hasMailmap():
+            return None
+        try:
+            result = catfile.readCommit(str(revision))
+        except ScmError as e:
+            self.debugPrint("cat-file lookup failed, falling back: {0}".format(e))
+            return None
+        if result is None or result[1]['author'] is None:
+            return None
+        oid, commit = result
+        return self._changesetFromCommit(oid, commit)
+
+    '''
+    Private function to build a changeset from a parsed commit object (see catfile.parseCommit).
+    The result matches what _parseChangesets returns for the same commit.
+    '''
+    def _changesetFromCommit(self, oid, commit):
+        name, email, epoch, offset = commit['author']
+        return GitScm._makeChangeset(oid, list(commit['parents']), name, epoch, offset, commit['message'])
+
+    '''
+    Private function to build a changeset from the raw commit fields.
+    The dates are the author date in the author's timezone, the same as 'Date:' in the medium log format.
+    Only the last non-empty line of the message is kept (see _summaryLine).
+    '''
+    @staticmethod
+    def _makeChangeset(oid, parents, name, epoch, offset, message):
+        return Changeset(oid, parents, name, epoch, offset, GitScm._summaryLine(message))
+
+    '''
+    Private function returning the last non-empty line of a commit message, or None if the message is empty
+    '''
+    @staticmethod
+    def _summaryLine(message):
+        end = len(message)
+        while end > 0:
+            start = message.rfind("\n", 0, end) + 1
+            line = message[start:end].strip()
+            if len(line) > 0:
+                return line
+            end = start - 1
+        return None
         
     '''
     Private function to generate pathspec args based on include/exclude parameters
@@ -72,16 +590,87 @@ class GitScm(BaseScm):
     Initialize a repo from scratch in the local path.
     Returns nothing on success. Raises ScmError on error.
     '''
+    @BaseScm.invalidatesCache()
     def initialize(self):
         self._processScmCommand(['init'])
 
     '''
     Clone a repo from the remote path into the local path.
+    With a mirror cache (see setMirrorCache), the objects come from the local mirror of the remote; if the mirror
+    cannot be updated, the clone is done from the remote alone. The clone options (see setCloneOptions) select a
+    shallow, partial, single branch or sparse clone.
     Returns nothing on success. Raises ScmError on error.
     '''
     @BaseScm.requiresRemoteRepo
+    @BaseScm.invalidatesCache()
     def clone(self):
-        self._processScmCommand(['clone', '--recurse', self.remotepath, self.localpath], cwd='.')
+        mirror = None
+        try:
+            mirror = self.updateMirror()
+        except ScmError as e:
+            self.debugPrint("mirror update failed, falling back: {0}".format(e))
+        self._processScmCommand(self._cloneArgs(mirror), cwd='.')
+        if self.cloneSparse is not None:
+            self._processScmCommand(self._sparseCheckoutArgs())
+        if self.submoduleFilter is not None:
+            for args in self._submoduleCloneArgs(self._getGitlinks("HEAD", self.getSubrepos())):
+                self._processScmCommand(args)
+
+    '''
+    Private function to build the clone command line from the clone options (see setCloneOptions), with a reference
+    to a mirror if one is given. The submodules are cloned along, unless they have filters (see _submoduleCloneArgs).
+    '''
+    def _cloneArgs(self, mirror=None):
+        args = ['clone']
+        if self.submoduleFilter is None:
+            args.append('--recurse')
+            if self.shallowSubmodules:
+                args.append('--shallow-submodules')
+        if self.cloneDepth is not None:
+            args.extend(['--depth', self.cloneDepth])
+        if self.cloneFilter is not None:
+            args.append('--filter=' + self.cloneFilter)
+        if self.cloneBranch is not None:
+            args.extend(['--branch', self.cloneBranch])
+        if self.cloneSingleBranch:
+            args.append('--single-branch')
+        if self.cloneSparse is not None:
+            args.append('--sparse')
+        if mirror is not None:
+            #the mirror only holds the superproject: with --reference-if-able, the submodules (which look for their
+            #objects under the mirror's modules directory) are cloned without alternates instead of failing
+            args.extend(['--reference-if-able', mirror])
+            if self.mirrorDissociate:
+                args.append('--dissociate')
+        return args + [self.remotepath, self.localpath]
+
+    '''
+    Private function to build the command setting the sparse checkout cone to the 'sparse' clone option
+    '''
+    def _sparseCheckoutArgs(self):
+        return ['sparse-checkout', 'set', '--cone', '--'] + self.cloneSparse
+
+    '''
+    Private function to build the commands cloning the submodules when they have filters: one 'submodule update --init'
+    per filter, given the dictionary of path -> recorded commit of the top level submodules (see _getGitlinks)
+    '''
+    def _submoduleCloneArgs(self, gitlinks):
+        groups = {}
+        for path in sorted(gitlinks):
+            if isinstance(self.submoduleFilter, dict):
+                spec = self.submoduleFilter.get(path)
+            else:
+                spec = self.submoduleFilter
+            groups.setdefault(spec, []).append(path)
+        commands = []
+        for spec, paths in sorted(groups.items(), key=lambda group: group[0] or ""):
+            args = ['submodule', 'update', '--init', '--recursive', '--jobs', self.submoduleJobs]
+            if self.shallowSubmodules:
+                args.extend(['--depth', 1])
+            if spec is not None:
+                args.append('--filter=' + spec)
+            commands.append(args + ['--'] + paths)
+        return commands
 
     '''
     Add a file to be tracked by the repo. Also used to stage files for commit.
@@ -104,6 +693,7 @@ class GitScm(BaseScm):
     If message is specified, use the given commit message.
     Returns nothing on success. Raises ScmError on error.
     '''
+    @BaseScm.invalidatesCache()
     def commit(self, message):
         args = ['commit']
         if self.username:
@@ -119,81 +709,492 @@ class GitScm(BaseScm):
     def push(self):
         self._processScmCommand(['push', self.remotepath])
         self._processScmCommand(['push', '--tags', self.remotepath])
-        
+
+    '''
+    Push a local branch to the branch of the same name on origin with --force-with-lease, a compare-and-swap: the push
+    only succeeds if the remote branch is still at 'expected' (a commit id, "" for a branch that must not exist yet),
+    by default the commit of the remote-tracking branch origin/<branch> as of the last fetch. The remote branch can
+    be moved to any commit, not only a descendant, but commits pushed by others since are never overwritten.
+    Returns nothing on success. Raises ScmError on error, including when the remote branch moved.
+    '''
+    @BaseScm.invalidatesCache("getBranches")
+    def pushBranch(self, branch, expected=None):
+        if expected is None:
+            expected = self._getRef("refs/remotes/origin/" + branch) or ""
+        self._processScmCommand(['push', '--quiet', "--force-with-lease=refs/heads/{0}:{1}".format(branch, expected),
+                                 'origin', "refs/heads/{0}:refs/heads/{0}".format(branch)])
+
+    '''
+    Start a transaction updating several refs at once (see RefTransaction): queue changes with create, update and
+    delete (full ref names, each optionally checked against an expected old value), then commit them all or none.
+    The local refs are updated by one 'update-ref --stdin' process. With 'push', the refs are also pushed to origin by
+    one 'push --atomic' with a --force-with-lease check per ref; 'local=False' only pushes them, e.g. to leave a branch
+    checked out here alone. 'message' is the reflog message of the local updates.
+    Returns a RefTransaction, which commits when used as a context manager and the block succeeds, e.g.
+        with scm.refTransaction(push=True) as refs:
+            refs.update("refs/heads/stable", merged, old="origin/stable")
+            refs.create("refs/tags/v1.2", merged)
+    '''
+    def refTransaction(self, message=None, push=False, local=True):
+        return RefTransaction(self, message, "origin" if push else None, local)
+
+    '''
+    Private function returning the object id a ref points to, or None if the ref does not exist
+    '''
+    def _getRef(self, ref):
+        try:
+            return self._resolveRevision(ref)
+        except ScmError:
+            return None
+
+    '''
+    Commit new contents for a few files on a branch without touching the index or the working tree, e.g. to commit
+    generated files. The blobs are written with hash-object, the trees on the paths to the files are rebuilt from the
+    parent's trees with mktree (all the other trees are reused as they are), the commit is created with commit-tree
+    and the branch is moved to it with update-ref, which fails if the branch moved in the meantime.
+    'files' maps paths ("/" separated, relative to the repo root) to the new contents (bytes), or None to delete a file.
+    New files get mode 100644, existing files keep their mode.
+    'parent' is the revision to commit on, the branch by default (e.g. "origin/<branch>" after update() commits on top
+    of the remote branch). The branch is created if needed, with a root commit if there is no parent either.
+    With 'push', the branch is then pushed to origin with --force-with-lease (see pushBranch).
+    If the branch is checked out, its index and working tree are left as they are, so they no longer match it.
+    Returns the new commit id, or None if the files already have these contents (no commit is made).
+    Raises ScmError on error.
+    '''
+    @BaseScm.invalidatesCache()
+    def commitFiles(self, branch, files, message, parent=None, push=False):
+        ref = "refs/heads/" + branch
+        old = self._getRef(ref)
+        if parent is not None:
+            parent = self._resolveRevision(parent + "^{commit}")
+        else:
+            parent = old
+        base = self._resolveRevision(parent + "^{tree}") if parent is not None else None
+        changes = dict((GitScm._nativeStr(path).strip("/"), content) for path, content in files.items())
+        tree = self._writeTree(base, changes)
+        if tree is None:
+            #every file of the repo was deleted
+            tree = self._processScmCommand(['mktree'], input=b"").strip()
+        if tree == base:
+            return None
+        args = ['commit-tree', tree]
+        if parent is not None:
+            args.extend(['-p', parent])
+        message = GitScm._nativeStr(message)
+        commit = self._processScmCommand(args + ['-F', '-'], input=GitScm._toBytes(message)).strip()
+        summary = message.strip().split("\n")[0]
+        self._processScmCommand(['update-ref', '-m', "commitFiles: " + summary, ref, commit, old or ZERO_OID])
+        if push:
+            self.pushBranch(branch)
+        return commit
+
+    '''
+    Private function to write the tree 'tree' (None for a new tree) with changes applied, for commitFiles.
+    'changes' maps paths relative to the tree to new contents, or None to delete them.
+    Returns the new tree id, or None if the tree ends up empty.
+    '''
+    def _writeTree(self, tree, changes):
+        #name -> [mode, type, object id], in the order of the tree
+        entries = collections.OrderedDict()
+        if tree is not None:
+            for record in self._processScmCommand(['ls-tree', '-z', tree]).split("\0"):
+                info, sep, name = record.partition("\t")
+                if sep:
+                    entries[name] = info.split(" ")
+        subtrees = {}
+        for path, content in changes.items():
+            name, sep, rest = path.partition("/")
+            if sep:
+                subtrees.setdefault(name, {})[rest] = content
+            elif content is None:
+                entries.pop(name, None)
+            else:
+                entry = entries.get(name)
+                mode = entry[0] if entry is not None and entry[1] == "blob" else "100644"
+                oid = self._processScmCommand(['hash-object', '-w', '--stdin'], input=GitScm._toBytes(content)).strip()
+                entries[name] = [mode, "blob", oid]
+        for name, subchanges in subtrees.items():
+            entry = entries.get(name)
+            subtree = self._writeTree(entry[2] if entry is not None and entry[1] == "tree" else None, subchanges)
+            if subtree is None:
+                entries.pop(name, None)
+            else:
+                entries[name] = ["040000", "tree", subtree]
+        if len(entries) == 0:
+            return None
+        data = "".join("{0} {1} {2}\t{3}\0".format(mode, type, oid, name) for name, (mode, type, oid) in entries.items())
+        return self._processScmCommand(['mktree', '-z'], input=GitScm._toBytes(data)).strip()
+
+    '''
+    Private function returning a path or message as the type of the command output: text on Python 3, utf-8 encoded
+    bytes on Python 2, so it can be compared and joined with what git lists and passed as a command argument
+    '''
+    @staticmethod
+    def _nativeStr(value):
+        if isinstance(value, str):
+            return value
+        if isinstance(value, bytes):
+            return value.decode('utf-8')
+        return value.encode('utf-8')
+
+    '''
+    Private function returning text encoded in utf-8, or bytes (a Python 2 str) as they are, for a command's input
+    '''
+    @staticmethod
+    def _toBytes(value):
+        if isinstance(value, bytes):
+            return value
+        return value.encode('utf-8')
+
     '''
     Return the current state of files in the repository.
-    If type is specified ("modified", "added", "removed", "deleted", "unknown", "clean", "ignored"), only return status for the requested type.
-    If type is not specified, will return status for all types.
-    Returns a list of tuples for the requested file types on success. Raises ScmError on error. List can be empty if there are no modified files.
-    '''
-    def status(self, type=None, include=None, exclude=None):
-        typeLookup = {
-            "modified": 'M',
-            "added": 'A',
-            "removed": 'D',
-            "deleted": 'D',
-        }
-        
-        stateLookup = {
-            "M": "mod",
-            "A": "add",
-            "D": "del",
-        }
+    If type is specified ("modified", "added", "removed", "deleted", "renamed", "unmerged", "unknown", "clean", "ignored"), only return status for the requested type.
+    If type is not specified, will return status for all types except clean and ignored files.
+    untracked selects how untracked files are scanned: "all" (every file), "normal" (untracked directories are collapsed) or "no"
+    (skip the scan, the fast mode). By default only "unknown" and unfiltered queries scan them, with git's configured mode.
+    Returns a list of (state, filename) tuples for the requested file types on success (see status.TYPE_STATES for the states).
+    Raises ScmError on error. List can be empty if there are no modified files.
+    '''
+    def status(self, type=None, include=None, exclude=None, untracked=None):
+        return GitScm._statusTuples(self.iterStatus(type, include, exclude, untracked), type)
+
+    '''
+    Generator version of status, yielding a StatusEntry (see status.StatusEntry) per file as 'git status' reports it.
+    The entries carry the index and working tree states separately, the source of renames and the submodule state.
+    Raises ScmError on error (after the entries read so far have been yielded).
+    '''
+    def iterStatus(self, type=None, include=None, exclude=None, untracked=None):
+        args = self._statusArgs(type, include, exclude, untracked)
+        if type not in ("clean", "ignored") and include is None and exclude is None:
+            entries = self._watchedStatus(type in (None, "unknown") and untracked != "no")
+            if entries is not None:
+                for entry in entries:
+                    if type is None or entry.matches(type):
+                        yield entry
+                return
+
+        entries = GitScm._iterStatusEntries(self._streamScmCommand(args, separator="\0"))
+        if type == "clean":
+            files = self._streamScmCommand(['ls-files', '-z'] + self._getPathspecArgs(include, exclude), separator="\0")
+            entries = GitScm._iterCleanEntries(entries, files)
+        for entry in entries:
+            if type is None or entry.matches(type):
+                yield entry
+
+    '''
+    Enable or disable git's untracked cache (core.untrackedCache) for status. If no value is specified, the current
+    state will toggle. When enabled, git stores the untracked file scan in the index and only rescans directories that
+    changed since, which makes status with untracked files much faster on large trees.
+    '''
+    def setUntrackedCache(self, value=None):
+        if value is None:
+            value = not self.useUntrackedCache
+        self.useUntrackedCache = bool(value)
+
+    '''
+    Enable or disable git's builtin file system monitor (core.fsmonitor) for status. If no value is specified, the current
+    state will toggle. When enabled, git starts a monitor daemon for the repo and only looks at the files it reports
+    as changed. The builtin monitor needs git 2.36+ on Windows or macOS; elsewhere git ignores the setting.
+    '''
+    def setFsMonitor(self, value=None):
+        if value is None:
+            value = not self.useFsMonitor
+        self.useFsMonitor = bool(value)
 
+    '''
+    Private function to build the status command arguments. Raises ScmError for an unknown file type or untracked mode.
+    '''
+    def _statusArgs(self, type=None, include=None, exclude=None, untracked=None):
         if type is not None:
-            if not type in typeLookup:
+            if not type in TYPE_STATES:
                 raise ScmError("Unknown file type to search for: {0}".format(type))
+        if untracked is None:
+            #only the untracked and ignored files need the untracked scan, which is the slow part of status on a large tree
+            if type not in (None, "unknown", "ignored"):
+                untracked = "no"
+        elif untracked not in UNTRACKED_MODES:
+            raise ScmError("Unknown untracked files mode: {0}".format(untracked))
+
+        args = []
+        if self.useUntrackedCache:
+            args.extend(['-c', 'core.untrackedCache=true'])
+        if self.useFsMonitor:
+            args.extend(['-c', 'core.fsmonitor=true'])
+        args.extend(['status', '--porcelain=v2', '-z'])
+        if untracked is not None:
+            args.append('--untracked-files={0}'.format(untracked))
+        if type == "ignored":
+            args.append('--ignored')
 
-        args = ['status', '-s']
-        
         args.extend(self._getPathspecArgs(include, exclude))
+        return args
 
-        output = self._processScmCommand(args)
+    '''
+    Private generator yielding the status entries of every changed and untracked file, or only of the given paths
+    (see BaseScm._watchedStatus)
+    '''
+    def _scanStatus(self, paths=None, untracked=True):
+        args = self._statusArgs(untracked="all" if untracked else "no")
+        if paths is not None:
+            #rewriting the whole index to refresh the stat data of a few files costs more than the query itself
+            args = ['--no-optional-locks'] + args + ['--'] + [":(top,literal){0}".format(path) for path in paths]
+        return GitScm._iterStatusEntries(self._streamScmCommand(args, separator="\0"))
+
+    '''
+    Private function to parse the status command output into a list of (state, filename) tuples
+    '''
+    def _parseStatus(self, output, type=None):
+        entries = GitScm._iterStatusEntries(output.split("\0"))
+        return GitScm._statusTuples([entry for entry in entries if type is None or entry.matches(type)], type)
+
+    '''
+    Private function to convert status entries into the (state, filename) tuples returned by status.
+    The state is the one of the requested type if there is one (e.g. "mod" for a file both added and modified).
+    '''
+    @staticmethod
+    def _statusTuples(entries, type=None):
+        if type is not None:
+            return [(TYPE_STATES[type], entry.path) for entry in entries]
+        return [(entry.state, entry.path) for entry in entries]
+
+    '''
+    Private generator to parse 'git status --porcelain=v2 -z' output from an iterable of NUL separated records
+    Yields a StatusEntry per file. Renames and copies take two records (the path, then the source path).
+    '''
+    @staticmethod
+    def _iterStatusEntries(records):
+        records = iter(records)
+        for record in records:
+            if len(record) == 0 or record[0] == '#':
+                continue
+            kind = record[0]
+            if kind == '1':
+                #1 XY sub mH mI mW hH hI path
+                fields = record.split(" ", 8)
+                yield StatusEntry(fields[8], "tracked", fields[1][0], fields[1][1], submodule=GitScm._submoduleState(fields[2]))
+            elif kind == '2':
+                #2 XY sub mH mI mW hH hI Xscore path, then the source path
+                fields = record.split(" ", 9)
+                yield StatusEntry(fields[9], "tracked", fields[1][0], fields[1][1], next(records, None), int(fields[8][1:]),
+                                  GitScm._submoduleState(fields[2]))
+            elif kind == 'u':
+                #u XY sub m1 m2 m3 mW h1 h2 h3 path
+                fields = record.split(" ", 10)
+                yield StatusEntry(fields[10], "unmerged", fields[1][0], fields[1][1], submodule=GitScm._submoduleState(fields[2]))
+            elif kind == '?':
+                yield StatusEntry(record[2:], "untracked")
+            elif kind == '!':
+                yield StatusEntry(record[2:], "ignored")
+
+    '''
+    Private function returning the submodule state of a porcelain v2 entry, or None for a regular file
+    '''
+    @staticmethod
+    def _submoduleState(field):
+        return None if field.startswith("N") else field
+
+    '''
+    Private generator yielding a clean StatusEntry for every tracked file ('git ls-files -z' records)
+    that has no entry in the status of the tracked files
+    '''
+    @staticmethod
+    def _iterCleanEntries(entries, files):
+        dirty = set(entry.path for entry in entries)
+        last = None
+        for path in files:
+            #unmerged files are listed once per stage
+            if len(path) == 0 or path == last:
+                continue
+            last = path
+            if path not in dirty:
+                yield StatusEntry(path, "clean")
 
-        results = []
-        for line in output.splitlines():
-            line = line.strip()
-            if len(line) > 0:
-                line = line.split()
-                #filter results based on type if needed
-                if type is not None:
-                    if typeLookup[type] == line[0]:
-                        if line[0] in stateLookup:
-                            state = stateLookup[line[0]]
-                        else:
-                            state = "unk"
-                        results.append((state, line[1]))
-                else:
-                    if line[0] in stateLookup:
-                        state = stateLookup[line[0]]
-                    else:
-                        state = "unk"
-                    results.append((state, line[1]))
-        return results
-        
     '''
     Move the current pointer in the repository to the given revision id.
     Returns nothing on success. Raises ScmError on error.
     '''
+    @BaseScm.invalidatesCache()
     def gotoRevision(self, revision=None):
         if revision is None:
             revision = "master"
-        self._processScmCommand(['checkout', revision])
-        #update submodules to the current revision, if there are any
+        old = self._getGitlinks("HEAD", self.getSubrepos())
+        try:
+            self._processScmCommand(['checkout', revision])
+        except ScmCommandError:
+            #a shallow or single branch clone may not have the revision yet
+            if self.cloneDepth is None and not self.cloneSingleBranch and not self._isShallow():
+                raise
+            for args in self._fetchRevisionCommands(revision):
+                self._processScmCommand(args)
+        #update the submodules whose recorded commit changed, if there are any
+        subrepos = self.getSubrepos()
+        if len(subrepos) > 0:
+            changed = self._changedSubmodules(old, self._getGitlinks("HEAD", subrepos))
+            if len(changed) > 0:
+                self._processScmCommand(self._submoduleUpdateArgs(changed))
+
+    '''
+    Private function returning True if the repo is a shallow clone (e.g. a submodule cloned with shallowSubmodules)
+    '''
+    def _isShallow(self):
+        gitdir = gitrefs.findGitDir(self.localpath)
+        return gitdir is not None and os.path.exists(os.path.join(gitrefs.findCommonDir(gitdir), "shallow"))
+
+    '''
+    Private function to build the commands fetching a revision missing from a shallow or single branch clone, with the
+    clone depth (1 for a shallow repo cloned by someone else), and checking it out: a full commit id as is, anything
+    else as a branch of the remote, checked out as a local branch at it (the remote's fetch refspec of a single
+    branch clone does not cover the branch, so checkout can neither find it by name nor track it).
+    With 'force', local changes are thrown away by the checkout.
+    '''
+    def _fetchRevisionCommands(self, revision, force=False):
+        args = ['fetch', '--quiet']
+        if self.cloneDepth is not None:
+            args.extend(['--depth', self.cloneDepth])
+        elif self._isShallow():
+            args.extend(['--depth', 1])
+        checkout = ['checkout', '--force'] if force else ['checkout']
+        if re.match(r"^[0-9a-f]{40}$", revision):
+            return [args + ['origin', revision], checkout + [revision]]
+        return [args + ['origin', "+refs/heads/{0}:refs/remotes/origin/{0}".format(revision)],
+                checkout + ['-B', revision, "origin/" + revision]]
+
+    '''
+    Bring a previously used working copy to a revision of the remote, as a new clone checked out at it would be: fetch
+    from the remote, check the revision out with --force (a branch is reset to the remote branch), remove every
+    untracked and ignored file (clean -ffdx), then sync the submodule URLs, update the submodules and clean them.
+    This is much faster than a new clone of a large repository (see workspaces.WorkspacePool).
+    With fetch=False, the fetch is skipped (the caller just fetched).
+    Returns nothing on success. Raises ScmError on error.
+    '''
+    @BaseScm.invalidatesCache()
+    def resetWorkspace(self, revision=None, fetch=True):
+        if revision is None:
+            revision = "master"
+        if fetch:
+            self._processScmCommand(['fetch', '--quiet', '--prune', 'origin'])
+        try:
+            self._processScmCommand(['show-ref', '--verify', '--quiet', "refs/remotes/origin/" + revision])
+            branch = True
+        except ScmCommandError:
+            branch = False
+        if branch:
+            self._processScmCommand(['checkout', '--force', '-B', revision, "origin/" + revision])
+        else:
+            try:
+                self._processScmCommand(['checkout', '--force', revision])
+            except ScmCommandError:
+                if self.cloneDepth is None and not self.cloneSingleBranch and not self._isShallow():
+                    raise
+                for args in self._fetchRevisionCommands(revision, force=True):
+                    self._processScmCommand(args)
+        self._processScmCommand(['clean', '-ffdx', '--quiet'])
         if len(self.getSubrepos()) > 0:
-            self._processScmCommand(['submodule', 'update'])
+            self._processScmCommand(['submodule', 'sync', '--recursive', '--quiet'])
+            self._processScmCommand(['submodule', 'update', '--init', '--recursive', '--force', '--jobs', self.submoduleJobs])
+            self._processScmCommand(['submodule', 'foreach', '--recursive', '--quiet', 'git', 'clean', '-ffdx', '--quiet'])
+
+    '''
+    Set the number of submodules gotoRevision updates at the same time (git submodule update --jobs), which is also
+    the number of repositories getSubmodules reads at the same time.
+    '''
+    def setSubmoduleJobs(self, jobs=DEFAULT_SUBMODULE_JOBS):
+        self.submoduleJobs = max(1, int(jobs))
+
+    '''
+    Private function returning the dictionary of path -> recorded commit id of the submodules at 'paths' in a revision.
+    Returns an empty dictionary if there are no paths or the revision does not exist (e.g. a repo without commits).
+    '''
+    def _getGitlinks(self, revision, paths):
+        if len(paths) == 0:
+            return {}
+        try:
+            return parseGitlinks(self._processScmCommand(self._gitlinksArgs(revision, paths)))
+        except ScmError as e:
+            self.debugPrint("no submodule commits for {0}: {1}".format(revision, e))
+            return {}
+
+    '''
+    Private function to build the command arguments listing the gitlinks at 'paths' in a revision
+    '''
+    def _gitlinksArgs(self, revision, paths):
+        return ['ls-tree', '-z', revision, '--'] + list(paths)
+
+    '''
+    Private function returning the paths of the submodules to update after a checkout, given the recorded commits
+    before ('old') and after ('new'): those whose recorded commit changed, and those not checked out at it (e.g. not
+    cloned yet, or moved by hand). The others, and the submodules nested in them, are already up to date.
+    '''
+    def _changedSubmodules(self, old, new):
+        changed = []
+        for path, oid in sorted(new.items()):
+            if old.get(path) != oid or self._getSubmoduleHead(path) != oid:
+                changed.append(path)
+        return changed
+
+    '''
+    Private function returning the commit checked out in the submodule at 'path', read from its git directory.
+    Returns None if the submodule is not cloned.
+    '''
+    def _getSubmoduleHead(self, path):
+        gitdir = gitrefs.findGitDir(os.path.join(self.localpath, path))
+        if gitdir is None:
+            return None
+        head = gitrefs.resolveRef(gitdir, "HEAD")
+        return head[1] if head is not None else None
+
+    '''
+    Private function to build the command arguments updating the given submodules (and the submodules nested in them)
+    '''
+    def _submoduleUpdateArgs(self, paths):
+        return ['submodule', 'update', '--recursive', '--jobs', self.submoduleJobs, '--'] + list(paths)
+
+    '''
+    Returns the submodule graph of a revision (HEAD by default): a list of Submodule objects (see submodules.Submodule)
+    with the commit recorded by each gitlink. With 'recursive', the submodules of every cloned submodule are read at
+    their recorded commit, level by level, the repositories of a level being read in parallel (see setSubmoduleJobs).
+    The list is ordered by path, so a submodule comes before the submodules nested in it.
+    Raises ScmError on error.
+    '''
+    def getSubmodules(self, revision=None, recursive=True):
+        submodules = []
+        #repositories to read: path of the repository, its directory, the commit to read and its depth
+        level = [("", self.localpath, revision or "HEAD", 0)]
+        while len(level) > 0:
+            specs = []
+            for parent, directory, commit, depth in level:
+                specs.append({'args': ['ls-tree', '-r', '-d', '-z', commit], 'cwd': directory})
+                specs.append({'args': ['config', '-z', '--blob', commit + ':.gitmodules', '--get-regexp', r'^submodule\.'], 'cwd': directory})
+            batch = self.runBatch(specs, self.submoduleJobs)
+
+            next = []
+            for i, (parent, directory, commit, depth) in enumerate(level):
+                links, config = batch[2 * i], batch[2 * i + 1]
+                if not links.ok:
+                    if depth == 0:
+                        raise links.error
+                    #the recorded commit may not have been fetched in the submodule
+                    self.debugPrint("cannot read submodules of {0} at {1}: {2}".format(parent, commit, links.error))
+                    continue
+                #a repo without .gitmodules (or without entries) makes git config fail
+                modules = parseGitmodules(config.output) if config.ok else {}
+                for path, oid in parseGitlinks(links.output).items():
+                    name, url = modules.get(path, (None, None))
+                    subdir = os.path.join(directory, path)
+                    initialized = gitrefs.findGitDir(subdir) is not None
+                    fullpath = parent + "/" + path if parent else path
+                    submodules.append(Submodule(fullpath, parent, oid, name, url, depth + 1, initialized))
+                    if recursive and initialized:
+                        next.append((fullpath, subdir, oid, depth + 1))
+            level = next
+        return sorted(submodules, key=lambda submodule: submodule.path)
         
     '''
     Returns the revision id for the currently pointed to revision in the repository
     Returns the current revision id on success. Raises ScmError on error.
     '''
     def getCurrentRevision(self, showmod=False, length=None):
-        output = self._processScmCommand(['rev-parse', 'HEAD'])
-
-        lines = output.splitlines()
-        rev = lines[0].strip()
-        if len(rev) == 0:
-            raise ScmError("Current revision not found")
+        rev = self._getHeadRevision()
             
         if length:
             rev = rev[:length]
@@ -204,6 +1205,17 @@ class GitScm(BaseScm):
                 rev = rev + "+"
         return rev
         
+    '''
+    Private function returning the full revision id of HEAD. Kept separate from getCurrentRevision
+    so the query cache does not keep the working copy state reported with showmod.
+    '''
+    @BaseScm.cachedQuery
+    def _getHeadRevision(self):
+        rev = self._resolveRevision('HEAD')
+        if len(rev) == 0:
+            raise ScmError("Current revision not found")
+        return rev
+
     '''
     Change to the requested branch name in the repository.
     Returns nothing on success. Raises ScmError on error.
@@ -216,6 +1228,7 @@ class GitScm(BaseScm):
     Return the name of the branch currently used in the repository.
     Returns the name of the current branch success. Raises ScmError on error.
     '''
+    @BaseScm.cachedQuery
     def getCurrentBranch(self):
         output = self._processScmCommand(['rev-parse', '--abbrev-ref', 'HEAD'])
 
@@ -227,36 +1240,229 @@ class GitScm(BaseScm):
         
     '''
     Return a list of the local branches - does not return detached HEADs
-    '''
-    def getBranches(self):
-        output = self._processScmCommand(['show-ref', '--heads'])
-        lines = output.splitlines()
-        refs = []
-        for line in lines:
-            if line.strip() == "":
-                continue
-            refs.append(line.strip().split()[1])
+    Each branch is the BranchChangeset of its head commit, with 'branch' set to the short name and 'ref' to the full ref name.
+    If remotes is set, the remote tracking branches are listed too (named like "origin/feature"; the remote HEAD symrefs are skipped).
+    If aheadBehind is set, 'ahead' and 'behind' hold the number of commits each branch has that the main branch does not
+    and the other way round; they are None for every branch if the main branch does not exist.
+    All branches are read with a single 'git for-each-ref' call (see BRANCH_FORMAT).
+    '''
+    @BaseScm.cachedQuery
+    def getBranches(self, remotes=False, aheadBehind=False):
+        patterns = ["refs/heads/"]
+        if remotes:
+            patterns.append("refs/remotes/")
+
+        base = None
+        if aheadBehind:
+            try:
+                base = self._resolveRevision("{0}^{{commit}}".format(self.getMainBranchName()))
+            except ScmError as e:
+                self.debugPrint("main branch not found, no ahead/behind counts: {0}".format(e))
 
+        fmt = BRANCH_FORMAT
+        fields = BRANCH_FIELDS
+        if base is not None and self.hasAheadBehindAtom is not False:
+            fmt += "%(ahead-behind:{0})%00".format(base)
+            fields += 1
+        try:
+            output = self._processScmCommand(['for-each-ref', '--format=' + fmt] + patterns)
+        except ScmCommandError as e:
+            if fields == BRANCH_FIELDS or "ahead-behind" not in e.msg:
+                raise
+            #%(ahead-behind) needs git 2.41
+            self.debugPrint("for-each-ref has no ahead-behind, falling back: {0}".format(e))
+            self.hasAheadBehindAtom = False
+            fields = BRANCH_FIELDS
+            output = self._processScmCommand(['for-each-ref', '--format=' + BRANCH_FORMAT] + patterns)
+        if fields > BRANCH_FIELDS:
+            self.hasAheadBehindAtom = True
+
+        records = output.split("\0")
         branches = []
-        for ref in refs:
-            output = self._processScmCommand(['log', '-n', 1, ref])
-            changesets = self._parseChangesets(output)
-            changesets[0]['branch'] = ref[len("refs/heads/"):]
-            branches.extend(changesets)
+        idents = []
+        for i in range(0, len(records) - fields + 1, fields):
+            record = records[i:i + fields]
+            #every record but the first starts with the newline for-each-ref ends the previous one with
+            ref = record[0].lstrip("\n")
+            symref, type, oid, parents, name, email, date, message = record[1:BRANCH_FIELDS]
+            if len(symref) > 0 or type != "commit":
+                continue
+            epoch, offset = GitScm._parseRawDate(date)
+            branch = BranchChangeset(oid, parents.split(), name, epoch, offset, GitScm._summaryLine(message),
+                                     branch=ref.split("/", 2)[2], ref=ref)
+            if fields > BRANCH_FIELDS:
+                ahead, behind = record[BRANCH_FIELDS].split()
+                branch.ahead = int(ahead)
+                branch.behind = int(behind)
+            branches.append(branch)
+            idents.append("{0} {1}".format(name, email))
+
+        #for-each-ref before git 2.41 cannot apply the mailmap to author names, so map them the way log does
+        if self._hasMailmap():
+            names = self._mapAuthorNames(idents)
+            for branch, ident in zip(branches, idents):
+                branch.idsid = names.get(ident, branch.idsid)
+
+        if base is not None and fields == BRANCH_FIELDS:
+            self._countAheadBehind(base, branches)
         return branches
-        
+
+    '''
+    Private function to map "Name <email>" author identities through the repo's mailmap with 'git check-mailmap'.
+    Returns a dictionary of identity to mapped author name.
+    '''
+    def _mapAuthorNames(self, idents):
+        unique = sorted(set(idents))
+        names = {}
+        for i in range(0, len(unique), MAILMAP_CHUNK):
+            chunk = unique[i:i + MAILMAP_CHUNK]
+            output = self._processScmCommand(['check-mailmap'] + chunk)
+            for ident, line in zip(chunk, output.splitlines()):
+                names[ident] = line.rpartition(" <")[0]
+        return names
+
+    '''
+    Private function to fill in the 'ahead' and 'behind' counts of branches against the main branch commit 'base',
+    for git versions without %(ahead-behind): one 'git rev-list --left-right --count' per distinct branch head,
+    run as a batch.
+    Raises ScmError on error.
+    '''
+    def _countAheadBehind(self, base, branches):
+        heads = sorted(set(branch.hash for branch in branches))
+        batch = self.runBatch([['rev-list', '--left-right', '--count', "{0}...{1}".format(base, head)] for head in heads])
+        counts = {}
+        for head, output in zip(heads, batch.check().outputs):
+            #left is the commits only the main branch has, right the ones only the branch has
+            behind, ahead = output.split()
+            counts[head] = (int(ahead), int(behind))
+        for branch in branches:
+            branch.ahead, branch.behind = counts[branch.hash]
+
     '''
     Create a branch with the given name at the current revision. does not switch to the new branch.
     '''
+    @BaseScm.invalidatesCache("getBranches")
     def createBranch(self, name):
         self._processScmCommand(['branch', name])
             
+    '''
+    Return the working trees of the repository: a list of Worktree objects (see worktrees.Worktree), the main working
+    tree first, then the linked working trees.
+    Raises ScmError on error.
+    '''
+    def getWorktrees(self):
+        try:
+            output = self._processScmCommand(['worktree', 'list', '--porcelain', '-z'])
+        except ScmCommandError as e:
+            #-z needs git 2.36+
+            self.debugPrint("worktree list -z failed, falling back: {0}".format(e))
+            return parseWorktrees(self._processScmCommand(['worktree', 'list', '--porcelain']), "\n")
+        return parseWorktrees(output)
+
+    '''
+    Private function returning the Worktree registered at a path, or None if there is none
+    '''
+    def _findWorktree(self, path):
+        path = os.path.realpath(path)
+        for worktree in self.getWorktrees():
+            if os.path.realpath(worktree.path) == path:
+                return worktree
+        return None
+
+    '''
+    Create a linked working tree at 'path' checked out at a revision (HEAD by default), or reuse the one already there,
+    and return a GitScm for it. A reused working tree gets the revision checked out with --force and its untracked and
+    ignored files removed, so it starts as clean as a new one without checking out every file again.
+    With 'branch', the branch is created (or reset) at the revision and checked out, otherwise the revision is checked
+    out detached. A branch can only be checked out in one working tree at a time.
+    With 'lock', the working tree is locked with that reason before it is used (see lockWorktree), which fails if it is
+    already locked, so two jobs never share a working tree. With 'submodules', the submodules are cloned and updated in
+    the working tree (every working tree has its own submodule clones); otherwise the submodules a reused working tree
+    already has are left at their commits.
+    Raises ScmError on error.
+    '''
+    @BaseScm.invalidatesCache("getBranches")
+    def getWorktree(self, path, revision=None, branch=None, lock=None, submodules=False):
+        path = os.path.abspath(path)
+        revision = revision or "HEAD"
+        existing = self._findWorktree(path)
+        if existing is not None and existing.prunable is not None:
+            #still registered but its directory is gone: forget it and create it again
+            self.pruneWorktrees()
+            existing = None
+        #no upstream is set for the branch, which would write to the config shared by all the working trees
+        checkout = ['--no-track', '-B', branch] if branch is not None else ['--detach']
+        if existing is None:
+            args = ['worktree', 'add', '--quiet']
+            if lock is not None:
+                args.extend(['--lock', '--reason', lock])
+            self._processScmCommand(args + checkout + [path, revision])
+        elif lock is not None:
+            self.lockWorktree(path, lock)
+        worktree = GitScm(path, remoterepo=self.remotepath, username=self.username)
+        worktree.setSubmoduleJobs(self.submoduleJobs)
+        try:
+            if existing is not None:
+                worktree._processScmCommand(['checkout', '--force', '--quiet'] + checkout + [revision])
+                worktree._processScmCommand(['clean', '-ffdx', '--quiet'])
+            if submodules and len(worktree.getSubrepos()) > 0:
+                worktree._processScmCommand(['submodule', 'update', '--init', '--recursive', '--force', '--jobs',
+                                             worktree.submoduleJobs])
+        except ScmError:
+            if lock is not None:
+                self.unlockWorktree(path)
+            raise
+        return worktree
+
+    '''
+    Remove the linked working tree at 'path': its directory and its administrative files. With 'force', a working tree
+    with local changes or a lock is removed too.
+    Returns nothing on success. Raises ScmError on error.
+    '''
+    @BaseScm.invalidatesCache("getBranches")
+    def removeWorktree(self, path, force=False):
+        args = ['worktree', 'remove']
+        if force:
+            args.extend(['--force', '--force'])
+        self._processScmCommand(args + [os.path.abspath(path)])
+
+    '''
+    Forget the linked working trees whose directory was deleted (unless they are locked). With 'expire'
+    (e.g. "2.weeks.ago"), only those older than that are forgotten.
+    Returns nothing on success. Raises ScmError on error.
+    '''
+    @BaseScm.invalidatesCache("getBranches")
+    def pruneWorktrees(self, expire=None):
+        args = ['worktree', 'prune']
+        if expire is not None:
+            args.extend(['--expire', expire])
+        self._processScmCommand(args)
+
+    '''
+    Lock the linked working tree at 'path', optionally with a reason, so it is not pruned and getWorktree does not hand
+    it out to another job.
+    Returns nothing on success. Raises ScmError on error, including when it is already locked.
+    '''
+    def lockWorktree(self, path, reason=None):
+        args = ['worktree', 'lock']
+        if reason is not None:
+            args.extend(['--reason', reason])
+        self._processScmCommand(args + [os.path.abspath(path)])
+
+    '''
+    Unlock the linked working tree at 'path'.
+    Returns nothing on success. Raises ScmError on error.
+    '''
+    def unlockWorktree(self, path):
+        self._processScmCommand(['worktree', 'unlock', os.path.abspath(path)])
+
     '''
     Get the latest changes from the remote repository, and change the current pointer to (merging if necessary) to the latest revision.
     Equivalent to 'git pull', or 'hg pull -u', etc
     Returns nothing on success. Raises ScmError on error.
     '''
     @BaseScm.requiresRemoteRepo
+    @BaseScm.invalidatesCache()
     def updateAndMerge(self):
         self._processScmCommand(['pull'])
         
@@ -266,6 +1472,7 @@ class GitScm(BaseScm):
     Returns nothing on success. Raises ScmError on error.
     '''
     @BaseScm.requiresRemoteRepo
+    @BaseScm.invalidatesCache()
     def update(self):
         self._processScmCommand(['fetch'])
         
@@ -273,6 +1480,7 @@ class GitScm(BaseScm):
     Merge the currently pointed to revision with the given revision id.
     Returns nothing on success. Raises ScmError on error.
     '''
+    @BaseScm.invalidatesCache()
     def merge(self, revision):        
         self._processScmCommand(['merge', revision])
         
@@ -282,6 +1490,103 @@ class GitScm(BaseScm):
     Returns the text of the patch on success. Raises ScmError on error.
     '''
     def getPatch(self, rev1=None, rev2=None, outfile=None, context=5, stat=False, include=None, exclude=None, submodules=True):
+        output = self._processScmCommand(self._patchArgs(rev1, rev2, context, stat, include, exclude, submodules), outfile=outfile)
+        return output
+
+    '''
+    Streaming version of getPatch. Takes the same arguments (except outfile), but returns a generator which yields the
+    patch text one line at a time (without line endings) as it is read from git.
+    Raises ScmError on error.
+    '''
+    def iterPatch(self, rev1=None, rev2=None, context=5, stat=False, include=None, exclude=None, submodules=True):
+        return self._streamScmCommand(self._patchArgs(rev1, rev2, context, stat, include, exclude, submodules))
+
+    '''
+    Structured version of getPatch. Takes the same arguments (except outfile and stat), but returns a Patch which indexes
+    the file and hunk boundaries of the diff output as it is read, and hands out the diff of each file and hunk on demand.
+    Raises ScmError on error.
+    '''
+    def getStructuredPatch(self, rev1=None, rev2=None, context=5, include=None, exclude=None, submodules=True):
+        return Patch.fromChunks(self._streamScmCommand(self._patchArgs(rev1, rev2, context, False, include, exclude, submodules), separator=None))
+
+    '''
+    Get the numeric line churn of a diff: the number of added and deleted lines per changed file, without the
+    diff text (rev1/rev2/include/exclude as for getPatch). Renames are detected; a renamed file is counted under its new path.
+    Returns a Churn (see scmlib.churn) with one row per file. Raises ScmError on error.
+    '''
+    def getChurn(self, rev1=None, rev2=None, include=None, exclude=None):
+        return self._parseChurn(self._streamScmCommand(self._churnArgs(rev1, rev2, include, exclude), separator="\0"))
+
+    '''
+    Private function to build the diff command arguments for getChurn
+    '''
+    def _churnArgs(self, rev1=None, rev2=None, include=None, exclude=None):
+        args = ["diff", "--numstat", "-z", "-M"]
+        if rev1 and not rev2:
+            args.append("{0}^!".format(rev1))
+        elif rev1 and rev2:
+            args.append("{0}..{1}".format(rev1, rev2))
+        args.extend(self._getPathspecArgs(include, exclude))
+        return args
+
+    '''
+    Get the line churn of every commit in a revision range, with the commit authors: the commits reachable from rev2
+    (HEAD by default) but not from rev1 (all of the history if rev1 is not set), optionally limited by author date
+    (startdate/enddate as for log) and paths. Merge commits are not counted, so each change is counted once.
+    Returns a Churn (see scmlib.churn) with one row per file per commit, to aggregate with byAuthor, byDirectory, etc.
+    Raises ScmError on error.
+    '''
+    def getChurnLog(self, rev1=None, rev2=None, startdate=None, enddate=None, include=None, exclude=None):
+        return self._parseChurn(self._streamScmCommand(self._churnLogArgs(rev1, rev2, startdate, enddate, include, exclude), separator="\0"))
+
+    '''
+    Private function to build the log command arguments for getChurnLog (see CHURN_LOG_FORMAT)
+    '''
+    def _churnLogArgs(self, rev1=None, rev2=None, startdate=None, enddate=None, include=None, exclude=None):
+        args = ["log", "--numstat", "-z", "-M", "--no-merges", "--format=" + CHURN_LOG_FORMAT]
+        if startdate:
+            args.extend(["--after", startdate])
+        if enddate:
+            args.extend(["--before", enddate])
+        if rev1:
+            args.append("{0}..{1}".format(rev1, rev2 or "HEAD"))
+        elif rev2:
+            args.append(rev2)
+        args.extend(self._getPathspecArgs(include, exclude))
+        return args
+
+    '''
+    Private function to parse --numstat -z output from an iterable of NUL separated fields, with optional commit
+    headers (see CHURN_LOG_FORMAT). Returns a Churn.
+    '''
+    @staticmethod
+    def _parseChurn(fields):
+        churn = Churn()
+        author = None
+        fields = iter(fields)
+        for field in fields:
+            field = field.lstrip("\n")
+            if len(field) == 0:
+                continue
+            if field.startswith("\x01"):
+                #commit header: \x01<hash>, then the author
+                author = next(fields)
+                continue
+            added, deleted, path = field.split("\t", 2)
+            if len(path) == 0:
+                #rename or copy: the old and new paths follow as separate fields
+                next(fields)
+                path = next(fields)
+            if added == "-":
+                churn.add(path, None, None, author)
+            else:
+                churn.add(path, int(added), int(deleted), author)
+        return churn
+
+    '''
+    Private function to build the diff command arguments for getPatch
+    '''
+    def _patchArgs(self, rev1=None, rev2=None, context=5, stat=False, include=None, exclude=None, submodules=True):
         args = ["diff"]
         if submodules:
             args.append("--submodule=diff")
@@ -303,72 +1608,84 @@ class GitScm(BaseScm):
             args.append("{0}..{1}".format(rev1, rev2))
             
         args.extend(self._getPathspecArgs(include, exclude))
-        
-        output = self._processScmCommand(args, outfile=outfile)
-        return output
+        return args
 
     '''
-    Private function to parse the git log/changeset list output
+    Private function to parse the git log/changeset list output (see LOG_FORMAT)
     Returns a list of the changesets it parsed
     '''
     def _parseChangesets(self, output):
-        changesets = []
-        changeset = None
-        for line in output.splitlines():
-            line = line.rstrip()
-            if line.startswith("commit "):
-                #commit XXXXXXXXXXXXXXXX
-                line = line[len("commit "):].strip()
-                changeset = dict()
-                ids = line.split()
-                changeset['hash'] = ids[0]
-                changeset['parents'] = []
-                if len(ids) > 1:
-                    changeset['parents'] = [p for p in ids if p != changeset['hash']]
-                changesets.append(changeset)
-            elif line.startswith("Author: "):
-                #Author: idsid <idsid@domain>
-                #Author: Last, First <idsid@domain>
-                line = line[len("Author: "):]
-                line = line.strip()
-                splitline = splitline = line.split("<")
-                changeset['idsid'] = splitline[0].strip()
-            elif line.startswith("Date: "):
-                #get ww/yr format from date
-                dstr = line[len("Date: "):]
-                dstr = dstr.strip()
-                #Fri Nov 09 12:44:01 2012 -0700
-                #remove the timezone because python datetime sucks at that...
-                dstr = dstr[:-5]
-                dstr = dstr.strip()
-                dobj = datetime.datetime.strptime(dstr, "%a %b %d %H:%M:%S %Y")
-                dobj_aligned = BaseScm.alignTimestamp(dobj)
-                changeset['timestamp'] = str(dobj)
-                changeset['date'] = dstr
-                changeset['iso'] = dobj.isocalendar()
-                changeset['ts_aligned'] = str(dobj_aligned)
-                changeset['iso_aligned'] = dobj_aligned.isocalendar()
-            else:
-                #assume it's part of the commit message
-                line = line.strip()
-                if len(line) > 0:
-                    changeset['message'] = line
+        return list(self._iterChangesets(output.split("\0")))
+
+    '''
+    Private generator to parse git log/changeset list output from an iterable of NUL separated fields (see LOG_FORMAT)
+    Yields each changeset once all of its fields have been read
+    '''
+    def _iterChangesets(self, fields):
+        record = []
+        for field in fields:
+            record.append(field)
+            if len(record) < LOG_FIELDS:
+                continue
+            oid, parents, name, date, message = record
+            record = []
+            epoch, offset = GitScm._parseRawDate(date)
+            yield GitScm._makeChangeset(oid, parents.split(), name, epoch, offset, message)
 
-        return changesets
+    '''
+    Private function to parse a raw git date ("epoch +hhmm") into the epoch and the offset in seconds east of UTC
+    '''
+    @staticmethod
+    def _parseRawDate(date):
+        epoch, sep, tz = date.partition(" ")
+        offset = int(tz[1:3] or 0) * 3600 + int(tz[3:5] or 0) * 60
+        if tz.startswith("-"):
+            offset = -offset
+        return int(epoch), offset
         
     '''
     Get log information for one or more revisions. Gets log data for all revisions by default.
     If revision is specified, get log data for only the specified revision.
     If limit is specified, only return at most <limit> log entries.
-    Returns a list of dictionaries containing log data. Each dictionary contains the revision ('hash'),
+    Returns a list of Changeset objects (see changeset.Changeset, accessed like dictionaries). Each contains the revision ('hash'),
     commiting user id ('idsid'), date of the change ('date'), and commit message ('message')
     Raises ScmError on error
     '''
-    def log(self, revision=None, limit=None, file=None, startdate=None, enddate=None):
+    @BaseScm.cachedQuery
+    def log(self, revision=None, limit=None, file=None, startdate=None, enddate=None, author=None):
         #return a list of dictionaries (changeset/author/timestamp/message) containing log info as requested
         #if revision is none, return changesets for all revisions
         #if limit is none return all changesets
-        args = ['log', '--parents', '--format=medium']
+        if revision is not None and file is None and not startdate and not enddate and author is None:
+            #single commit lookups are answered by the cat-file co-process when possible
+            changeset = self._catFileChangeset(revision)
+            if changeset is not None:
+                return [changeset]
+        elif revision is None and file is None:
+            changesets = self._queryCommitIndex(limit, startdate, enddate, author)
+            if changesets is not None:
+                return changesets
+            if not startdate and not enddate and author is None:
+                changesets = self._walkHistory(limit=limit)
+                if changesets is not None:
+                    return changesets
+
+        output = self._processScmCommand(self._logArgs(revision, limit, file, startdate, enddate, author))
+        return self._parseChangesets(output)
+
+    '''
+    Streaming version of log. Takes the same arguments, but returns a generator which yields each changeset
+    as soon as it has been read from git, without buffering the whole log output.
+    Raises ScmError on error (after the changesets read so far have been yielded).
+    '''
+    def iterLog(self, revision=None, limit=None, file=None, startdate=None, enddate=None, author=None):
+        return self._iterChangesets(self._streamScmCommand(self._logArgs(revision, limit, file, startdate, enddate, author), separator="\0"))
+
+    '''
+    Private function to build the log command arguments
+    '''
+    def _logArgs(self, revision=None, limit=None, file=None, startdate=None, enddate=None, author=None):
+        args = ['log', '-z', '--parents', '--date=raw', '--format=' + LOG_FORMAT]
         if revision is not None:
             limit = 1 #for a single revision, only show 1
             args.append(revision)
@@ -378,82 +1695,267 @@ class GitScm(BaseScm):
             args.extend(["--after", startdate])
         if enddate:
             args.extend(["--before", enddate])
+        if author is not None:
+            args.append("--author={0}".format(author))
         if file is not None:
             args.append(file)
-        output = self._processScmCommand(args)
-        return self._parseChangesets(output)
+        return args
         
     '''
     Get log information for the first-parent ancestor path of a revision.
     If revision is specified, get log data for only the specified revision.
     If limit is specified, only return at most <limit> log entries.
-    Returns a list of dictionaries containing log data. Each dictionary contains the revision ('hash'),
+    Returns a list of Changeset objects (see changeset.Changeset, accessed like dictionaries). Each contains the revision ('hash'),
     commiting user id ('idsid'), date of the change ('date'), and commit message ('message')
     Raises ScmError on error
     '''
+    @BaseScm.cachedQuery
     def getAncestors(self, revision=None, limit=None):
-        args = ['rev-list', '--parents', '--first-parent', '--format=medium']
+        index = self._getCommitIndex()
+        if index is not None:
+            try:
+                self.updateCommitIndex()
+                rows = index.ancestors(self._resolveRevision("{0}^{{commit}}".format(revision or "HEAD")), limit)
+                if rows is not None:
+                    return [Changeset(r['hash'], r['parents'], r['author'], r['epoch'], r['offset'], r['message']) for r in rows]
+            except ScmError as e:
+                self.debugPrint("commit index query failed, falling back: {0}".format(e))
+
+        changesets = self._walkHistory(revision, limit, firstParent=True)
+        if changesets is not None:
+            return changesets
+
+        output = self._processScmCommand(self._ancestorsArgs(revision, limit))
+        return self._parseChangesets(output)
+
+    '''
+    Private function to walk the history of a revision (HEAD by default) with the object reader, in 'git log' order.
+    Returns a list of changesets, or None if the object reader is not available or cannot answer.
+    '''
+    def _walkHistory(self, revision=None, limit=None, firstParent=False):
+        store = self._getObjectStore()
+        if store is None:
+            return None
+        if revision is None:
+            revision = "HEAD"
+        try:
+            oid = store.peelToCommit(store.resolve(revision))
+            changesets = []
+            if limit is not None and int(limit) <= 0:
+                return changesets
+            for oid, commit in store.walkHistory([oid], firstParent):
+                changesets.append(self._changesetFromCommit(oid, commit))
+                if limit is not None and len(changesets) >= int(limit):
+                    break
+            return changesets
+        except Exception as e:
+            self.debugPrint("object reader lookup failed, falling back: {0}".format(e))
+            return None
+
+    '''
+    Private function to build the first-parent log command arguments for getAncestors
+    '''
+    def _ancestorsArgs(self, revision=None, limit=None):
+        args = ['log', '-z', '--parents', '--first-parent', '--date=raw', '--format=' + LOG_FORMAT]
         if limit is not None:
             args.extend(['-n', limit])
         if revision is None:
             revision = "HEAD"
         args.append(revision)
-        output = self._processScmCommand(args)
-        return self._parseChangesets(output)
+        return args
 
     '''
     Returns a list of tags that have been committed, ordered from newest to oldest.
+    If filter is set, only the tags matching the glob pattern are returned (see TagIndex.names).
     Raises ScmError on error.
     '''
+    @BaseScm.cachedQuery
     def getTags(self, filter=None):
-        args = ['tag', '-l', '--sort=-taggerdate']  # sort newest to oldest to match hg
-        if filter is not None:
-            args.append(filter)
-        output = self._processScmCommand(args)
+        return self.getTagIndex().names(filter)
+
+    '''
+    Returns a TagIndex (see tagindex.TagIndex) of all the tags with their peeled commits and tagger dates, read with a
+    single 'git for-each-ref'. The index is kept until the packed-refs file or a loose tag changes.
+    Raises ScmError on error.
+    '''
+    def getTagIndex(self):
+        gitdir = gitrefs.findGitDir(self.localpath)
+        key = None
+        if gitdir is not None:
+            commondir = gitrefs.findCommonDir(gitdir)
+            key = (gitrefs.fileStamp(os.path.join(commondir, "packed-refs")),
+                   gitrefs.treeStamp(os.path.join(commondir, "refs", "tags")))
+        with self.tagindexLock:
+            if key is not None and self.tagindex is not None and self.tagindex.key == key:
+                return self.tagindex
+
+        output = self._processScmCommand(['for-each-ref', '--format=' + TAG_FORMAT, 'refs/tags/'])
+        index = TagIndex(self._parseTags(output), key)
+        with self.tagindexLock:
+            self.tagindex = index
+        return index
+
+    '''
+    Private function to parse the tag list output (see TAG_FORMAT). Returns a list of TagEntry objects.
+    Tags of tags are peeled to their commit with rev-parse (for-each-ref only peels one level).
+    '''
+    def _parseTags(self, output):
+        records = output.split("\0")
+        entries = []
+        for i in range(0, len(records) - TAG_FIELDS + 1, TAG_FIELDS):
+            ref, type, oid, peeledType, peeled, date = records[i:i + TAG_FIELDS]
+            name = ref.lstrip("\n")[len("refs/tags/"):]
+            commit = None
+            if type == "commit":
+                commit = oid
+            elif peeledType == "commit":
+                commit = peeled
+            elif peeledType == "tag":
+                try:
+                    commit = self._resolveRevision("{0}^{{commit}}".format(oid))
+                except ScmError as e:
+                    self.debugPrint("tag {0} does not point to a commit: {1}".format(name, e))
+            entries.append(TagEntry(name, oid, commit, int(date) if date else 0, type == "tag"))
+        return entries
 
-        tags = []
-        for line in output.splitlines():
-            line = line.strip()
-            if len(line) > 0:
-                tags.append(line)
-        return tags
-        
     '''
     Add a tag with the given name and message to the currently pointed to revision id in the repository.
     Returns nothing on success. Raises ScmError on error.
     '''
+    @BaseScm.invalidatesCache("getTags", "getLatestTag")
     def createTag(self, name, message):
         args = ['tag', name, '-f', '-m', message]
         self._processScmCommand(args)
         
     '''
-    Returns a the name of the latest tag used
+    Returns a the name of the latest tag used, as given by 'git describe --tags': the tag name if the current revision
+    is tagged, otherwise "<tag>-<number of commits since the tag>-g<abbreviated revision id>".
+    When exactly one tag points to the current revision, its name comes from the tag index without running git;
+    otherwise git describe picks the tag, by its own rules.
     Raises ScmError on error.
     '''
+    @BaseScm.cachedQuery
     def getLatestTag(self):
+        tags = self.getTagIndex().tagsAt(self._resolveRevision("HEAD^{commit}"))
+        if len(tags) == 1:
+            return tags[0].name
         output = self._processScmCommand(['describe', '--tags'])
         return output.strip()
 
+    '''
+    Returns the list of tags (newest first) whose commit contains the given revision, i.e. the revision is the tagged
+    commit or one of its ancestors, like 'git tag --contains'. The tagged commits come from the tag index; their
+    history is walked once with 'git rev-list --date-order' (children before parents), carrying a bitmask of the
+    tagged commits each commit is reachable from, and stops at the revision. The walk is read as git lists it when the
+    repo has a commit-graph file (written by 'git commit-graph write' or by fetch/gc in recent git versions).
+    Raises ScmError on error.
+    '''
+    @BaseScm.cachedQuery
+    def getTagsContaining(self, revision):
+        index = self.getTagIndex()
+        target = self._resolveRevision("{0}^{{commit}}".format(revision))
+        commits = sorted(index.commits())
+        if len(commits) == 0:
+            return []
+        bits = dict((commit, 1 << i) for i, commit in enumerate(commits))
+        masks = {}
+        found = 0
+        #the revision is listed too, so the walk reaches it even if no tag contains it
+        walk = self._streamScmCommand(['rev-list', '--date-order', '--parents', '--tags', target])
+        try:
+            for line in walk:
+                fields = line.split()
+                if len(fields) == 0:
+                    continue
+                #every child has been seen, so the mask is complete
+                mask = masks.pop(fields[0], 0) | bits.get(fields[0], 0)
+                if fields[0] == target:
+                    found = mask
+                    break
+                for parent in fields[1:]:
+                    masks[parent] = masks.get(parent, 0) | mask
+        finally:
+            walk.close()
+        return [entry.name for entry in index if entry.commit is not None and found & bits[entry.commit]]
+
     '''
     Returns a list of all the tracked files in the repository.
     Raises ScmError on error.
     '''
+    @BaseScm.cachedQuery
     def getFiles(self):
-        output = self._processScmCommand(['ls-tree', '-r', '--name-only', '--full-tree', 'HEAD'])
+        store = self._getObjectStore()
+        if store is not None:
+            try:
+                tree = store.readCommit(store.peelToCommit(store.resolve("HEAD")))['tree']
+                return list(store.walkTree(tree))
+            except Exception as e:
+                self.debugPrint("object reader lookup failed, falling back: {0}".format(e))
 
-        files = []
-        for line in output.splitlines():
-            line = line.strip()
-            if len(line) > 0:
-                files.append(line)
+        output = self._processScmCommand(self._filesArgs())
+        return self._parseFiles(output)
+
+    '''
+    Generator version of getFiles, yielding the tracked files of the given revision (HEAD by default) one at a time
+    as 'git ls-tree' lists them, without building the whole list.
+    Raises ScmError on error.
+    '''
+    def iterFiles(self, revision=None):
+        for path in self._streamScmCommand(self._filesArgs(revision), separator="\0"):
+            if len(path) > 0:
+                yield path
+
+    '''
+    Returns a FileIndex (see fileindex.FileIndex) of the tracked files of the given revision (HEAD by default),
+    for prefix, glob and extension queries. The last few indexes are kept per tree id, so asking again for an
+    unchanged tree (e.g. HEAD after a commit that only moved a branch) does not run git.
+    Raises ScmError on error.
+    '''
+    def getFileIndex(self, revision=None):
+        if revision is None:
+            revision = "HEAD"
+        tree = self._resolveRevision("{0}^{{tree}}".format(revision))
+        with self.fileindexLock:
+            index = self.fileindexes.get(tree)
+            if index is not None:
+                self.fileindexes[tree] = self.fileindexes.pop(tree)
+                return index
+
+        index = None
+        store = self._getObjectStore()
+        if store is not None:
+            try:
+                index = FileIndex.fromPaths(store.walkTree(tree), tree)
+            except Exception as e:
+                self.debugPrint("object reader lookup failed, falling back: {0}".format(e))
+        if index is None:
+            output = b"".join(self._streamScmCommand(self._filesArgs(tree), separator=None))
+            index = FileIndex(output.decode('utf-8', 'replace'), tree)
+
+        with self.fileindexLock:
+            self.fileindexes[tree] = index
+            while len(self.fileindexes) > FILE_INDEX_CACHE_SIZE:
+                self.fileindexes.popitem(last=False)
+        return index
 
-        return files
+    '''
+    Private function to build the tracked file list command arguments
+    '''
+    def _filesArgs(self, revision=None):
+        return ['ls-tree', '-r', '-z', '--name-only', '--full-tree', revision or 'HEAD']
+
+    '''
+    Private function to parse the tracked file list output (NUL separated, see _filesArgs)
+    '''
+    def _parseFiles(self, output):
+        return [path for path in output.split("\0") if len(path) > 0]
         
     '''
     Revert changes to one or more files.
     If filename is specified, only revert changes to that file. If not specified (default) revert changes to all files.
     Returns nothing on success. Raises ScmError on error.
     '''
+    @BaseScm.invalidatesCache("getSubrepos")
     def revertFile(self, filename=None):
         #git reset --hard
         if filename is None:
@@ -465,6 +1967,7 @@ class GitScm(BaseScm):
     '''
     Return a list of the subrepositories/submodules, if any. Returns an empty list if none.
     '''
+    @BaseScm.cachedQuery
     def getSubrepos(self):
         subrepos = []
         subrepoFile = self.localpath + os.sep + ".gitmodules"
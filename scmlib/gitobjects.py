@@ -0,0 +1,553 @@
+import binascii
+import collections
+import heapq
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from .errors import ScmObjectError
+from .catfile import parseCommit
+from . import gitrefs
+
+#pack object type numbers
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {
+    OBJ_COMMIT: "commit",
+    OBJ_TREE: "tree",
+    OBJ_BLOB: "blob",
+    OBJ_TAG: "tag",
+}
+
+#default number of bytes of resolved delta bases kept in memory
+DEFAULT_DELTA_CACHE_BYTES = 32 * 1024 * 1024
+
+#git tree entry mode for submodule commits (gitlinks)
+GITLINK_MODE = "160000"
+
+'''
+Private function to read a variable length size from a delta header. Returns (value, new position).
+'''
+def _readDeltaSize(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        c = data[pos]
+        pos += 1
+        value |= (c & 0x7f) << shift
+        shift += 7
+        if not c & 0x80:
+            return value, pos
+
+'''
+Apply a git delta to a base object. Returns the resulting object data.
+Raises ScmObjectError if the delta does not match the base.
+'''
+def applyDelta(base, delta):
+    delta = bytearray(delta)
+    srcsize, pos = _readDeltaSize(delta, 0)
+    dstsize, pos = _readDeltaSize(delta, pos)
+    if srcsize != len(base):
+        raise ScmObjectError("Delta base size mismatch")
+
+    out = []
+    end = len(delta)
+    while pos < end:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            #copy from base
+            offset = 0
+            size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            if size == 0:
+                size = 0x10000
+            out.append(base[offset:offset + size])
+        elif op:
+            #insert literal data
+            out.append(bytes(delta[pos:pos + op]))
+            pos += op
+        else:
+            raise ScmObjectError("Invalid delta opcode")
+
+    result = b"".join(out)
+    if len(result) != dstsize:
+        raise ScmObjectError("Delta result size mismatch")
+    return result
+
+'''
+Parse the raw contents of a git tree object.
+Returns a list of (mode, name, oid) tuples in tree order, with name decoded as utf-8 text.
+'''
+def parseTree(data):
+    entries = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        space = data.index(b" ", pos)
+        nul = data.index(b"\0", space)
+        mode = data[pos:space].decode('ascii')
+        name = data[space + 1:nul].decode('utf-8', 'replace')
+        oid = binascii.hexlify(data[nul + 1:nul + 21]).decode('ascii')
+        entries.append((mode.zfill(6), name, oid))
+        pos = nul + 21
+    return entries
+
+class PackFile(object):
+    '''
+    Read access to one pack (.idx version 2 and .pack files), memory mapped.
+    '''
+    def __init__(self, idxpath):
+        self.idxpath = idxpath
+        self.packpath = idxpath[:-len(".idx")] + ".pack"
+        self.idxfile = open(self.idxpath, "rb")
+        self.packfile = open(self.packpath, "rb")
+        try:
+            self.idx = mmap.mmap(self.idxfile.fileno(), 0, access=mmap.ACCESS_READ)
+            self.pack = mmap.mmap(self.packfile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            self.close()
+            raise ScmObjectError("Unable to map pack {0}".format(self.packpath))
+
+        if self.idx[:4] != b"\377tOc" or struct.unpack(">I", self.idx[4:8])[0] != 2:
+            self.close()
+            raise ScmObjectError("Unsupported pack index format {0}".format(self.idxpath))
+        if self.pack[:4] != b"PACK":
+            self.close()
+            raise ScmObjectError("Invalid pack file {0}".format(self.packpath))
+
+        self.fanout = struct.unpack(">256I", self.idx[8:8 + 1024])
+        self.count = self.fanout[255]
+        self.shaStart = 8 + 1024
+        self.offsetStart = self.shaStart + 24 * self.count   #skip the sha1 and crc32 tables
+        self.largeStart = self.offsetStart + 4 * self.count
+
+    '''
+    Returns the pack offset of the object with the given binary id, or None if it is not in this pack.
+    '''
+    def find(self, binoid):
+        first = ord(binoid[0:1])
+        lo = self.fanout[first - 1] if first > 0 else 0
+        hi = self.fanout[first]
+        idx = self.idx
+        start = self.shaStart
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = start + 20 * mid
+            cur = idx[pos:pos + 20]
+            if cur < binoid:
+                lo = mid + 1
+            elif cur > binoid:
+                hi = mid
+            else:
+                return self._offset(mid)
+        return None
+
+    def _offset(self, index):
+        pos = self.offsetStart + 4 * index
+        offset = struct.unpack(">I", self.idx[pos:pos + 4])[0]
+        if offset & 0x80000000:
+            pos = self.largeStart + 8 * (offset & 0x7fffffff)
+            offset = struct.unpack(">Q", self.idx[pos:pos + 8])[0]
+        return offset
+
+    '''
+    Read the entry header at the given offset.
+    Returns (type, size, data position, base) where base is the base offset for OFS_DELTA entries,
+    the binary base id for REF_DELTA entries and None otherwise.
+    '''
+    def entryHeader(self, offset):
+        pack = self.pack
+        #one byte slices and ord read the same on Python 2 (str) and 3 (bytes)
+        c = ord(pack[offset:offset + 1])
+        pos = offset + 1
+        objtype = (c >> 4) & 7
+        size = c & 15
+        shift = 4
+        while c & 0x80:
+            c = ord(pack[pos:pos + 1])
+            pos += 1
+            size |= (c & 0x7f) << shift
+            shift += 7
+
+        base = None
+        if objtype == OBJ_OFS_DELTA:
+            c = ord(pack[pos:pos + 1])
+            pos += 1
+            rel = c & 0x7f
+            while c & 0x80:
+                c = ord(pack[pos:pos + 1])
+                pos += 1
+                rel = ((rel + 1) << 7) | (c & 0x7f)
+            base = offset - rel
+        elif objtype == OBJ_REF_DELTA:
+            base = pack[pos:pos + 20]
+            pos += 20
+        return objtype, size, pos, base
+
+    '''
+    Inflate the zlib stream starting at the given pack position, expecting 'size' bytes of output.
+    '''
+    def inflate(self, pos, size):
+        decomp = zlib.decompressobj()
+        out = []
+        chunk = max(4096, size + 64)
+        while True:
+            data = self.pack[pos:pos + chunk]
+            if not data:
+                break
+            pos += len(data)
+            out.append(decomp.decompress(data))
+            #the pack data after the end of the stream is left unused (decompressobj has no 'eof' on Python 2)
+            if decomp.unused_data:
+                break
+        result = b"".join(out)
+        if len(result) != size:
+            raise ScmObjectError("Corrupt object in pack {0}".format(self.packpath))
+        return result
+
+    def close(self):
+        for attr in ("idx", "pack"):
+            m = getattr(self, attr, None)
+            if m is not None:
+                try:
+                    m.close()
+                except (ValueError, mmap.error):
+                    pass
+                setattr(self, attr, None)
+        for f in (self.idxfile, self.packfile):
+            try:
+                f.close()
+            except (IOError, OSError):
+                pass
+
+class GitObjectStore(object):
+    '''
+    In-process, read-only access to a git repository's refs and objects without running git.
+    Resolves refs from the refs directory and packed-refs, reads loose objects and packs (through mmap),
+    and inflates commits and trees on demand. Resolved delta bases are kept in a small LRU cache.
+    Raises ScmObjectError for anything it cannot answer, so callers can fall back to running git.
+    '''
+    def __init__(self, gitdir, deltaCacheBytes=DEFAULT_DELTA_CACHE_BYTES):
+        self.gitdir = gitdir
+        self.commondir = gitrefs.findCommonDir(gitdir)
+        self.objdirs = self._findObjectDirs(os.path.join(self.commondir, "objects"))
+        self.lock = threading.RLock()
+        self.packs = {}
+        self.scanned = False
+        self.deltaCache = collections.OrderedDict()
+        self.deltaCacheBytes = deltaCacheBytes
+        self.deltaCacheUsed = 0
+        self._checkSupported()
+        self.shallow = self._readShallow()
+
+    '''
+    Private function to raise ScmObjectError for repositories whose history git rewrites on the fly
+    (grafts, replace refs) or whose object format is not sha1
+    '''
+    def _checkSupported(self):
+        if os.path.exists(os.path.join(self.commondir, "info", "grafts")):
+            raise ScmObjectError("Repositories with grafts are not supported")
+        replace = os.path.join(self.commondir, "refs", "replace")
+        if os.path.isdir(replace) and len(os.listdir(replace)) > 0:
+            raise ScmObjectError("Repositories with replace refs are not supported")
+        for name in gitrefs.readPackedRefs(self.commondir):
+            if name.startswith("refs/replace/"):
+                raise ScmObjectError("Repositories with replace refs are not supported")
+        try:
+            with open(os.path.join(self.commondir, "config"), "r") as f:
+                for line in f:
+                    if line.strip().replace(" ", "").lower().startswith("objectformat=") and "sha1" not in line.lower():
+                        raise ScmObjectError("Only sha1 repositories are supported")
+        except IOError:
+            pass
+
+    def _readShallow(self):
+        shallow = set()
+        try:
+            with open(os.path.join(self.commondir, "shallow"), "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if len(line) > 0:
+                        shallow.add(line)
+        except IOError:
+            pass
+        return shallow
+
+    '''
+    Private function returning the object directory and any alternate object directories it refers to
+    '''
+    def _findObjectDirs(self, objdir, depth=0):
+        dirs = [objdir]
+        if depth > 5:
+            return dirs
+        try:
+            with open(os.path.join(objdir, "info", "alternates"), "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if len(line) == 0 or line.startswith("#"):
+                        continue
+                    if not os.path.isabs(line):
+                        line = os.path.normpath(os.path.join(objdir, line))
+                    dirs.extend(self._findObjectDirs(line, depth + 1))
+        except IOError:
+            pass
+        return dirs
+
+    '''
+    Private function to (re)scan the pack directories, opening new packs and keeping already opened ones
+    '''
+    def _scanPacks(self):
+        found = {}
+        for objdir in self.objdirs:
+            packdir = os.path.join(objdir, "pack")
+            try:
+                names = os.listdir(packdir)
+            except OSError:
+                continue
+            for name in names:
+                if not name.endswith(".idx"):
+                    continue
+                path = os.path.join(packdir, name)
+                pack = self.packs.get(path)
+                if pack is None:
+                    if not os.path.exists(path[:-len(".idx")] + ".pack"):
+                        continue
+                    pack = PackFile(path)
+                found[path] = pack
+        for path, pack in self.packs.items():
+            if path not in found:
+                pack.close()
+        self.packs = found
+        self.scanned = True
+
+    '''
+    Resolve a ref or revision name to an object id. Supports "HEAD", full refnames, short branch, tag and
+    remote names, and full hexadecimal object ids. Tags are not peeled.
+    Raises ScmObjectError for anything else (e.g. "HEAD~1" or abbreviated ids).
+    '''
+    def resolve(self, name):
+        name = str(name)
+        if len(name) == 40 and all(c in "0123456789abcdef" for c in name.lower()):
+            return name.lower()
+        if name == "HEAD" or name.startswith("refs/"):
+            candidates = [name]
+        else:
+            candidates = ["refs/" + name, "refs/tags/" + name, "refs/heads/" + name, "refs/remotes/" + name, "refs/remotes/" + name + "/HEAD"]
+        for candidate in candidates:
+            result = gitrefs.resolveRef(self.gitdir, candidate, self.commondir)
+            if result is not None and result[1] is not None:
+                return result[1]
+        raise ScmObjectError("Cannot resolve {0}".format(name))
+
+    '''
+    Returns a sorted list of (refname, oid) tuples for all refs under the given prefix (e.g. "refs/heads/")
+    '''
+    def listRefs(self, prefix="refs/"):
+        refs = {}
+        for name, value in gitrefs.readPackedRefs(self.commondir).items():
+            if name.startswith(prefix):
+                refs[name] = value[0]
+        top = os.path.join(self.commondir, *prefix.rstrip("/").split("/"))
+        for root, dirs, files in os.walk(top):
+            for f in files:
+                if f.endswith(".lock"):
+                    continue
+                path = os.path.join(root, f)
+                name = os.path.relpath(path, self.commondir).replace(os.sep, "/")
+                result = gitrefs.resolveRef(self.gitdir, name, self.commondir)
+                if result is not None and result[1] is not None:
+                    refs[name] = result[1]
+        return sorted(refs.items())
+
+    '''
+    Read an object by its full hexadecimal id. Returns a (type name, data) tuple.
+    Raises ScmObjectError if the object cannot be found or read.
+    '''
+    def read(self, oid):
+        with self.lock:
+            result = self._readLoose(oid)
+            if result is not None:
+                return result
+            binoid = binascii.unhexlify(oid)
+            result = self._readPacked(binoid)
+            if result is None:
+                #the object may be in a pack written since the last scan
+                self._scanPacks()
+                result = self._readPacked(binoid)
+            if result is None:
+                raise ScmObjectError("Object {0} not found".format(oid))
+            return (TYPE_NAMES[result[0]], result[1])
+
+    def _readLoose(self, oid):
+        for objdir in self.objdirs:
+            path = os.path.join(objdir, oid[:2], oid[2:])
+            try:
+                with open(path, "rb") as f:
+                    raw = zlib.decompress(f.read())
+            except IOError:
+                continue
+            except zlib.error:
+                raise ScmObjectError("Corrupt loose object {0}".format(oid))
+            nul = raw.index(b"\0")
+            objtype = raw[:nul].split(b" ")[0].decode('ascii')
+            return (objtype, raw[nul + 1:])
+        return None
+
+    def _readPacked(self, binoid):
+        if not self.scanned:
+            self._scanPacks()
+        for pack in self.packs.values():
+            offset = pack.find(binoid)
+            if offset is not None:
+                return self._readPackEntry(pack, offset)
+        return None
+
+    '''
+    Private function to read and fully resolve the pack entry at the given offset, walking the delta chain
+    down to its base and applying the deltas back up
+    '''
+    def _readPackEntry(self, pack, offset):
+        chain = []
+        while True:
+            key = (pack.packpath, offset)
+            cached = self.deltaCache.get(key)
+            if cached is not None:
+                self.deltaCache.pop(key)
+                self.deltaCache[key] = cached
+                objtype, data = cached
+                break
+
+            objtype, size, pos, base = pack.entryHeader(offset)
+            if objtype == OBJ_OFS_DELTA:
+                chain.append((key, pack.inflate(pos, size)))
+                offset = base
+            elif objtype == OBJ_REF_DELTA:
+                chain.append((key, pack.inflate(pos, size)))
+                baseoid = binascii.hexlify(base).decode('ascii')
+                typename, data = self.read(baseoid)
+                objtype = [k for k, v in TYPE_NAMES.items() if v == typename][0]
+                break
+            elif objtype in TYPE_NAMES:
+                data = pack.inflate(pos, size)
+                break
+            else:
+                raise ScmObjectError("Invalid object type {0} in pack {1}".format(objtype, pack.packpath))
+
+        if len(chain) > 0:
+            #only the intermediate bases are worth caching, the requested object is returned to the caller
+            self._cacheBase((pack.packpath, offset), objtype, data)
+        while len(chain) > 0:
+            key, delta = chain.pop()
+            data = applyDelta(data, delta)
+            if len(chain) > 0:
+                self._cacheBase(key, objtype, data)
+        return (objtype, data)
+
+    def _cacheBase(self, key, objtype, data):
+        if len(data) > self.deltaCacheBytes // 4 or key in self.deltaCache:
+            return
+        self.deltaCache[key] = (objtype, data)
+        self.deltaCacheUsed += len(data)
+        while self.deltaCacheUsed > self.deltaCacheBytes:
+            oldkey, (oldtype, olddata) = self.deltaCache.popitem(last=False)
+            self.deltaCacheUsed -= len(olddata)
+
+    '''
+    Returns the id of the commit an object id refers to, following annotated tags.
+    Raises ScmObjectError if it does not lead to a commit.
+    '''
+    def peelToCommit(self, oid):
+        for depth in range(10):
+            objtype, data = self.read(oid)
+            if objtype == "commit":
+                return oid
+            if objtype != "tag":
+                break
+            #annotated tag, follow its object line
+            oid = data[len(b"object "):data.index(b"\n")].decode('ascii')
+        raise ScmObjectError("{0} is not a commit".format(oid))
+
+    '''
+    Read and parse a commit (see catfile.parseCommit).
+    Parents of shallow commits are dropped, as git log does. Raises ScmObjectError on error.
+    '''
+    def readCommit(self, oid):
+        objtype, data = self.read(oid)
+        if objtype != "commit":
+            raise ScmObjectError("{0} is not a commit".format(oid))
+        commit = parseCommit(data)
+        if oid in self.shallow:
+            commit['parents'] = []
+        return commit
+
+    '''
+    Read and parse a tree (see parseTree). Raises ScmObjectError on error.
+    '''
+    def readTree(self, oid):
+        objtype, data = self.read(oid)
+        if objtype != "tree":
+            raise ScmObjectError("{0} is not a tree".format(oid))
+        return parseTree(data)
+
+    '''
+    Generator yielding the paths of all files (and submodule gitlinks) in a tree, recursively, in the same
+    order as 'git ls-tree -r'
+    '''
+    def walkTree(self, oid, prefix=""):
+        for mode, name, entryoid in self.readTree(oid):
+            path = prefix + name
+            if mode.startswith("04"):
+                for sub in self.walkTree(entryoid, path + "/"):
+                    yield sub
+            else:
+                yield path
+
+    '''
+    Generator yielding (oid, commit) tuples for the history of the given commits, newest first by committer date
+    (the default 'git log' order), each commit once.
+    '''
+    def walkHistory(self, oids, firstParent=False):
+        heap = []
+        seen = set()
+        counter = 0
+        for oid in oids:
+            if oid in seen:
+                continue
+            seen.add(oid)
+            commit = self.readCommit(oid)
+            heapq.heappush(heap, (-commit['committer'][2], counter, oid, commit))
+            counter += 1
+        while heap:
+            negdate, ctr, oid, commit = heapq.heappop(heap)
+            yield oid, commit
+            parents = commit['parents'][:1] if firstParent else commit['parents']
+            for parent in parents:
+                if parent in seen:
+                    continue
+                seen.add(parent)
+                pcommit = self.readCommit(parent)
+                heapq.heappush(heap, (-pcommit['committer'][2], counter, parent, pcommit))
+                counter += 1
+
+    def close(self):
+        with self.lock:
+            for pack in self.packs.values():
+                pack.close()
+            self.packs = {}
+            self.deltaCache.clear()
+            self.deltaCacheUsed = 0
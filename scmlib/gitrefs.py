@@ -0,0 +1,140 @@
+import os
+import threading
+
+#maximum depth of symbolic refs followed when resolving a ref
+MAX_SYMREF_DEPTH = 5
+
+_packedRefsCache = {}
+_packedRefsLock = threading.Lock()
+
+'''
+Returns a hashable (mtime, size) stamp for the given path, or None if it does not exist.
+'''
+def fileStamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+'''
+Returns a hashable stamp for a directory tree: the (mtime, size) of every directory below path, including itself.
+Adding, replacing (git writes a new file and renames it into place) or removing a file changes its directory's stamp.
+Returns None if the directory does not exist.
+'''
+def treeStamp(path):
+    if not os.path.isdir(path):
+        return None
+    stamps = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        stamps.append((os.path.relpath(dirpath, path), fileStamp(dirpath)))
+    return tuple(stamps)
+
+'''
+Returns the git directory of the given working tree, following a ".git" file (submodules, linked worktrees).
+Returns None if the working tree has no git directory.
+'''
+def findGitDir(worktree):
+    dotgit = os.path.join(worktree, ".git")
+    if os.path.isdir(dotgit):
+        return dotgit
+    if not os.path.isfile(dotgit):
+        return None
+    try:
+        with open(dotgit, "r") as f:
+            line = f.readline().strip()
+    except IOError:
+        return None
+    if not line.startswith("gitdir:"):
+        return None
+    path = line[len("gitdir:"):].strip()
+    if not os.path.isabs(path):
+        path = os.path.join(worktree, path)
+    return os.path.normpath(path)
+
+'''
+Returns the common git directory holding the refs and objects shared by all worktrees of a repo.
+For a linked worktree this is the main repo's git directory, otherwise it is gitdir itself.
+'''
+def findCommonDir(gitdir):
+    try:
+        with open(os.path.join(gitdir, "commondir"), "r") as f:
+            path = f.readline().strip()
+    except IOError:
+        return gitdir
+    if not os.path.isabs(path):
+        path = os.path.join(gitdir, path)
+    return os.path.normpath(path)
+
+'''
+Returns a dictionary of refname -> (oid, peeled oid or None) read from the packed-refs file of a repo.
+The parsed file is kept in memory until its mtime or size changes.
+'''
+def readPackedRefs(commondir):
+    path = os.path.join(commondir, "packed-refs")
+    stamp = fileStamp(path)
+    if stamp is None:
+        return {}
+    with _packedRefsLock:
+        cached = _packedRefsCache.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+    refs = {}
+    last = None
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if len(line) == 0 or line.startswith("#"):
+                    continue
+                if line.startswith("^"):
+                    #peeled value of the annotated tag on the previous line
+                    if last is not None:
+                        refs[last] = (refs[last][0], line[1:].strip())
+                    continue
+                oid, sep, name = line.partition(" ")
+                refs[name] = (oid, None)
+                last = name
+    except IOError:
+        return {}
+
+    with _packedRefsLock:
+        _packedRefsCache[path] = (stamp, refs)
+    return refs
+
+'''
+Private function to read a loose ref file. Returns the stripped content or None if it does not exist.
+'''
+def _readLooseRef(path):
+    try:
+        with open(path, "r") as f:
+            return f.readline().strip()
+    except IOError:
+        return None
+
+'''
+Resolve a ref name (e.g. "HEAD", "refs/heads/master") without running git.
+Per-worktree refs (HEAD and friends) are read from gitdir, everything else from the common dir.
+Returns a (refname, oid) tuple, where refname is the final ref a symbolic ref points to and oid is None
+for an unborn branch. Returns None if the ref does not exist.
+'''
+def resolveRef(gitdir, name, commondir=None):
+    if commondir is None:
+        commondir = findCommonDir(gitdir)
+    for depth in range(MAX_SYMREF_DEPTH):
+        if name.startswith("refs/"):
+            value = _readLooseRef(os.path.join(commondir, name))
+        else:
+            value = _readLooseRef(os.path.join(gitdir, name))
+        if value is None:
+            packed = readPackedRefs(commondir).get(name)
+            if packed is None:
+                return (name, None) if depth > 0 else None
+            return (name, packed[0])
+        if value.startswith("ref:"):
+            name = value[len("ref:"):].strip()
+            continue
+        return (name, value)
+    return None
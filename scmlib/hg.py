@@ -1,10 +1,46 @@
 from .basescm import BaseScm
 from .errors import ScmError
+from .errors import ScmCommandError
+from .gitrefs import fileStamp
+from .changeset import HgChangeset
+from .churn import Churn
+from .commitindex import CommitIndex
+from .commitindex import INDEX_FILENAME
+from .commitindex import parseDateBound
+from .fileindex import FileIndex
+from .hgcmdserver import HgCommandServer
+from .patch import Patch
+from .status import StatusEntry
 
 import re
 import os
+import binascii
+import fnmatch
+import codecs
+import collections
 import datetime
 import sys
+import threading
+import time
+import timeit
+
+#template used to fill the commit index: rev, node, parent nodes, author, hgdate, branch and description, each followed by a NUL
+INDEX_TEMPLATE = r'{rev}\0{node}\0{p1node} {p2node}\0{author}\0{date|hgdate}\0{branch}\0{desc}\0'
+INDEX_FIELDS = 7
+NULL_NODE = "0" * 40
+
+#number of file indexes kept per changeset id by getFileIndex
+FILE_INDEX_CACHE_SIZE = 4
+
+#hg status codes of files that are not tracked changes, and the git style state letters of the tracked ones
+#(removed and missing files are both deleted)
+STATUS_KINDS = {'?': "untracked", 'I': "ignored", 'C': "clean"}
+STATUS_CODES = {'M': 'M', 'A': 'A', 'R': 'D', '!': 'D'}
+
+LOG_TEMPLATE = r'changeset: {rev}:{node}\nbranch: {branch}\nuser: {author}\ndate: {date|hgdate}\nparents: {parents}\nsummary: {splitlines(desc) % \'{line} \'}\n\n'
+
+#template used by getChurnLog with --patch: \x01, node and author name, each followed by a NUL, then the diff
+CHURN_LOG_TEMPLATE = r'\x01{node}\0{author|person}\0'
 
 class HgScm(BaseScm):
     '''
@@ -43,6 +79,251 @@ class HgScm(BaseScm):
         if self.toolpath is None:
             raise ScmError("Cannot find hg executable. Must have mercurial available in your PATH to use commands")
 
+        self.useCommandServer = False
+        self.cmdserver = None
+        self.useCommitIndex = False
+        self.commitindex = None
+        self.fileindexes = collections.OrderedDict()
+        self.fileindexLock = threading.Lock()
+
+    '''
+    Enable or disable the persistent 'hg serve --cmdserver pipe' process (see hgcmdserver.HgCommandServer).
+    If no value is specified, the current state will toggle. When enabled, every command run in the local repo
+    goes through the command server instead of starting a new hg process.
+    '''
+    def setCommandServer(self, value=None):
+        if value is None:
+            value = not self.useCommandServer
+        self.useCommandServer = bool(value)
+        if not self.useCommandServer:
+            self.close()
+
+    '''
+    Enable or disable the persistent commit index (see commitindex.CommitIndex), stored in the .hg directory.
+    If no value is specified, the current state will toggle. When enabled, log queries without a revision or file
+    and getAncestors of the working copy parent are answered from the index, which is brought up to date
+    before each query.
+    '''
+    def setCommitIndex(self, value=None):
+        if value is None:
+            value = not self.useCommitIndex
+        self.useCommitIndex = bool(value)
+        if not self.useCommitIndex and self.commitindex is not None:
+            self.commitindex.close()
+            self.commitindex = None
+
+    '''
+    Stop the command server, if it is running, and close the commit index and the working copy watcher. They are set up again when needed.
+    '''
+    def close(self):
+        super(HgScm, self).close()
+        if self.cmdserver is not None:
+            self.cmdserver.close()
+            self.cmdserver = None
+        if self.commitindex is not None:
+            self.commitindex.close()
+            self.commitindex = None
+
+    '''
+    Private function to get the commit index for this repo.
+    Returns None if the index is disabled or the repo does not exist yet.
+    '''
+    def _getCommitIndex(self):
+        if not self.useCommitIndex or self.localpath is None:
+            return None
+        hgdir = os.path.join(self.localpath, ".hg")
+        if not os.path.isdir(hgdir):
+            return None
+        if self.commitindex is None:
+            self.commitindex = CommitIndex(os.path.join(hgdir, INDEX_FILENAME))
+        return self.commitindex
+
+    '''
+    Bring the commit index up to date with the repository. Revisions are append-only in mercurial, so only the
+    revisions after the last indexed one are read. If that revision no longer matches (e.g. after a strip),
+    the index is rebuilt. Does not run hg at all if the changelog has not changed since the last update.
+    Returns the number of commits added. Raises ScmError if the index is not enabled or on error.
+    '''
+    def updateCommitIndex(self):
+        index = self._getCommitIndex()
+        if index is None:
+            raise ScmError("Commit index is not enabled")
+
+        stamp = repr(fileStamp(os.path.join(self.localpath, ".hg", "store", "00changelog.i")))
+        if index.getMeta('stamp') == stamp:
+            return 0
+
+        lastrev = int(index.getMeta('rev', -1))
+        lastnode = index.getMeta('node')
+        commits = None
+        if lastrev >= 0:
+            try:
+                #start at the last indexed revision to check it is still the same changeset
+                output = self._processScmCommand(['log', '-r', "{0}:".format(lastrev), '--template', INDEX_TEMPLATE])
+                commits = list(self._iterIndexCommits(output.split("\0")))
+            except ScmError:
+                commits = None
+            if commits is None or len(commits) == 0 or commits[0]['hash'] != lastnode:
+                self.debugPrint("commit index is out of date, rebuilding")
+                index.clear()
+                commits = None
+        if commits is None:
+            output = self._processScmCommand(['log', '-r', "0:", '--template', INDEX_TEMPLATE])
+            commits = list(self._iterIndexCommits(output.split("\0")))
+
+        added = index.addCommits(commits)
+        if len(commits) > 0:
+            index.setMeta('rev', commits[-1]['rev'])
+            index.setMeta('node', commits[-1]['hash'])
+        index.setMeta('stamp', stamp)
+        self.debugPrint("commit index: {0} commits added".format(added))
+        return added
+
+    '''
+    Private generator to parse the commit index log output (see INDEX_TEMPLATE) into commit dictionaries for
+    CommitIndex.addCommits. The message is summarized the same way as LOG_TEMPLATE does.
+    '''
+    def _iterIndexCommits(self, fields):
+        record = []
+        for field in fields:
+            record.append(field)
+            if len(record) < INDEX_FIELDS:
+                continue
+            rev, node, parents, author, date, branch, desc = record
+            record = []
+            yield {
+                'rev': int(rev),
+                'hash': node,
+                'parents': [p for p in parents.split() if p != NULL_NODE],
+                'author': author,
+                #dates are reported in UTC (see LOG_TEMPLATE)
+                'epoch': int(float(date.split()[0])),
+                'offset': 0,
+                'branch': branch,
+                'message': "".join(line + " " for line in desc.splitlines()).strip(),
+            }
+
+    '''
+    Private function to build a changeset from a commit index row
+    '''
+    def _changesetFromRow(self, row):
+        return HgChangeset(row['hash'], row['parents'], row['author'], row['epoch'], row['offset'], row['message'],
+                           id=str(row['rev']), branch=row['branch'])
+
+    '''
+    Private function to answer a log query from the commit index.
+    Returns a list of changesets, or None if the index is disabled or cannot answer the query (dates it cannot
+    interpret exactly like mercurial, author patterns, errors), in which case the caller should run hg.
+    '''
+    def _queryCommitIndex(self, limit=None, startdate=None, enddate=None, author=None):
+        index = self._getCommitIndex()
+        if index is None:
+            return None
+        start = parseDateBound(startdate) if startdate else None
+        end = parseDateBound(enddate) if enddate else None
+        if (startdate and start is None) or (enddate and end is None):
+            return None
+        if author is not None and (author.startswith("re:") or author.startswith("literal:")):
+            return None
+        try:
+            self.updateCommitIndex()
+            #hg matches users case-insensitively
+            rows = index.query(start, end, author, ignoreCase=True, limit=limit)
+        except ScmError as e:
+            self.debugPrint("commit index query failed, falling back: {0}".format(e))
+            return None
+        return [self._changesetFromRow(r) for r in rows]
+
+    '''
+    Private function returning the node of the working copy parent, read from the dirstate.
+    Returns None if it cannot be read.
+    '''
+    def _workingParent(self):
+        try:
+            with open(os.path.join(self.localpath, ".hg", "dirstate"), "rb") as f:
+                data = f.read(64)
+        except IOError:
+            return None
+        marker = b"dirstate-v2\n"
+        if data.startswith(marker):
+            #dirstate-v2 docket: the parents are stored in 32 byte fields after the marker
+            data = data[len(marker):]
+        if len(data) < 20:
+            return None
+        node = binascii.hexlify(data[:20]).decode('ascii')
+        return None if node == NULL_NODE else node
+
+    '''
+    Private function to get the command server for a command run from 'cwd'.
+    Returns None if the server is disabled, the local path does not contain a repo yet, or the command runs
+    outside the local repo (e.g. clone), in which case the command runs in its own hg process.
+    '''
+    def _getCommandServer(self, cwd=None):
+        if not self.useCommandServer or self.localpath is None:
+            return None
+        if cwd is not None and os.path.abspath(cwd) != os.path.abspath(self.localpath):
+            return None
+        if not os.path.isdir(os.path.join(self.localpath, ".hg")):
+            return None
+        if self.cmdserver is None:
+            server = HgCommandServer(self.toolpath, self.localpath)
+            try:
+                server.start()
+            except ScmError as e:
+                self.debugPrint("command server not available: {0}".format(e))
+                self.useCommandServer = False
+                return None
+            self.cmdserver = server
+        return self.cmdserver
+
+    '''
+    Execute hg with the given argument list (see BaseScm._processScmCommand).
+    Runs the command in the command server when it is enabled. If the server cannot be started, it is disabled
+    and the command runs in its own hg process. A server that dies while running a command raises ScmError,
+    since the command may already have taken effect; the server is restarted on the next command.
+    Commands with an 'input' always run in their own hg process.
+    '''
+    def _processScmCommand(self, args, cwd=None, outfile=None, input=None):
+        server = self._getCommandServer(cwd) if input is None else None
+        if server is None:
+            return super(HgScm, self)._processScmCommand(args, cwd, outfile, input)
+
+        cmd, cwd = self._buildScmCommand(args, cwd)
+        self.debugPrint("running command {0} (command server)".format(" ".join(cmd)))
+        start = time.time()
+        timer = timeit.default_timer()
+        returncode, cout, cerr = server.runCommand(cmd[1:])
+        self._recordCommand(cmd, cwd, start, timeit.default_timer() - timer, returncode, len(cout), len(cerr))
+
+        self.rawoutput = cout.decode('utf-8', 'replace')
+        if returncode != 0:
+            raise ScmCommandError(cerr.decode('utf-8', 'replace'), " ".join(cmd), returncode)
+
+        #write command output to a file if requested (in utf-8)
+        if outfile is not None:
+            with codecs.open(outfile, mode='w', encoding='utf-8', errors='replace') as f:
+                f.write(self.rawoutput)
+
+        return self.rawoutput
+
+    '''
+    Private function returning a snapshot of the repository state for the query cache (see BaseScm._getRepoState).
+    Uses the stamps of the dirstate (working copy parents), the changelog (tip), bookmarks, the working copy
+    branch, local tags, .hgtags and .hgsub.
+    '''
+    def _getRepoState(self):
+        hgdir = os.path.join(self.localpath, ".hg")
+        if not os.path.isdir(hgdir):
+            return None
+        return (fileStamp(os.path.join(hgdir, "dirstate")),
+                fileStamp(os.path.join(hgdir, "store", "00changelog.i")),
+                fileStamp(os.path.join(hgdir, "store", "00changelog.d")),
+                fileStamp(os.path.join(hgdir, "bookmarks")),
+                fileStamp(os.path.join(hgdir, "branch")),
+                fileStamp(os.path.join(hgdir, "localtags")),
+                fileStamp(os.path.join(self.localpath, ".hgtags")),
+                fileStamp(os.path.join(self.localpath, ".hgsub")))
+
     '''
     Private function to generate pathspec args based on include/exclude parameters
     '''
@@ -76,6 +357,7 @@ class HgScm(BaseScm):
     Initialize a repo from scratch in the local path.
     Returns nothing on success. Raises ScmError on error.
     '''
+    @BaseScm.invalidatesCache()
     def initialize(self):
         self._processScmCommand(['init'])
 
@@ -84,6 +366,7 @@ class HgScm(BaseScm):
     Returns nothing on success. Raises ScmError on error.
     '''        
     @BaseScm.requiresRemoteRepo
+    @BaseScm.invalidatesCache()
     def clone(self):
         self._processScmCommand(['clone', self.remotepath, self.localpath], cwd='.')
 
@@ -106,6 +389,7 @@ class HgScm(BaseScm):
     If message is specified, use the given commit message.
     Returns nothing on success. Raises ScmError on error.
     '''
+    @BaseScm.invalidatesCache()
     def commit(self, message):
         args = ['commit']
         if self.username:
@@ -124,10 +408,46 @@ class HgScm(BaseScm):
     '''
     Return the current state of files in the repository.
     If type is specified ("modified", "added", "removed", "deleted", "unknown", "clean", "ignored"), only return status for the requested type.
-    If type is not specified, will return status for all types.
-    Returns a list of tuples for the requested file types on success. Raises ScmError on error. List can be empty if there are no modified files.
+    If type is not specified, will return status for all types except clean and ignored files.
+    If untracked is "no", unknown files are left out of an unfiltered status; mercurial always lists every untracked file otherwise.
+    Returns a list of (state, filename) tuples for the requested file types on success. Raises ScmError on error. List can be empty if there are no modified files.
+    '''
+    def status(self, type=None, include=None, exclude=None, untracked=None):
+        return [(entry.state, entry.path) for entry in self.iterStatus(type, include, exclude, untracked)]
+
+    '''
+    Generator version of status, yielding a StatusEntry (see status.StatusEntry) per file as 'hg status' reports it.
+    Raises ScmError on error (after the entries read so far have been yielded).
+    '''
+    def iterStatus(self, type=None, include=None, exclude=None, untracked=None):
+        args = self._statusArgs(type, include, exclude, untracked)
+        if type not in ("clean", "ignored") and include is None and exclude is None:
+            entries = self._watchedStatus(type in (None, "unknown") and untracked != "no")
+            if entries is not None:
+                for entry in entries:
+                    if type is None or entry.matches(type):
+                        yield entry
+                return
+
+        for entry in HgScm._iterStatusEntries(self._streamScmCommand(args, separator="\0")):
+            yield entry
+
+    '''
+    Private generator yielding the status entries of every changed and untracked file, or only of the given paths
+    (see BaseScm._watchedStatus)
     '''
-    def status(self, type=None, include=None, exclude=None):
+    def _scanStatus(self, paths=None, untracked=True):
+        args = ['status', '--print0']
+        if not untracked:
+            args.extend(['-m', '-a', '-r', '-d'])
+        if paths is not None:
+            args.extend(["path:{0}".format(path) for path in paths])
+        return HgScm._iterStatusEntries(self._streamScmCommand(args, separator="\0"))
+
+    '''
+    Private function to build the status command arguments. Raises ScmError for an unknown file type or untracked mode.
+    '''
+    def _statusArgs(self, type=None, include=None, exclude=None, untracked=None):
         typeLookup = {
             "modified": '-m',
             "added": '-a',
@@ -138,44 +458,47 @@ class HgScm(BaseScm):
             "ignored": '-i'
         }
 
-        stateLookup = {
-            "M": "mod",
-            "A": "add",
-            "D": "del",
-            "R": "del",
-            "I": "ign",
-            "?": "unk",
-            "C": "cln"
-        }
-
-        args = ['status']
+        args = ['status', '--print0']
 
         if type is not None:
             if not type in typeLookup:
                 raise ScmError("Unknown file type to search for: {0}".format(type))
             args.append(typeLookup[type])
+        if untracked is not None and untracked not in ("all", "normal", "no"):
+            raise ScmError("Unknown untracked files mode: {0}".format(untracked))
+        if type is None and untracked == "no":
+            args.extend(['-m', '-a', '-r', '-d'])
             
         args.extend(self._getPathspecArgs(include, exclude))
+        return args
 
-        output = self._processScmCommand(args)
-
-        results = []
-        for line in output.splitlines():
-            line = line.strip()
-            if len(line) > 0:
-                line = line.split()
-                if line[0] in stateLookup:
-                    state = stateLookup[line[0]]
-                else:
-                    state = "unk"
-                results.append((state, line[1]))
+    '''
+    Private function to parse the status command output into a list of (state, filename) tuples
+    '''
+    def _parseStatus(self, output, type=None):
+        return [(entry.state, entry.path) for entry in HgScm._iterStatusEntries(output.split("\0"))]
 
-        return results
+    '''
+    Private generator to parse 'hg status --print0' output from an iterable of NUL separated records ("<code> <path>")
+    Yields a StatusEntry per file, with the state letter in 'worktree' (removed and missing files are both 'D').
+    '''
+    @staticmethod
+    def _iterStatusEntries(records):
+        for record in records:
+            if len(record) < 3:
+                continue
+            code = record[0]
+            path = record[2:]
+            if code in STATUS_KINDS:
+                yield StatusEntry(path, STATUS_KINDS[code])
+            else:
+                yield StatusEntry(path, "tracked", worktree=STATUS_CODES.get(code, 'M'))
 
     '''
     Move the current pointer in the repository to the given revision id.
     Returns nothing on success. Raises ScmError on error.
     '''    
+    @BaseScm.invalidatesCache()
     def gotoRevision(self, revision=None):
         if revision is None:
             revision = "default"
@@ -186,12 +509,11 @@ class HgScm(BaseScm):
     Returns the current revision id on success. Raises ScmError on error.
     '''
     def getCurrentRevision(self, showmod=False, length=None):
-        output = self._processScmCommand(['identify', '-i'])
-
-        lines = output.splitlines()
-        rev = lines[0].strip()
-        if len(rev) == 0:
-            raise ScmError("Current revision not found")
+        if showmod == True:
+            #the "+" mercurial adds for uncommitted changes depends on the working copy, so never use the cache here
+            rev = self._identify()
+        else:
+            rev = self._getHeadRevision()
 
         if length:
             rev = rev[:length]
@@ -200,6 +522,26 @@ class HgScm(BaseScm):
             rev = rev.rstrip("+")
         return rev
 
+    '''
+    Private function returning the output of 'hg identify -i' for the working copy parent
+    '''
+    def _identify(self):
+        output = self._processScmCommand(['identify', '-i'])
+
+        lines = output.splitlines()
+        rev = lines[0].strip()
+        if len(rev) == 0:
+            raise ScmError("Current revision not found")
+        return rev
+
+    '''
+    Private function returning the revision id of the working copy parent without the uncommitted changes marker.
+    Kept separate from getCurrentRevision so the query cache does not keep the working copy state.
+    '''
+    @BaseScm.cachedQuery
+    def _getHeadRevision(self):
+        return self._identify().rstrip("+")
+
     '''
     Change to the requested branch name in the repository.
     Returns nothing on success. Raises ScmError on error.
@@ -212,6 +554,7 @@ class HgScm(BaseScm):
     Return the name of the branch currently used in the repository.
     Returns the name of the current branch success. Raises ScmError on error.
     '''
+    @BaseScm.cachedQuery
     def getCurrentBranch(self):
         output = self._processScmCommand(['identify', '-b'])
 
@@ -223,24 +566,122 @@ class HgScm(BaseScm):
 
     '''
     Return a list of the local branches (named branches AND detached heads)
+    Mercurial has no remote tracking branches, and ahead/behind counts are not computed: remotes and aheadBehind are ignored.
     '''
-    def getBranches(self):
+    @BaseScm.cachedQuery
+    def getBranches(self, remotes=False, aheadBehind=False):
         #NOTE: if there are multiple heads, they will all have the same branch name (i.e. default)
-        output = self._processScmCommand(['heads', '--debug', '--template', r'changeset: {rev}:{node}\nbranch: {branch}\nuser: {author}\ndate: {localdate(date, \'UTC\')|date}\nparents: {parents}\nsummary: {splitlines(desc) % \'{line} \'}\n\n'])
+        output = self._processScmCommand(['heads', '--debug', '--template', LOG_TEMPLATE])
         return self._parseChangesets(output)
 
     @BaseScm.requiresRemoteRepo
+    @BaseScm.invalidatesCache()
     def updateAndMerge(self):
         self._processScmCommand(['pull', '-u'])
 
     @BaseScm.requiresRemoteRepo
+    @BaseScm.invalidatesCache()
     def update(self):
         self._processScmCommand(['pull'])
 
+    @BaseScm.invalidatesCache()
     def merge(self, revision):        
         self._processScmCommand(['merge', '-r', revision])
 
     def getPatch(self, rev1=None, rev2=None, outfile=None, context=5, stat=False, include=None, exclude=None, submodules=True):
+        output = self._processScmCommand(self._patchArgs(rev1, rev2, context, stat, include, exclude, submodules), outfile=outfile)
+        return output
+
+    '''
+    Streaming version of getPatch. Takes the same arguments (except outfile), but returns a generator which yields the
+    patch text one line at a time (without line endings) as it is read from mercurial.
+    Raises ScmError on error.
+    '''
+    def iterPatch(self, rev1=None, rev2=None, context=5, stat=False, include=None, exclude=None, submodules=True):
+        return self._streamScmCommand(self._patchArgs(rev1, rev2, context, stat, include, exclude, submodules))
+
+    '''
+    Structured version of getPatch. Takes the same arguments (except outfile and stat), but returns a Patch which indexes
+    the file and hunk boundaries of the diff output as it is read, and hands out the diff of each file and hunk on demand.
+    Raises ScmError on error.
+    '''
+    def getStructuredPatch(self, rev1=None, rev2=None, context=5, include=None, exclude=None, submodules=True):
+        return Patch.fromChunks(self._streamScmCommand(self._patchArgs(rev1, rev2, context, False, include, exclude, submodules), separator=None))
+
+    '''
+    Get the numeric line churn of a diff: the number of added and deleted lines per changed file, without the
+    diff text (rev1/rev2/include/exclude as for getPatch). Mercurial has no --numstat, so the lines are counted from
+    the git style diff output (see scmlib.patch); a renamed file is counted under its new path.
+    Returns a Churn (see scmlib.churn) with one row per file. Raises ScmError on error.
+    '''
+    def getChurn(self, rev1=None, rev2=None, include=None, exclude=None):
+        output = self._processScmCommand(self._churnArgs(rev1, rev2, include, exclude))
+        return self._parseChurn(output)
+
+    '''
+    Private function to build the diff command arguments for getChurn
+    '''
+    def _churnArgs(self, rev1=None, rev2=None, include=None, exclude=None):
+        args = ["diff", "--git"]
+        if rev1 and not rev2:
+            args.extend(["-c", rev1])
+        elif rev1 and rev2:
+            args.extend(["-r", rev1, "-r", rev2])
+        args.extend(self._getPathspecArgs(include, exclude))
+        return args
+
+    '''
+    Get the line churn of every changeset in a revision range, with the changeset authors: the changesets that are
+    ancestors of rev2 (the working directory parent by default) but not of rev1 (all of the history if rev1 is not set),
+    optionally limited by date (startdate/enddate as for log) and paths. Merge changesets are not counted.
+    Returns a Churn (see scmlib.churn) with one row per file per changeset. Raises ScmError on error.
+    '''
+    def getChurnLog(self, rev1=None, rev2=None, startdate=None, enddate=None, include=None, exclude=None):
+        output = self._processScmCommand(self._churnLogArgs(rev1, rev2, startdate, enddate, include, exclude))
+        return self._parseChurn(output, authors=True)
+
+    '''
+    Private function to build the log command arguments for getChurnLog (see CHURN_LOG_TEMPLATE)
+    '''
+    def _churnLogArgs(self, rev1=None, rev2=None, startdate=None, enddate=None, include=None, exclude=None):
+        args = ["log", "--patch", "--git", "--no-merges", "--template", CHURN_LOG_TEMPLATE]
+        if rev1:
+            args.extend(["-r", "only({0}, {1})".format(rev2 or ".", rev1)])
+        else:
+            args.extend(["-r", "::{0}".format(rev2 or ".")])
+        if startdate and enddate:
+            args.extend(["--date", "{0} to {1}".format(startdate, enddate)])
+        elif startdate:
+            args.extend(["--date", ">{0}".format(startdate)])
+        elif enddate:
+            args.extend(["--date", "<{0}".format(enddate)])
+        args.extend(self._getPathspecArgs(include, exclude))
+        return args
+
+    '''
+    Private function to parse git style diff output into a Churn. With 'authors' set, the diff of each changeset is
+    preceded by its header from CHURN_LOG_TEMPLATE.
+    '''
+    @staticmethod
+    def _parseChurn(output, authors=False):
+        churn = Churn()
+        if authors:
+            blocks = [block.split("\0", 2)[1:] for block in output.split("\x01")[1:]]
+        else:
+            blocks = [(None, output)]
+        for author, diff in blocks:
+            for patchFile in Patch(diff):
+                if patchFile.binary:
+                    churn.add(patchFile.path, None, None, author)
+                else:
+                    added, deleted = patchFile.lineCounts()
+                    churn.add(patchFile.path, added, deleted, author)
+        return churn
+
+    '''
+    Private function to build the diff command arguments for getPatch
+    '''
+    def _patchArgs(self, rev1=None, rev2=None, context=5, stat=False, include=None, exclude=None, submodules=True):
         args = ["diff"]
         if submodules:
             args.append("-S")
@@ -262,15 +703,34 @@ class HgScm(BaseScm):
             args.extend(["-r", rev1, "-r", rev2])
             
         args.extend(self._getPathspecArgs(include, exclude))
-        
-        output = self._processScmCommand(args, outfile=outfile)
-        return output
+        return args
 
-    def log(self, revision=None, limit=None, file=None, startdate=None, enddate=None):
+    @BaseScm.cachedQuery
+    def log(self, revision=None, limit=None, file=None, startdate=None, enddate=None, author=None):
         #return a list of dictionaries (changeset/author/timestamp/message) containing log info as requested
         #if revision is none, return changesets for all revisions
         #if limit is none return all changesets
-        args = ['log', '--debug', '--template', r'changeset: {rev}:{node}\nbranch: {branch}\nuser: {author}\ndate: {localdate(date, \'UTC\')|date}\nparents: {parents}\nsummary: {splitlines(desc) % \'{line} \'}\n\n']
+        if revision is None and file is None:
+            changesets = self._queryCommitIndex(limit, startdate, enddate, author)
+            if changesets is not None:
+                return changesets
+
+        output = self._processScmCommand(self._logArgs(revision, limit, file, startdate, enddate, author))
+        return self._parseChangesets(output)
+
+    '''
+    Streaming version of log. Takes the same arguments, but returns a generator which yields each changeset
+    as soon as it has been read from mercurial, without buffering the whole log output.
+    Raises ScmError on error (after the changesets read so far have been yielded).
+    '''
+    def iterLog(self, revision=None, limit=None, file=None, startdate=None, enddate=None, author=None):
+        return self._iterChangesets(self._streamScmCommand(self._logArgs(revision, limit, file, startdate, enddate, author)))
+
+    '''
+    Private function to build the log command arguments
+    '''
+    def _logArgs(self, revision=None, limit=None, file=None, startdate=None, enddate=None, author=None):
+        args = ['log', '--debug', '--template', LOG_TEMPLATE]
         if revision is not None:
             limit = 1 #for a single revision, only show 1
             args.extend(['-r', revision])
@@ -282,33 +742,53 @@ class HgScm(BaseScm):
         elif startdate:
             #single date
             args.extend(["date", startdate])
+        if author is not None:
+            args.extend(["-u", author])
         if file is not None:
             args.append(file)
-        output = self._processScmCommand(args)
-        return self._parseChangesets(output)
+        return args
         
     '''
     Get log information for the first-parent ancestor path of a revision.
     If revision is specified, get log data for only the specified revision.
     If limit is specified, only return at most <limit> log entries.
-    Returns a list of dictionaries containing log data. Each dictionary contains the revision ('hash'),
+    Returns a list of Changeset objects (see changeset.Changeset, accessed like dictionaries). Each contains the revision ('hash'),
     commiting user id ('idsid'), date of the change ('date'), and commit message ('message')
     Raises ScmError on error
     '''
+    @BaseScm.cachedQuery
     def getAncestors(self, revision=None, limit=None):
-        args = ['log', '--debug', '--template', r'changeset: {rev}:{node}\nbranch: {branch}\nuser: {author}\ndate: {localdate(date, \'UTC\')|date}\nparents: {parents}\nsummary: {splitlines(desc) % \'{line} \'}\n\n', '-r', '"_firstancestors(.)"']
+        index = self._getCommitIndex()
+        if index is not None and revision is None:
+            try:
+                self.updateCommitIndex()
+                parent = self._workingParent()
+                rows = index.ancestors(parent, limit) if parent is not None else None
+                if rows is not None:
+                    return [self._changesetFromRow(r) for r in rows]
+            except ScmError as e:
+                self.debugPrint("commit index query failed, falling back: {0}".format(e))
+
+        output = self._processScmCommand(self._ancestorsArgs(revision, limit))
+        return self._parseChangesets(output)
+
+    '''
+    Private function to build the first-ancestors log command arguments for getAncestors
+    '''
+    def _ancestorsArgs(self, revision=None, limit=None):
+        args = ['log', '--debug', '--template', LOG_TEMPLATE, '-r', '"_firstancestors(.)"']
         if limit is not None:
             args.extend(['-n', limit])
         #need to modify the ancestors(.) to change rev...
         #if revision is None:
         #    revision = "tip"
         #args.append(revision)
-        output = self._processScmCommand(args)
-        return self._parseChangesets(output)
+        return args
         
     '''
     Create a branch with the given name at the current revision. does not switch to the new branch.
     '''
+    @BaseScm.invalidatesCache("getCurrentBranch")
     def createBranch(self, name):
         self._processScmCommand(['branch', name])
         
@@ -317,74 +797,84 @@ class HgScm(BaseScm):
     Returns a list of the changesets it parsed
     '''
     def _parseChangesets(self, output):
+        changesets = list(self._iterChangesets(output.splitlines()))
+        self.debugPrint("num changesets={0}".format(len(changesets)))
+        return changesets
+
+    '''
+    Private generator to parse mercurial log/changeset list output from an iterable of lines
+    Yields each changeset once all of its lines have been read
+    '''
+    def _iterChangesets(self, lines):
         #parse the log messages into dictionaries..
-        changesets = []
         changeset = None
-        for line in output.splitlines():
+        for line in lines:
             line = line.rstrip()
             if line.startswith("changeset:"):
+                if changeset is not None:
+                    yield changeset
                 line = line[len("changeset:"):].strip()
-                changeset = dict()
                 splitline = line.split(":")
-                changeset['id'] = splitline[0]
-                changeset['hash'] = splitline[1]
-                changeset['parents'] = []
-                changesets.append(changeset)
+                changeset = HgChangeset(splitline[1], [], None, 0, id=splitline[0])
             elif line.startswith("user:"):
                 line = line[len("user:"):].strip()
-                changeset['idsid'] = line
+                changeset.idsid = line
             elif line.startswith("parents:"):
                 line = line[len("parents:"):].strip()
                 parents = line.split()
                 for parent in parents:
                     revs = parent.split(":")
                     if revs[0] != "-1":
-                        changeset['parents'].append(revs[1])
+                        changeset.parents.append(revs[1])
             elif line.startswith("date:"):
-                #get ww/yr format from date
-                dstr = line[len("date:"):].strip()
-                #Fri Nov 09 12:44:01 2012 -0700
-                #remove the timezone because python datetime sucks at that...
-                dstr = dstr[:-5]
-                dstr = dstr.strip()
-                dobj = datetime.datetime.strptime(dstr, "%a %b %d %H:%M:%S %Y")
-                dobj_aligned = BaseScm.alignTimestamp(dobj)
-                changeset['timestamp'] = str(dobj)
-                changeset['date'] = dstr
-                changeset['iso'] = dobj.isocalendar()
-                changeset['ts_aligned'] = str(dobj_aligned)
-                changeset['iso_aligned'] = dobj_aligned.isocalendar()
+                #unix time and timezone offset (in seconds west of UTC)
+                #the timezone is not applied, all dates are reported in UTC
+                changeset.epoch = int(float(line[len("date:"):].split()[0]))
             elif line.startswith("summary:"):
                 msg = line[len("summary:"):].strip()
-                changeset['message'] = msg
+                changeset.message = msg
             elif line.startswith("branch:"):
                 brname = line[len("branch:"):].strip()
-                changeset['branch'] = brname
+                changeset.branch = brname
             else:
                 pass
 
-        self.debugPrint("num changesets={0}".format(len(changesets)))
-        return changesets
+        if changeset is not None:
+            yield changeset
 
     '''
     Returns a list of tags that have been committed, ordered from newest to oldest.
+    If filter is set, only the tags matching the glob pattern (as for 'git tag -l <pattern>') are returned.
     Raises ScmError on error.
     '''
+    @BaseScm.cachedQuery
     def getTags(self, filter=None):
-        #filter is non-functional since Hg does not support it
         output = self._processScmCommand(['tags'])
 
+        #hg tags has no pattern argument, so the filter is applied here with the same glob syntax as git tag -l
+        match = re.compile(fnmatch.translate(filter)).match if filter is not None else None
         tags = []
         for line in output.splitlines():
             m = re.match(r'^(.*?)\s*[0-9]+:[0-9a-f]+$', line)
-            if m:
+            if m and (match is None or match(m.group(1))):
                 tags.append(m.group(1))
         return tags
 
+    '''
+    Returns the list of tags (newest first) whose changeset contains the given revision, i.e. the revision is the
+    tagged changeset or one of its ancestors. Raises ScmError on error.
+    '''
+    @BaseScm.cachedQuery
+    def getTagsContaining(self, revision):
+        output = self._processScmCommand(['log', '-r', 'tag() and descendants({0})'.format(revision), '--template', r'{join(tags, "\0")}\0'])
+        tags = set(tag for tag in output.split("\0") if len(tag) > 0 and tag != "tip")
+        return [tag for tag in self.getTags() if tag in tags]
+
     '''
     Add a tag with the given name and message to the currently pointed to revision id in the repository.
     Returns nothing on success. Raises ScmError on error.
     '''
+    @BaseScm.invalidatesCache()
     def createTag(self, name, message):
         args = ['tag', name, '-f', '-m', message]
         if self.username:
@@ -395,6 +885,7 @@ class HgScm(BaseScm):
     Returns a the name of the latest tag used
     Raises ScmError on error.
     '''
+    @BaseScm.cachedQuery
     def getLatestTag(self):
         output = self._processScmCommand(['log', '-r', '.', '--template', '"{latesttag}"'])
         return output.strip()
@@ -403,9 +894,57 @@ class HgScm(BaseScm):
     Returns a list of all the tracked files in the repository.
     Raises ScmError on error.
     '''
+    @BaseScm.cachedQuery
     def getFiles(self):
         output = self._processScmCommand(['manifest'])
+        return self._parseFiles(output)
+
+    '''
+    Generator version of getFiles, yielding the tracked files of the given revision (the working copy parent by default)
+    one at a time as 'hg files' lists them, without building the whole list.
+    Raises ScmError on error.
+    '''
+    def iterFiles(self, revision=None):
+        for path in self._streamScmCommand(self._filesArgs(revision), separator="\0"):
+            if len(path) > 0:
+                yield path
+
+    '''
+    Returns a FileIndex (see fileindex.FileIndex) of the tracked files of the given revision (the working copy parent
+    by default), for prefix, glob and extension queries. The last few indexes are kept per changeset id.
+    Raises ScmError on error.
+    '''
+    def getFileIndex(self, revision=None):
+        node = self._workingParent() if revision is None else None
+        if node is None:
+            output = self._processScmCommand(['log', '-r', revision or '.', '--template', '{node}'])
+            node = output.strip()
+            if len(node) == 0:
+                raise ScmError("Revision {0} not found".format(revision))
+        with self.fileindexLock:
+            index = self.fileindexes.get(node)
+            if index is not None:
+                self.fileindexes[node] = self.fileindexes.pop(node)
+                return index
+
+        output = b"".join(self._streamScmCommand(self._filesArgs(node), separator=None))
+        index = FileIndex(output.decode('utf-8', 'replace'), node)
+        with self.fileindexLock:
+            self.fileindexes[node] = index
+            while len(self.fileindexes) > FILE_INDEX_CACHE_SIZE:
+                self.fileindexes.popitem(last=False)
+        return index
 
+    '''
+    Private function to build the NUL separated tracked file list command arguments
+    '''
+    def _filesArgs(self, revision=None):
+        return ['files', '-0', '-r', revision or '.']
+
+    '''
+    Private function to parse the manifest output into a list of tracked files
+    '''
+    def _parseFiles(self, output):
         files = []
         for line in output.splitlines():
             line = line.strip()
@@ -420,6 +959,7 @@ class HgScm(BaseScm):
     If filename is specified, only revert changes to that file. If not specified (default) revert changes to all files.
     Returns nothing on success. Raises ScmError on error.
     '''
+    @BaseScm.invalidatesCache("getSubrepos")
     def revertFile(self, filename=None):
         args = ['revert']
         if filename is not None:
@@ -431,6 +971,7 @@ class HgScm(BaseScm):
     '''
     Return a list of the subrepositories/submodules, if any. Returns an empty list if none.
     '''
+    @BaseScm.cachedQuery
     def getSubrepos(self):
         subrepos = []
         subrepoFile = self.localpath + os.sep + ".hgsub"
@@ -0,0 +1,178 @@
+import os
+import struct
+import subprocess
+import threading
+
+from .errors import ScmError
+
+#channel header of every server message: one channel byte followed by a big-endian 32-bit length
+_HEADER = struct.Struct(">cI")
+_LENGTH = struct.Struct(">I")
+_RESULT = struct.Struct(">i")
+
+class HgCommandServer(object):
+    '''
+    A long-lived 'hg serve --cmdserver pipe' process used to run mercurial commands without paying the
+    python startup cost of a new hg process for every call.
+    Commands are sent with the 'runcommand' request of the command server protocol and the output, error and
+    result channels are collected until the command finishes, so commands are serialized with a lock.
+    The server is started on the first command and started again if it has died.
+    '''
+    def __init__(self, toolpath, cwd):
+        self.toolpath = toolpath
+        self.cwd = cwd
+        self.lock = threading.Lock()
+        self.server = None
+        self.capabilities = []
+        self.encoding = None
+
+    '''
+    Private function to start the server process and read its hello message. Caller must handle locking.
+    Raises ScmError if the server cannot be started or does not support the 'runcommand' request.
+    '''
+    def _start(self):
+        cmd = [self.toolpath, 'serve', '--cmdserver', 'pipe']
+        #command errors arrive on the 'e' channel; anything the server prints outside the channels is dropped
+        devnull = open(os.devnull, 'wb')
+        try:
+            self.server = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull, cwd=self.cwd)
+        except OSError as e:
+            self.server = None
+            raise ScmError("Unable to start {0}: {1}".format(" ".join(cmd), e))
+        finally:
+            devnull.close()
+
+        channel, data = self._readMessage()
+        if channel != b'o':
+            self._close()
+            raise ScmError("Unexpected hello message from the hg command server")
+        self.capabilities = []
+        self.encoding = None
+        for line in data.decode('utf-8', 'replace').splitlines():
+            key, sep, value = line.partition(":")
+            if key == "capabilities":
+                self.capabilities = value.split()
+            elif key == "encoding":
+                self.encoding = value.strip()
+        if "runcommand" not in self.capabilities:
+            self._close()
+            raise ScmError("hg command server does not support runcommand")
+
+    '''
+    Start the server if it is not running. Raises ScmError if it cannot be started.
+    '''
+    def start(self):
+        with self.lock:
+            if self.server is None or self.server.poll() is not None:
+                self._close()
+                self._start()
+
+    '''
+    Private function to read a single channel message from the server.
+    Returns the channel byte and the message data. For the input channels ('I', 'L') the data is empty and
+    the length is the number of bytes the server asks for.
+    Raises ScmError if the server has died, after which the server is closed.
+    '''
+    def _readMessage(self):
+        try:
+            header = self.server.stdout.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                raise EOFError("server exited")
+            channel, length = _HEADER.unpack(header)
+            if channel in (b'I', b'L'):
+                return channel, length
+            data = self.server.stdout.read(length)
+            if len(data) < length:
+                raise EOFError("truncated message")
+        except (IOError, OSError, ValueError, EOFError) as e:
+            self._close()
+            raise ScmError("hg command server failed: {0}".format(e))
+        return channel, data
+
+    '''
+    Private function to write a raw request to the server. Returns False if the server pipe is broken.
+    '''
+    def _send(self, data):
+        try:
+            self.server.stdin.write(data)
+            self.server.stdin.flush()
+        except (IOError, OSError, ValueError):
+            return False
+        return True
+
+    '''
+    Run an hg command (argument list without the tool name) in the server.
+    Returns a (returncode, stdout, stderr) tuple, with the output in bytes.
+    If the server has died since the last command, it is restarted before the command is sent.
+    Raises ScmError if the server cannot be used; the command may or may not have run in that case.
+    '''
+    def runCommand(self, args):
+        #Python 2 arguments may already be byte strings
+        payload = b"\0".join(a if isinstance(a, bytes) else a.encode('utf-8') for a in args)
+        request = b"runcommand\n" + _LENGTH.pack(len(payload)) + payload
+
+        with self.lock:
+            if self.server is None or self.server.poll() is not None:
+                self._close()
+                self._start()
+            if not self._send(request):
+                #the server died between commands, so the request never reached it and it is safe to resend
+                self._close()
+                self._start()
+                if not self._send(request):
+                    self._close()
+                    raise ScmError("hg command server is not accepting commands")
+
+            out = []
+            err = []
+            while True:
+                channel, data = self._readMessage()
+                if channel == b'o':
+                    out.append(data)
+                elif channel == b'e':
+                    err.append(data)
+                elif channel == b'r':
+                    return (_RESULT.unpack(data)[0], b"".join(out), b"".join(err))
+                elif channel in (b'I', b'L'):
+                    #no input is available; an empty reply is end of file and hg uses the default answer
+                    if not self._send(_LENGTH.pack(0)):
+                        self._close()
+                        raise ScmError("hg command server failed while requesting input")
+                elif channel.isupper():
+                    #unknown required channel; the protocol says the client must stop
+                    self._close()
+                    raise ScmError("hg command server requested unsupported channel {0!r}".format(channel))
+
+    '''
+    Private function to stop the server. Caller must handle locking.
+    '''
+    def _close(self):
+        server = self.server
+        self.server = None
+        if server is None:
+            return
+        try:
+            server.stdin.close()
+        except (IOError, OSError):
+            pass
+        try:
+            server.wait()
+        except OSError:
+            pass
+        try:
+            server.stdout.close()
+        except (IOError, OSError):
+            pass
+
+    '''
+    Stop the server. It will be restarted on the next command.
+    '''
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def __del__(self):
+        try:
+            self._close()
+        except Exception:
+            pass
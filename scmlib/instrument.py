@@ -0,0 +1,177 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+'''
+Returns the tool subcommand of a command line (e.g. "log" for ["git", "-c", "x=y", "log", "-n", "1"]).
+Global options before the subcommand are skipped. Returns an empty string if there is none.
+'''
+def subcommandOf(argv):
+    skip = False
+    for arg in argv[1:]:
+        if skip:
+            skip = False
+            continue
+        if arg in ("-c", "-C", "-R", "--cwd", "--config", "--repository"):
+            #global option followed by its value
+            skip = True
+            continue
+        if arg.startswith("-"):
+            continue
+        return arg
+    return ""
+
+class CommandRecord(object):
+    '''
+    Timing and size information for a single scm tool invocation, passed to each command hook.
+    '''
+    __slots__ = ('argv', 'cwd', 'start', 'elapsed', 'returncode', 'stdoutBytes', 'stderrBytes', 'method')
+
+    def __init__(self, argv, cwd, start, elapsed, returncode, stdoutBytes, stderrBytes, method):
+        self.argv = argv
+        self.cwd = cwd
+        self.start = start
+        self.elapsed = elapsed
+        self.returncode = returncode
+        self.stdoutBytes = stdoutBytes
+        self.stderrBytes = stderrBytes
+        self.method = method
+
+    @property
+    def subcommand(self):
+        return subcommandOf(self.argv)
+
+    def asDict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+'''
+Return the value at the given percentile (0-100) of a sorted list using the nearest-rank method
+'''
+def percentile(values, pct):
+    if len(values) == 0:
+        return 0.0
+    rank = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    rank = max(0, min(len(values) - 1, rank))
+    return values[rank]
+
+class CommandStats(object):
+    '''
+    In-memory aggregator of command records, grouped by tool subcommand.
+    An instance is callable, so it can be registered directly with BaseScm.addCommandHook.
+    '''
+    def __init__(self, keepRecords=False):
+        self.lock = threading.Lock()
+        self.keepRecords = keepRecords
+        self.records = []
+        self.groups = {}
+
+    def __call__(self, record):
+        self.add(record)
+
+    '''
+    Add a command record to the statistics
+    '''
+    def add(self, record):
+        key = record.subcommand
+        with self.lock:
+            group = self.groups.get(key)
+            if group is None:
+                group = {'times': [], 'stdoutBytes': 0, 'stderrBytes': 0, 'failures': 0, 'methods': {}}
+                self.groups[key] = group
+            group['times'].append(record.elapsed)
+            group['stdoutBytes'] += record.stdoutBytes
+            group['stderrBytes'] += record.stderrBytes
+            if record.returncode != 0:
+                group['failures'] += 1
+            method = record.method or ""
+            group['methods'][method] = group['methods'].get(method, 0) + 1
+            if self.keepRecords:
+                self.records.append(record)
+
+    '''
+    Drop all collected statistics
+    '''
+    def reset(self):
+        with self.lock:
+            self.records = []
+            self.groups = {}
+
+    '''
+    Returns a dictionary keyed by subcommand. Each value holds the command count, total/p50/p95/max wall time
+    in seconds, stdout/stderr byte totals, the number of failed commands and the count per calling scmlib method.
+    '''
+    def summary(self):
+        result = {}
+        with self.lock:
+            for key, group in self.groups.items():
+                times = sorted(group['times'])
+                result[key] = {
+                    'count': len(times),
+                    'total': sum(times),
+                    'p50': percentile(times, 50),
+                    'p95': percentile(times, 95),
+                    'max': times[-1] if len(times) > 0 else 0.0,
+                    'stdoutBytes': group['stdoutBytes'],
+                    'stderrBytes': group['stderrBytes'],
+                    'failures': group['failures'],
+                    'methods': dict(group['methods']),
+                }
+        return result
+
+    '''
+    Returns the statistics as a JSON-serializable report (see summary), along with the individual
+    command records if they are kept.
+    '''
+    def report(self):
+        report = {
+            'generated': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'pid': os.getpid(),
+            'commands': self.summary(),
+        }
+        if self.keepRecords:
+            with self.lock:
+                report['records'] = [r.asDict() for r in self.records]
+        return report
+
+    '''
+    Write the JSON report to the given path
+    '''
+    def writeReport(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+class JsonReportExporter(object):
+    '''
+    Writes the JSON report of a CommandStats object to a file when the process exits.
+    '''
+    def __init__(self, stats, path):
+        self.stats = stats
+        self.path = path
+        self.registered = False
+
+    def register(self):
+        if not self.registered:
+            atexit.register(self.export)
+            self.registered = True
+        return self
+
+    def export(self):
+        try:
+            self.stats.writeReport(self.path)
+        except (IOError, OSError) as e:
+            print("Unable to write scm command report to {0}: {1}".format(self.path, e))
+
+'''
+Start collecting statistics for every scm command run in this process.
+If reportPath is specified, a JSON report is written there at process exit.
+Returns the CommandStats object collecting the data.
+'''
+def enableInstrumentation(reportPath=None, keepRecords=False):
+    from .basescm import BaseScm
+    stats = CommandStats(keepRecords)
+    BaseScm.addCommandHook(stats)
+    if reportPath is not None:
+        JsonReportExporter(stats, reportPath).register()
+    return stats
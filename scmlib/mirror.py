@@ -0,0 +1,99 @@
+import hashlib
+import os
+import re
+import time
+
+from .filelock import FileLock
+
+#refs fetched into a mirror: every branch and tag of the remote, replacing the previous values
+MIRROR_REFSPECS = ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+
+#file in a mirror holding the time the last successful fetch finished
+FETCH_STAMP_FILE = "scmlib-fetch-stamp"
+
+'''
+Returns the remote URL without the user name and password (e.g. as added by GitScm from its username and password),
+so every job cloning a repository shares one mirror and no credentials end up in the cache paths.
+'''
+def stripCredentials(url):
+    return re.sub(r"^([a-zA-Z][a-zA-Z0-9+.-]*://)[^/@]*@", r"\1", url)
+
+'''
+Returns the name used for a remote URL in a shared cache directory: a readable name from the URL followed by a hash of
+the URL (without credentials), so different remotes with the same repository name do not collide.
+'''
+def cacheName(url):
+    url = stripCredentials(url).rstrip("/")
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", url.rpartition("/")[2] or url)
+    if name.endswith(".git"):
+        name = name[:-len(".git")]
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+    return "{0}-{1}".format(name, digest)
+
+class MirrorCache(object):
+    '''
+    Bare mirrors of remote repositories, one per remote URL, kept under a shared directory ('root') so every clone on
+    the machine copies objects from a local mirror and only the mirror fetches from the network (see GitScm.clone).
+    The git commands run through 'scm' (a GitScm), so they are recorded like its own commands.
+    Mirrors are updated under a file lock per mirror. A job waiting for the lock while another job fetches does not
+    fetch again once it gets the lock, since that fetch finished after it asked. The mirror may then miss commits
+    pushed just before the request, but a clone with --reference fetches whatever the mirror lacks from the remote,
+    so this only costs a slightly larger clone fetch, never a wrong clone. Credentials are passed on the fetch command
+    line, never stored in the mirror, and automatic gc is turned off in the mirrors so clones borrowing their objects never lose them.
+    '''
+    def __init__(self, root, scm, lockTimeout=None):
+        self.root = root
+        self.scm = scm
+        self.lockTimeout = lockTimeout
+
+    '''
+    Returns the path of the mirror for a remote URL (which may not exist yet, see cacheName)
+    '''
+    def mirrorPath(self, url):
+        return os.path.join(self.root, cacheName(url) + ".git")
+
+    '''
+    Returns a FileLock (not acquired) serializing the updates of the mirror for a remote URL
+    '''
+    def lock(self, url):
+        return FileLock(self.mirrorPath(url) + ".lock", self.lockTimeout)
+
+    '''
+    Create the mirror for a remote URL if needed and fetch the remote's branches and tags into it, unless a fetch
+    by another job finished while this call was waiting for the mirror lock.
+    Returns the mirror path. Raises ScmError on error.
+    '''
+    def update(self, url):
+        requested = time.time()
+        path = self.mirrorPath(url)
+        with self.lock(url):
+            if os.path.isdir(path) and self._lastFetch(path) >= requested:
+                self.scm.debugPrint("mirror {0} was fetched while waiting, not fetching again".format(path))
+                return path
+            if not os.path.isdir(os.path.join(path, "objects")):
+                self.scm._processScmCommand(['init', '--bare', '--quiet', path], cwd=self.root)
+                self.scm._processScmCommand(['config', 'gc.auto', '0'], cwd=path)
+            self.scm._processScmCommand(['fetch', '--quiet', '--prune', '--no-tags', url] + MIRROR_REFSPECS, cwd=path)
+            with open(os.path.join(path, FETCH_STAMP_FILE), "w") as f:
+                f.write(repr(time.time()))
+        return path
+
+    '''
+    Private function returning the end time of the last successful fetch into a mirror (0 if never)
+    '''
+    @staticmethod
+    def _lastFetch(path):
+        try:
+            with open(os.path.join(path, FETCH_STAMP_FILE), "r") as f:
+                return float(f.read().strip())
+        except (IOError, ValueError):
+            return 0
+
+    '''
+    Returns the list of mirror paths in the cache
+    '''
+    def mirrors(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(os.path.join(self.root, name) for name in os.listdir(self.root)
+                      if name.endswith(".git") and os.path.isdir(os.path.join(self.root, name)))
@@ -0,0 +1,329 @@
+import array
+import codecs
+import re
+
+#start of the lines the patch is indexed on: file headers (git "diff --git"/"diff --cc", mercurial "diff -r"), git
+#submodule headers ("Submodule <path> <old>..<new>:", from --submodule=diff) and hunk headers ("@@@" in a combined diff)
+_BOUNDARY = re.compile(br"^(?:diff |Submodule |@@)", re.MULTILINE)
+
+#git submodule header: Submodule <path> <old>..<new>[:| (new submodule)| (submodule deleted)]
+_SUBMODULE_HEADER = re.compile(br"^Submodule (.*) ([0-9a-f]+)\.\.\.?([0-9a-f]+)")
+
+#hunk header: @@ -start[,count] +start[,count] @@ [section]; a combined diff has one more '@' and -start per parent
+_HUNK_HEADER = re.compile(br"^(@@+) -(\d+)(?:,(\d+))? (?:-\d+(?:,\d+)? )*\+(\d+)(?:,(\d+))? \1 ?([^\n]*)")
+
+'''
+Private function to decode a path from a git diff header, which may be C-quoted (non-ASCII or special characters)
+'''
+def _decodePath(path):
+    if path.startswith(b'"') and path.endswith(b'"'):
+        path = codecs.escape_decode(path[1:-1])[0]
+    return path.decode('utf-8', 'replace')
+
+'''
+Private function to strip the a/ or b/ prefix of a diff path ("/dev/null" is returned as None)
+'''
+def _stripPrefix(path):
+    if path == "/dev/null":
+        return None
+    if path.startswith("a/") or path.startswith("b/"):
+        return path[2:]
+    return path
+
+class PatchHunk(object):
+    '''
+    One hunk of a file in a Patch. 'data' is a memoryview of the hunk text in the patch (header line included),
+    so no copy is made until bytes/text are requested. The line numbers are parsed from the header on creation.
+    '''
+    __slots__ = ('data', 'oldStart', 'oldLines', 'newStart', 'newLines', 'section')
+
+    def __init__(self, data):
+        self.data = data
+        match = _HUNK_HEADER.match(data[:4096].tobytes())
+        if match is None:
+            self.oldStart = self.oldLines = self.newStart = self.newLines = 0
+            self.section = ""
+        else:
+            #for a combined diff, the old lines are those of the first parent
+            self.oldStart = int(match.group(2))
+            self.oldLines = int(match.group(3)) if match.group(3) is not None else 1
+            self.newStart = int(match.group(4))
+            self.newLines = int(match.group(5)) if match.group(5) is not None else 1
+            self.section = match.group(6).decode('utf-8', 'replace')
+
+    @property
+    def text(self):
+        return self.data.tobytes().decode('utf-8', 'replace')
+
+    def __bytes__(self):
+        return self.data.tobytes()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return "PatchHunk(-{0},{1} +{2},{3})".format(self.oldStart, self.oldLines, self.newStart, self.newLines)
+
+class PatchFile(object):
+    '''
+    The diff of one file in a Patch. 'data' is a memoryview of the file's text in the patch (headers and hunks),
+    'header' the part before the first hunk. 'oldPath' and 'newPath' are None for an added or deleted file; 'path' is
+    the new path, or the old one for a deleted file. A git submodule header ('submodule' set) has no hunks; the diff
+    of the files inside the submodule follows as separate entries. Hunks are created when accessed (see hunks/hunk()).
+    '''
+    def __init__(self, patch, index):
+        self.patch = patch
+        self.index = index
+        start, end = patch._fileRange(index)
+        self.data = patch.view[start:end]
+        self.hunkStart, self.hunkEnd = patch.fileHunks[index], patch.fileHunks[index + 1]
+        headerEnd = patch.hunkOffsets[self.hunkStart] if self.hunkStart < self.hunkEnd else end
+        self.header = patch.view[start:headerEnd]
+        self.oldPath, self.newPath = patch._parsePaths(self.header.tobytes())
+
+    @property
+    def path(self):
+        return self.newPath if self.newPath is not None else self.oldPath
+
+    @property
+    def submodule(self):
+        return self.header[:10].tobytes() == b"Submodule "
+
+    '''
+    True if the file is binary (the patch holds no text hunks for it)
+    '''
+    @property
+    def binary(self):
+        header = self.header.tobytes()
+        return b"\nBinary file" in header or b"\nGIT binary patch" in header
+
+    @property
+    def text(self):
+        return self.data.tobytes().decode('utf-8', 'replace')
+
+    def __bytes__(self):
+        return self.data.tobytes()
+
+    '''
+    Returns the number of hunks, without creating them
+    '''
+    @property
+    def hunkCount(self):
+        return self.hunkEnd - self.hunkStart
+
+    '''
+    Returns hunk 'index' of this file as a PatchHunk
+    '''
+    def hunk(self, index):
+        if index < 0:
+            index += self.hunkCount
+        if index < 0 or index >= self.hunkCount:
+            raise IndexError("hunk index out of range")
+        return self.patch._hunk(self.hunkStart + index, self.index)
+
+    @property
+    def hunks(self):
+        return [self.patch._hunk(i, self.index) for i in range(self.hunkStart, self.hunkEnd)]
+
+    '''
+    Returns the number of (added, deleted) lines of the file
+    '''
+    def lineCounts(self):
+        if self.hunkCount == 0:
+            return 0, 0
+        body = self.data[len(self.header):].tobytes()
+        return body.count(b"\n+"), body.count(b"\n-")
+
+    def __repr__(self):
+        return "PatchFile({0!r}, {1} hunks)".format(self.path, self.hunkCount)
+
+class Patch(object):
+    '''
+    Structured view of diff output, returned by getStructuredPatch.
+    The output is kept as one bytes object and indexed in a single pass: the offset of every file header and hunk
+    header goes in an array, along with the first hunk of each file. The per-file (PatchFile) and per-hunk (PatchHunk)
+    views are memoryview slices of the output, created on demand, so counting the files or getting the diff of one
+    file does not parse the rest of the patch. Lookups by path parse the file headers only, on first use.
+    Supports len() (number of files), iteration and indexing over the files; str() is the full patch text.
+    '''
+    def __init__(self, data=b""):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self.data = bytes(data)
+        self.view = memoryview(self.data)
+        self.fileOffsets = array.array('L')
+        self.hunkOffsets = array.array('L')
+        #fileHunks[i] is the position in hunkOffsets of the first hunk of file i (one extra entry closes the last file)
+        self.fileHunks = array.array('L')
+        self.paths = None
+        for match in _BOUNDARY.finditer(self.data):
+            if self.data[match.start():match.start() + 1] != b"@":
+                self.fileOffsets.append(match.start())
+                self.fileHunks.append(len(self.hunkOffsets))
+            elif len(self.fileOffsets) > 0:
+                self.hunkOffsets.append(match.start())
+        self.fileHunks.append(len(self.hunkOffsets))
+
+    '''
+    Build a patch from an iterable of output chunks (bytes), e.g. the raw output stream of the diff command
+    '''
+    @classmethod
+    def fromChunks(cls, chunks):
+        return cls(b"".join(chunks))
+
+    '''
+    Private function returning the (start, end) byte offsets of file 'index'
+    '''
+    def _fileRange(self, index):
+        start = self.fileOffsets[index]
+        end = self.fileOffsets[index + 1] if index + 1 < len(self.fileOffsets) else len(self.data)
+        return start, end
+
+    '''
+    Private function returning the (old, new) paths of a file from its header (see PatchFile)
+    '''
+    @staticmethod
+    def _parsePaths(header):
+        match = _SUBMODULE_HEADER.match(header)
+        if match is not None:
+            path = match.group(1).decode('utf-8', 'replace')
+            return path, path
+        lines = header.split(b"\n")
+        oldPath = newPath = None
+        found = False
+        for line in lines[1:]:
+            if line.startswith(b"--- ") or line.startswith(b"+++ "):
+                #mercurial appends the date after a tab
+                path = _stripPrefix(_decodePath(line[4:].split(b"\t")[0]))
+                if line.startswith(b"-"):
+                    oldPath = path
+                else:
+                    newPath = path
+                found = True
+            elif line.startswith(b"rename from ") or line.startswith(b"copy from "):
+                oldPath = _decodePath(line.split(b" ", 2)[2])
+            elif line.startswith(b"rename to ") or line.startswith(b"copy to "):
+                newPath = _decodePath(line.split(b" ", 2)[2])
+                found = True
+        first = lines[0]
+        if first.startswith(b"diff --cc ") or first.startswith(b"diff --combined "):
+            if not found:
+                oldPath = newPath = _decodePath(first.split(b" ", 2)[2])
+        elif first.startswith(b"diff --git "):
+            if oldPath is None and newPath is None:
+                #mode, binary or empty file change: "diff --git a/<path> b/<path>", with the same path twice
+                rest = first[len(b"diff --git "):]
+                if rest.startswith(b'"'):
+                    end = rest.index(b'" ', 1) + 1
+                    path = _stripPrefix(_decodePath(rest[:end]))
+                else:
+                    path = _stripPrefix(_decodePath(rest[:(len(rest) - 1) // 2]))
+                new = any(line.startswith(b"new file mode") for line in lines)
+                deleted = any(line.startswith(b"deleted file mode") for line in lines)
+                oldPath = None if new else oldPath or path
+                newPath = None if deleted else newPath or path
+        elif not found:
+            #mercurial header without ---/+++ lines (e.g. binary): "diff -r <node> [-r <node>] <path>"
+            tokens = first.split(b" ")
+            i = 1
+            while i + 1 < len(tokens) and tokens[i] == b"-r":
+                i += 2
+            oldPath = newPath = b" ".join(tokens[i:]).decode('utf-8', 'replace')
+        return oldPath, newPath
+
+    def __len__(self):
+        return len(self.fileOffsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("patch file index out of range")
+        return PatchFile(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield PatchFile(self, i)
+
+    def __contains__(self, path):
+        return self.file(path) is not None
+
+    def __str__(self):
+        return self.text
+
+    def __bytes__(self):
+        return self.data
+
+    @property
+    def text(self):
+        return self.data.decode('utf-8', 'replace')
+
+    '''
+    Returns the number of hunks in the patch
+    '''
+    @property
+    def hunkCount(self):
+        return len(self.hunkOffsets)
+
+    '''
+    Returns hunk 'index' of the patch (counting across all files) as a PatchHunk
+    '''
+    def hunk(self, index):
+        if index < 0:
+            index += len(self.hunkOffsets)
+        if index < 0 or index >= len(self.hunkOffsets):
+            raise IndexError("hunk index out of range")
+        return self._hunk(index, self._fileOfHunk(index))
+
+    '''
+    Private function returning hunk 'index' of the patch, which belongs to file 'fileIndex'
+    '''
+    def _hunk(self, index, fileIndex):
+        start = self.hunkOffsets[index]
+        if index + 1 < self.fileHunks[fileIndex + 1]:
+            end = self.hunkOffsets[index + 1]
+        else:
+            #the last hunk of a file ends at the next file header
+            end = self._fileRange(fileIndex)[1]
+        return PatchHunk(self.view[start:end])
+
+    '''
+    Private function returning the file a hunk belongs to
+    '''
+    def _fileOfHunk(self, index):
+        lo, hi = 0, len(self.fileOffsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.fileHunks[mid + 1] <= index:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    '''
+    Returns the PatchFile for a path (new or old path of the file), or None if the file is not in the patch
+    '''
+    def file(self, path):
+        if self.paths is None:
+            paths = {}
+            for i in range(len(self)):
+                start, end = self._fileRange(i)
+                headerEnd = self.hunkOffsets[self.fileHunks[i]] if self.fileHunks[i] < self.fileHunks[i + 1] else end
+                oldPath, newPath = Patch._parsePaths(self.data[start:headerEnd])
+                for name in (newPath, oldPath):
+                    if name is not None and name not in paths:
+                        paths[name] = i
+            self.paths = paths
+        index = self.paths.get(path)
+        return PatchFile(self, index) if index is not None else None
+
+    '''
+    Returns the list of changed paths, in patch order (see PatchFile.path)
+    '''
+    def files(self):
+        return [patchFile.path for patchFile in self]
+
+    def __repr__(self):
+        return "Patch({0} files, {1} hunks)".format(len(self), self.hunkCount)
@@ -0,0 +1,230 @@
+import subprocess
+import time
+import timeit
+
+from .errors import ScmError
+from .errors import ScmCommandError
+
+#object id standing for a ref that does not exist (update-ref old values)
+ZERO_OID = "0" * 40
+
+class RefUpdate(object):
+    '''
+    One ref change queued in a RefTransaction: 'new' is the object id the ref is set to (None to delete it) and 'old'
+    the object id it is expected to have (ZERO_OID if it must not exist, None if it is not checked).
+    '''
+    __slots__ = ('ref', 'new', 'old')
+
+    def __init__(self, ref, new, old):
+        self.ref = ref
+        self.new = new
+        self.old = old
+
+    '''
+    Returns the line for this change in the 'git update-ref --stdin' format
+    '''
+    def stdinCommand(self):
+        if self.new is None:
+            words = ["delete", self.ref]
+        elif self.old == ZERO_OID:
+            return "create {0} {1}\n".format(self.ref, self.new)
+        else:
+            words = ["update", self.ref, self.new]
+        if self.old is not None:
+            words.append(self.old)
+        return " ".join(words) + "\n"
+
+    '''
+    Returns the 'git push' arguments for this change: the --force-with-lease option checking the old value on the
+    remote (if it is checked) and the refspec
+    '''
+    def pushArgs(self):
+        source = "" if self.new is None else self.new
+        if self.old is None:
+            return ["+{0}:{1}".format(source, self.ref)]
+        expected = "" if self.old == ZERO_OID else self.old
+        return ["--force-with-lease={0}:{1}".format(self.ref, expected), "{0}:{1}".format(source, self.ref)]
+
+    def __repr__(self):
+        return "RefUpdate({0!r}, {1!r}, {2!r})".format(self.ref, self.new, self.old)
+
+class RefTransaction(object):
+    '''
+    A batch of ref creations, updates and deletions applied all at once or not at all, each optionally checked
+    against the value the ref is expected to have. Nothing changes until commit: the local refs are then updated by a
+    single 'git update-ref --stdin' process and, with a 'remote', the refs are pushed by a single 'git push --atomic'
+    with a --force-with-lease check per ref. Only the local refs are updated if 'remote' is None, only the remote ones
+    if 'local' is False.
+    When both are updated, the local refs are locked and checked first (update-ref 'prepare'), then pushed, then
+    committed locally, so a failing check or push changes nothing on either side. The expected values are checked
+    against the local and the remote refs alike.
+    Revisions are resolved to object ids when the change is queued. The git commands run through 'scm' (a GitScm), so
+    they are recorded like its own commands. Can be used as a context manager: the transaction is committed when the
+    block ends and discarded if it raises.
+    '''
+    def __init__(self, scm, message=None, remote=None, local=True):
+        if remote is None and not local:
+            raise ScmError("Ref transaction updates neither the local nor the remote refs")
+        self.scm = scm
+        self.message = message
+        self.remote = remote
+        self.local = local
+        self.updates = []
+        self.done = False
+        self.process = None
+
+    '''
+    Queue the creation of a ref (full name, e.g. "refs/tags/v1.0") at a revision. The ref must not exist yet.
+    Raises ScmError if the revision does not exist.
+    '''
+    def create(self, ref, revision):
+        self._queue(ref, self.scm._resolveRevision(revision), ZERO_OID)
+
+    '''
+    Queue moving a ref (full name, e.g. "refs/heads/master") to a revision, creating it if needed. With 'old' (a
+    revision, or ZERO_OID if the ref must not exist), the transaction fails unless the ref is at that commit when it
+    is committed; by default the ref is moved whatever its value.
+    Raises ScmError if a revision does not exist.
+    '''
+    def update(self, ref, revision, old=None):
+        self._queue(ref, self.scm._resolveRevision(revision), self._expected(old))
+
+    '''
+    Queue the deletion of a ref (full name). With 'old' (a revision), the transaction fails unless the ref is at that
+    commit when it is committed.
+    Raises ScmError if the revision does not exist.
+    '''
+    def delete(self, ref, old=None):
+        self._queue(ref, None, self._expected(old))
+
+    '''
+    Private function to resolve an expected old value to an object id (None stays unchecked)
+    '''
+    def _expected(self, old):
+        if old is None or old == ZERO_OID:
+            return old
+        return self.scm._resolveRevision(old)
+
+    '''
+    Private function to add a change to the transaction
+    '''
+    def _queue(self, ref, new, old):
+        if self.done:
+            raise ScmError("Ref transaction is already finished")
+        if not ref.startswith("refs/"):
+            raise ScmError("Ref transactions take full ref names: {0}".format(ref))
+        if any(update.ref == ref for update in self.updates):
+            raise ScmError("Ref {0} is changed twice in the same transaction".format(ref))
+        self.updates.append(RefUpdate(ref, new, old))
+
+    '''
+    Apply the queued changes: all of them or, if a check or the push fails, none of them.
+    Raises ScmError on error (then nothing was changed, unless the local update failed after the push succeeded).
+    '''
+    def commit(self):
+        if self.done:
+            raise ScmError("Ref transaction is already finished")
+        self.done = True
+        if len(self.updates) == 0:
+            return
+        try:
+            if self.remote is None:
+                self.scm._processScmCommand(self._updateRefArgs(),
+                                            input="".join(update.stdinCommand() for update in self.updates).encode('utf-8'))
+            elif not self.local:
+                self._push()
+            else:
+                self._prepareLocal()
+                try:
+                    self._push()
+                except:
+                    try:
+                        self._finishLocal("abort")
+                    except ScmError as e:
+                        self.scm.debugPrint("update-ref abort failed: {0}".format(e))
+                    raise
+                self._finishLocal("commit")
+        finally:
+            if self.scm.cache is not None:
+                self.scm.cache.invalidate()
+
+    '''
+    Drop the queued changes without applying them
+    '''
+    def discard(self):
+        self.done = True
+        self.updates = []
+
+    '''
+    Private function to push the changes to the remote in one atomic push
+    '''
+    def _push(self):
+        args = ['push', '--quiet', '--atomic']
+        refspecs = []
+        for update in self.updates:
+            pushArgs = update.pushArgs()
+            args.extend(pushArgs[:-1])
+            refspecs.append(pushArgs[-1])
+        self.scm._processScmCommand(args + [self.remote] + refspecs)
+
+    '''
+    Private function returning the 'git update-ref --stdin' command
+    '''
+    def _updateRefArgs(self):
+        args = ['update-ref', '--stdin']
+        if self.message is not None:
+            args.extend(['-m', self.message])
+        return args
+
+    '''
+    Private function to start 'git update-ref --stdin', queue the changes and lock and check the local refs ('prepare')
+    without applying them. The running process is then ended with _finishLocal.
+    Raises ScmCommandError if a ref cannot be locked or does not have its expected value.
+    '''
+    def _prepareLocal(self):
+        cmd, cwd = self.scm._buildScmCommand(self._updateRefArgs())
+        self.scm.debugPrint("running command {0}".format(" ".join(cmd)))
+        start = time.time()
+        timer = timeit.default_timer()
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
+        self.process = (process, cmd, cwd, start, timer)
+        commands = ["start\n"] + [update.stdinCommand() for update in self.updates] + ["prepare\n"]
+        try:
+            process.stdin.write("".join(commands).encode('utf-8'))
+            process.stdin.flush()
+            if (process.stdout.readline().strip() == b"start: ok" and
+                    process.stdout.readline().strip() == b"prepare: ok"):
+                return
+        except (IOError, OSError):
+            pass
+        #update-ref exits on the first error, which it reports on stderr
+        self._finishLocal(None)
+        raise ScmCommandError("update-ref could not prepare the transaction", " ".join(cmd), process.returncode)
+
+    '''
+    Private function to end the 'git update-ref --stdin' process started by _prepareLocal with 'commit' or 'abort'
+    (None if it already failed). Raises ScmCommandError if the process fails.
+    '''
+    def _finishLocal(self, command):
+        process, cmd, cwd, start, timer = self.process
+        self.process = None
+        data = None if command is None else (command + "\n").encode('utf-8')
+        try:
+            cout, cerr = process.communicate(data)
+        except (IOError, OSError):
+            cout, cerr = process.communicate()
+        self.scm._recordCommand(cmd, cwd, start, timeit.default_timer() - timer, process.returncode, len(cout), len(cerr))
+        if process.returncode != 0:
+            raise ScmCommandError(cerr.decode('utf-8', 'replace'), " ".join(cmd), process.returncode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.commit()
+        else:
+            self.discard()
+
+    def __repr__(self):
+        return "RefTransaction({0!r}, remote={1!r}, local={2})".format(self.updates, self.remote, self.local)
@@ -0,0 +1,75 @@
+#state code returned by status for each file type that can be requested
+TYPE_STATES = {
+    "modified": "mod",
+    "added": "add",
+    "removed": "del",
+    "deleted": "del",
+    "renamed": "ren",
+    "unmerged": "unm",
+    "unknown": "unk",
+    "clean": "cln",
+    "ignored": "ign",
+}
+
+class StatusEntry(object):
+    '''
+    The state of one file in the working copy, yielded by iterStatus.
+    'kind' is "tracked", "unmerged", "untracked", "ignored" or "clean". For tracked and unmerged files, 'index' and
+    'worktree' hold the git style status letters ('M', 'T', 'A', 'D', 'R', 'C', 'U' or '.' for unchanged) of the index
+    against HEAD and of the working tree against the index. Mercurial has no index, so its states are in 'worktree' only.
+    Renamed and copied files have the source path in 'origPath' and the similarity score in 'score'.
+    'submodule' is None for regular files and the git submodule state ("S<c><m><u>": commit changed, tracked changes,
+    untracked changes, each a letter or '.') for submodules.
+    '''
+    __slots__ = ('path', 'kind', 'index', 'worktree', 'origPath', 'score', 'submodule')
+
+    def __init__(self, path, kind="tracked", index='.', worktree='.', origPath=None, score=None, submodule=None):
+        self.path = path
+        self.kind = kind
+        self.index = index
+        self.worktree = worktree
+        self.origPath = origPath
+        self.score = score
+        self.submodule = submodule
+
+    '''
+    The single state code used by status ("mod", "add", "del", "ren", "unm", "unk", "ign" or "cln")
+    '''
+    @property
+    def state(self):
+        if self.kind == "unmerged":
+            return "unm"
+        if self.kind == "untracked":
+            return "unk"
+        if self.kind == "ignored":
+            return "ign"
+        if self.kind == "clean":
+            return "cln"
+        codes = (self.index, self.worktree)
+        if 'R' in codes:
+            return "ren"
+        if 'A' in codes or 'C' in codes:
+            return "add"
+        if 'D' in codes:
+            return "del"
+        return "mod"
+
+    '''
+    Returns True if the entry is of the given file type (see TYPE_STATES)
+    '''
+    def matches(self, type):
+        if self.kind != "tracked":
+            return self.state == TYPE_STATES.get(type)
+        codes = (self.index, self.worktree)
+        if type == "modified":
+            return 'M' in codes or 'T' in codes
+        if type == "added":
+            return 'A' in codes or 'C' in codes
+        if type in ("removed", "deleted"):
+            return 'D' in codes
+        if type == "renamed":
+            return 'R' in codes
+        return False
+
+    def __repr__(self):
+        return "StatusEntry({0!r}, {1!r}, {2!r}, {3!r})".format(self.path, self.kind, self.index, self.worktree)
@@ -0,0 +1,55 @@
+#tree entry mode of a gitlink (the commit a submodule is pinned to)
+GITLINK_MODE = "160000"
+
+class Submodule(object):
+    '''
+    One submodule of the graph returned by getSubmodules.
+    'path' is relative to the top level repository and 'parent' is the path of the repository recording the submodule
+    ("" for the top level one). 'oid' is the commit recorded by the parent's gitlink, 'name' and 'url' come from the
+    parent's .gitmodules (None if it has no entry for the path). 'depth' is 1 for the submodules of the top level
+    repository, 2 for their submodules, etc. 'initialized' is True if the submodule has been cloned into its path.
+    '''
+    __slots__ = ('path', 'parent', 'oid', 'name', 'url', 'depth', 'initialized')
+
+    def __init__(self, path, parent, oid, name=None, url=None, depth=1, initialized=False):
+        self.path = path
+        self.parent = parent
+        self.oid = oid
+        self.name = name
+        self.url = url
+        self.depth = depth
+        self.initialized = initialized
+
+    def __repr__(self):
+        return "Submodule({0!r}, {1!r})".format(self.path, self.oid)
+
+'''
+Parse the output of 'git config -z --get-regexp ^submodule\\.' run on a .gitmodules file.
+Returns a dictionary of submodule path -> (name, url).
+'''
+def parseGitmodules(output):
+    paths = {}
+    urls = {}
+    for record in output.split("\0"):
+        key, sep, value = record.partition("\n")
+        if not key.startswith("submodule."):
+            continue
+        #the name may itself contain dots
+        name, sep, var = key[len("submodule."):].rpartition(".")
+        if var == "path":
+            paths[name] = value
+        elif var == "url":
+            urls[name] = value
+    return dict((path, (name, urls.get(name))) for name, path in paths.items())
+
+'''
+Parse the output of 'git ls-tree -z' and return a dictionary of path -> commit id for the gitlink entries
+'''
+def parseGitlinks(output):
+    gitlinks = {}
+    for record in output.split("\0"):
+        info, sep, path = record.partition("\t")
+        fields = info.split()
+        if len(fields) == 3 and fields[0] == GITLINK_MODE:
+            gitlinks[path] = fields[2]
+    return gitlinks
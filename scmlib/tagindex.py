@@ -0,0 +1,77 @@
+import fnmatch
+import re
+
+class TagEntry(object):
+    '''
+    One tag of a TagIndex: the tag name, the object id the tag ref points to ('oid', the tag object for an annotated
+    tag), the commit it peels to ('commit', None if the tag does not point to a commit), the tagger date as a unix
+    epoch (0 for a lightweight tag) and whether the tag is annotated.
+    '''
+    __slots__ = ('name', 'oid', 'commit', 'epoch', 'annotated')
+
+    def __init__(self, name, oid, commit, epoch=0, annotated=False):
+        self.name = name
+        self.oid = oid
+        self.commit = commit
+        self.epoch = epoch
+        self.annotated = annotated
+
+    def __repr__(self):
+        return "TagEntry({0!r}, {1!r})".format(self.name, self.commit)
+
+class TagIndex(object):
+    '''
+    All the tags of a repository with the commits they point to, returned by getTagIndex.
+    The tags are kept ordered from newest to oldest tagger date (lightweight tags last), then by name, which is the
+    order of 'git tag -l --sort=-taggerdate'. Lookups by name and by commit use dictionaries built once.
+    'key' identifies the repository state the index was built from.
+    '''
+    def __init__(self, entries, key=None):
+        self.entries = sorted(entries, key=lambda entry: (-entry.epoch, entry.name))
+        self.key = key
+        self.byName = dict((entry.name, entry) for entry in self.entries)
+        self.byCommit = {}
+        for entry in self.entries:
+            if entry.commit is not None:
+                self.byCommit.setdefault(entry.commit, []).append(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, name):
+        return name in self.byName
+
+    def __repr__(self):
+        return "TagIndex({0} tags, key={1!r})".format(len(self), self.key)
+
+    '''
+    Returns the TagEntry for a tag name, or None if there is no such tag
+    '''
+    def get(self, name):
+        return self.byName.get(name)
+
+    '''
+    Returns the list of tag names, newest first, optionally only those matching a glob pattern ('filter', fnmatch syntax,
+    case-sensitive, '*' also matches '/', as for 'git tag -l <pattern>')
+    '''
+    def names(self, filter=None):
+        if filter is None:
+            return [entry.name for entry in self.entries]
+        match = re.compile(fnmatch.translate(filter)).match
+        return [entry.name for entry in self.entries if match(entry.name)]
+
+    '''
+    Returns the tags pointing to a commit: annotated tags first, then newest
+    '''
+    def tagsAt(self, commit):
+        entries = self.byCommit.get(commit, [])
+        return sorted(entries, key=lambda entry: (not entry.annotated, -entry.epoch, entry.name))
+
+    '''
+    Returns the set of the commits that have at least one tag
+    '''
+    def commits(self):
+        return set(self.byCommit)
@@ -0,0 +1,160 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+import threading
+
+from .errors import ScmError
+
+#inotify event bits (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+#O_CLOEXEC is missing from the os module of Python 2 and older platforms, the value is fixed on Linux
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+#events that can change the status of a file
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+#struct inotify_event header: wd, mask, cookie, name length
+_EVENT_HEADER = struct.Struct("iIII")
+
+#directories never watched: the repository metadata (tracked through the repo state instead)
+EXCLUDED_DIRS = (".git", ".hg")
+
+#files that change how every untracked file is classified; touching one of them needs a full status scan
+IGNORE_FILES = (".gitignore", ".hgignore")
+
+_libc = None
+
+#file names are passed to and read from inotify as bytes; Python 2 paths already are
+_fsencode = getattr(os, "fsencode", lambda path: path)
+_fsdecode = getattr(os, "fsdecode", lambda path: path)
+
+'''
+Private function to load the C library functions used for inotify. Raises ScmError if inotify is not available.
+'''
+def _getLibc():
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            raise ScmError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        try:
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        except AttributeError:
+            raise ScmError("inotify is not supported by the C library")
+        _libc = libc
+    return _libc
+
+class DirtyTracker(object):
+    '''
+    Records the paths touched in a working copy since the last checkpoint, using Linux inotify.
+    Every directory under the root (except the .git/.hg metadata) is watched. Paths are relative to the root and use
+    '/' separators; a new, moved or deleted directory is recorded as the directory path itself.
+    If the kernel event queue overflows, changes were missed and collect() returns None once, so callers fall back
+    to a full scan. If a directory cannot be watched (e.g. the inotify watch limit is reached), it always returns None.
+    Events are only read when collect() is called, so no thread is needed. Access is serialized with a lock.
+    Raises ScmError if inotify is not available.
+    '''
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.libc = _getLibc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise ScmError("Unable to start inotify: {0}".format(os.strerror(ctypes.get_errno())))
+        self.dirs = {}
+        self.touched = set()
+        self.overflowed = False
+        self.unwatched = False
+        try:
+            self._addWatches("")
+        except:
+            self.close()
+            raise
+
+    '''
+    Private function to watch a directory and all the directories below it. 'relpath' is relative to the root.
+    '''
+    def _addWatches(self, relpath):
+        top = os.path.join(self.root, relpath) if relpath else self.root
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = [name for name in dirnames if name not in EXCLUDED_DIRS]
+            rel = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+            wd = self.libc.inotify_add_watch(self.fd, _fsencode(dirpath), WATCH_MASK | IN_ONLYDIR)
+            if wd < 0:
+                err = ctypes.get_errno()
+                #the directory may have been removed again already, which its parent's events record
+                if err not in (errno.ENOENT, errno.ENOTDIR):
+                    self.unwatched = True
+                continue
+            self.dirs[wd] = "" if rel == "." else rel
+
+    '''
+    Private function to read the pending events into the touched set
+    '''
+    def _drain(self):
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = _fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    self.overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                parent = self.dirs.get(wd)
+                if parent is None or len(name) == 0:
+                    continue
+                if name in EXCLUDED_DIRS:
+                    continue
+                path = parent + "/" + name if parent else name
+                self.touched.add(path)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._addWatches(path)
+
+    '''
+    Returns the set of paths touched since the last checkpoint and starts a new checkpoint.
+    Returns None (and still starts a new checkpoint) if changes may have been missed.
+    '''
+    def collect(self):
+        with self.lock:
+            if self.fd < 0:
+                return None
+            self._drain()
+            touched = None if self.overflowed or self.unwatched else self.touched
+            self.touched = set()
+            self.overflowed = False
+            return touched
+
+    def close(self):
+        with self.lock:
+            if self.fd >= 0:
+                os.close(self.fd)
+                self.fd = -1
+            self.dirs = {}
@@ -0,0 +1,280 @@
+import os
+import re
+import shutil
+import stat
+import time
+
+from .errors import ScmError
+from .filelock import FileLock
+from .filelock import LOCK_POLL_INTERVAL
+from .git import GitScm
+from .mirror import cacheName
+from .mirror import stripCredentials
+from . import gitrefs
+
+#default number of workspaces kept per remote URL
+DEFAULT_POOL_SIZE = 2
+
+#suffixes of the files kept next to each workspace: its lock, and its state (the time it was last released and the
+#disk space it used then)
+LOCK_SUFFIX = ".lock"
+STATE_SUFFIX = ".state"
+
+'''
+Returns the number of bytes used by the files under a directory (0 if it does not exist)
+'''
+def diskUsage(path):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+'''
+Private function to delete a directory tree, including the read-only files git leaves in the object store
+'''
+def _removeTree(path):
+    def retry(function, failed, excinfo):
+        os.chmod(failed, stat.S_IWRITE)
+        function(failed)
+    if os.path.isdir(path):
+        shutil.rmtree(path, onerror=retry)
+
+'''
+Returns a remote URL in a form where the different ways of writing the same repository compare equal: without the
+credentials, the scheme, the port, a trailing "/" or ".git", and with scp-like ssh URLs ("git@host:group/repo.git")
+turned into host and path like the others, e.g. "host/group/repo". Local paths and file:// URLs become the path.
+'''
+def normalizeUrl(url):
+    url = stripCredentials(url.strip()).replace("\\", "/")
+    match = re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*://([^/]*)(/.*)?$", url)
+    if match is not None:
+        host, path = match.group(1), match.group(2) or ""
+    else:
+        #scp-like syntax, not a Windows drive letter
+        match = re.match(r"^(?:[^@/]+@)?([^:/]{2,}):(.*)$", url)
+        if match is not None:
+            host, path = match.group(1), "/" + match.group(2)
+        else:
+            host, path = "", url
+    host = re.sub(r":\d*$", "", host).lower()
+    path = path.rstrip("/")
+    if path.endswith(".git"):
+        path = path[:-len(".git")].rstrip("/")
+    return host + path
+
+'''
+Returns True if the local path of a GitScm holds a clone of its remote repository (see normalizeUrl)
+'''
+def isCloneOf(scm):
+    if scm.remotepath is None or gitrefs.findGitDir(scm.localpath) is None:
+        return False
+    try:
+        url = scm._processScmCommand(['config', '--get', 'remote.origin.url']).strip()
+    except ScmError:
+        return False
+    return normalizeUrl(url) == normalizeUrl(scm.remotepath)
+
+'''
+Bring the local path of a GitScm to a revision of its remote ("master" by default). A previous clone of the same
+remote is fetched and reset in place (see GitScm.resetWorkspace), otherwise the remote is cloned there (see
+GitScm.clone) and checked out at the revision.
+A directory holding any other git working copy is never deleted, and a failing reset is raised, unless 'replace' is
+set: only a WorkspacePool sets it, for the workspaces it manages and holds the lock of, which are then deleted and
+cloned again. A failing fetch is always raised, since a new clone would need the remote as well.
+Returns True if a previous clone was reused. Raises ScmError on error.
+'''
+def checkoutWorkspace(scm, revision=None, replace=False):
+    if isCloneOf(scm):
+        try:
+            scm._processScmCommand(['fetch', '--quiet', '--prune', 'origin'])
+        finally:
+            if scm.cache is not None:
+                scm.cache.invalidate()
+        try:
+            scm.resetWorkspace(revision, fetch=False)
+            return True
+        except ScmError as e:
+            if not replace:
+                raise
+            scm.debugPrint("workspace reset failed, cloning again: {0}".format(e))
+    if gitrefs.findGitDir(scm.localpath) is not None:
+        if not replace:
+            raise ScmError("{0} holds a working copy of another repository, not replacing it with a clone of {1}".format(
+                scm.localpath, stripCredentials(scm.remotepath)))
+        _removeTree(scm.localpath)
+    scm.clone()
+    scm.gotoRevision(revision)
+    return False
+
+class Workspace(object):
+    '''
+    A working copy handed out by WorkspacePool.acquire: 'path' is its directory, 'scm' a GitScm for it and 'reused'
+    tells if a previous checkout was reset rather than cloned. The workspace stays locked to the job until it is
+    released. Can be used as a context manager.
+    '''
+    def __init__(self, pool, path, scm, lock, reused):
+        self.pool = pool
+        self.path = path
+        self.scm = scm
+        self.lock = lock
+        self.reused = reused
+
+    '''
+    Give the workspace back to the pool, recording its disk use, and evict old workspaces over the pool's budget
+    '''
+    def release(self):
+        if not self.lock.locked:
+            return
+        try:
+            self.scm.close()
+            self.pool._writeState(self.path, time.time(), diskUsage(self.path))
+        finally:
+            self.lock.release()
+        self.pool.evict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def __repr__(self):
+        return "Workspace({0!r}, reused={1})".format(self.path, self.reused)
+
+class WorkspacePool(object):
+    '''
+    Working copies kept under a shared directory ('root') and handed out again to later jobs instead of wiping them
+    and cloning from scratch: up to 'size' per remote URL, each locked (see filelock.FileLock) while a job uses it.
+    acquire hands out the most recently used free workspace of the remote and brings it to the requested revision
+    (see checkoutWorkspace), so a job starts from an up to date copy in seconds.
+    With 'diskBudget' (bytes), the least recently used free workspaces of all the remotes are deleted whenever the
+    workspaces use more than the budget. 'lockTimeout' is how long acquire waits (in seconds) when all the workspaces
+    of a remote are in use (None waits forever).
+    '''
+    def __init__(self, root, size=DEFAULT_POOL_SIZE, diskBudget=None, lockTimeout=None):
+        if size < 1:
+            raise ScmError("Workspace pool size must be at least 1: {0}".format(size))
+        self.root = os.path.abspath(root)
+        self.size = size
+        self.diskBudget = diskBudget
+        self.lockTimeout = lockTimeout
+
+    '''
+    Returns the directory holding the workspaces of a remote URL (see mirror.cacheName)
+    '''
+    def remoteDir(self, url):
+        return os.path.join(self.root, cacheName(url))
+
+    '''
+    Hand out a workspace of a remote URL checked out at a revision ("master" by default), waiting if all of them are in
+    use. 'username' and 'password' are passed to the GitScm, and 'setup' is called with the GitScm before the checkout
+    (e.g. to set a mirror cache or clone options).
+    Returns a Workspace, locked until it is released. Raises ScmError on error.
+    '''
+    def acquire(self, url, revision=None, username=None, password=None, setup=None):
+        path, lock = self._lockFreeSlot(url)
+        try:
+            self.evict()
+            scm = GitScm(path, remoterepo=url, username=username, password=password)
+            if setup is not None:
+                setup(scm)
+            #the slot is locked, so a workspace that cannot be reset may be replaced
+            reused = checkoutWorkspace(scm, revision, replace=True)
+            self._writeState(path, time.time(), self._readState(path)[1])
+        except:
+            lock.release()
+            raise
+        return Workspace(self, path, scm, lock, reused)
+
+    '''
+    Private function to lock a workspace slot of a remote URL, preferring the most recently used existing workspaces.
+    Returns the slot path and its acquired FileLock.
+    '''
+    def _lockFreeSlot(self, url):
+        directory = self.remoteDir(url)
+        slots = [os.path.join(directory, str(index)) for index in range(self.size)]
+        #warm workspaces first, the most recently used first, then the slots without a workspace
+        slots.sort(key=lambda path: (not os.path.isdir(path), -self._readState(path)[0]))
+        deadline = None if self.lockTimeout is None else time.time() + self.lockTimeout
+        while True:
+            for path in slots:
+                lock = FileLock(path + LOCK_SUFFIX, 0)
+                try:
+                    lock.acquire()
+                except ScmError:
+                    continue
+                return path, lock
+            if deadline is not None and time.time() >= deadline:
+                raise ScmError("All {0} workspaces of {1} are in use".format(self.size, stripCredentials(url)))
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    '''
+    Delete the least recently used free workspaces until all the workspaces fit in the disk budget.
+    Workspaces in use are never deleted, so the total can stay over the budget.
+    Returns the list of deleted workspace paths.
+    '''
+    def evict(self):
+        if self.diskBudget is None:
+            return []
+        workspaces = []
+        for path in self.workspaces():
+            used, size = self._readState(path)
+            workspaces.append((used, size, path))
+        total = sum(size for used, size, path in workspaces)
+        evicted = []
+        for used, size, path in sorted(workspaces):
+            if total <= self.diskBudget:
+                break
+            lock = FileLock(path + LOCK_SUFFIX, 0)
+            try:
+                lock.acquire()
+            except ScmError:
+                continue
+            try:
+                _removeTree(path)
+                os.remove(path + STATE_SUFFIX)
+            except OSError:
+                pass
+            finally:
+                lock.release()
+            total -= size
+            evicted.append(path)
+        return evicted
+
+    '''
+    Returns the list of workspace paths of the pool, for all the remotes
+    '''
+    def workspaces(self):
+        paths = []
+        if not os.path.isdir(self.root):
+            return paths
+        for remote in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, remote)
+            if os.path.isdir(directory):
+                paths.extend(os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                             if name.isdigit() and os.path.isdir(os.path.join(directory, name)))
+        return paths
+
+    '''
+    Private function returning the (last used time, disk use) recorded for a workspace, (0, 0) if none
+    '''
+    @staticmethod
+    def _readState(path):
+        try:
+            with open(path + STATE_SUFFIX, "r") as f:
+                used, size = f.read().split()
+            return float(used), int(size)
+        except (IOError, ValueError):
+            return 0, 0
+
+    '''
+    Private function to record the last used time and disk use of a workspace
+    '''
+    @staticmethod
+    def _writeState(path, used, size):
+        with open(path + STATE_SUFFIX, "w") as f:
+            f.write("{0!r} {1}".format(used, size))
@@ -0,0 +1,52 @@
+class Worktree(object):
+    '''
+    One working tree of a repository, as returned by getWorktrees: the main working tree first, then the linked ones.
+    'head' is the checked out commit and 'branch' the short name of the checked out branch (None when detached).
+    'locked' is the lock reason ("" if locked without one) or None, 'prunable' the reason why 'git worktree prune'
+    would remove it (e.g. its directory was deleted) or None. 'bare' is set for the main tree of a bare repository.
+    '''
+    __slots__ = ('path', 'head', 'branch', 'bare', 'locked', 'prunable')
+
+    def __init__(self, path, head=None, branch=None, bare=False, locked=None, prunable=None):
+        self.path = path
+        self.head = head
+        self.branch = branch
+        self.bare = bare
+        self.locked = locked
+        self.prunable = prunable
+
+    @property
+    def detached(self):
+        return self.branch is None and not self.bare
+
+    def __repr__(self):
+        return "Worktree({0!r}, {1!r})".format(self.path, self.branch or self.head)
+
+'''
+Parse the output of 'git worktree list --porcelain' (one attribute per line and an empty line after each working
+tree), with 'separator' ending the lines ("\\0" with -z, which git 2.36+ supports). Returns a list of Worktree objects.
+'''
+def parseWorktrees(output, separator="\0"):
+    worktrees = []
+    worktree = None
+    for line in output.split(separator):
+        if len(line) == 0:
+            worktree = None
+            continue
+        key, sep, value = line.partition(" ")
+        if key == "worktree":
+            worktree = Worktree(value)
+            worktrees.append(worktree)
+        elif worktree is None:
+            continue
+        elif key == "HEAD":
+            worktree.head = value
+        elif key == "branch":
+            worktree.branch = value[len("refs/heads/"):] if value.startswith("refs/heads/") else value
+        elif key == "bare":
+            worktree.bare = True
+        elif key == "locked":
+            worktree.locked = value
+        elif key == "prunable":
+            worktree.prunable = value
+    return worktrees
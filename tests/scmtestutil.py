@@ -0,0 +1,79 @@
+'''
+Helpers shared by the scmlib tests: throwaway git repositories built with the git command line in a temporary
+directory. The tests run on Python 2 and 3:
+
+usage: python -m unittest discover -s tests
+'''
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+class GitTestCase(unittest.TestCase):
+    '''
+    Test case owning a temporary directory, removed after each test, with helpers to build repositories in it
+    '''
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    '''
+    Returns the path of a file or directory below the temporary directory
+    '''
+    def path(self, *names):
+        return os.path.join(self.tmpdir, *names)
+
+    '''
+    Run git in a repository and return its output as text. Text arguments are passed in utf-8 on Python 2.
+    '''
+    def git(self, repo, *args, **kwargs):
+        args = [a if isinstance(a, str) else a.encode('utf-8') for a in args]
+        return subprocess.check_output(['git'] + args, cwd=repo, env=kwargs.get('env')).decode('utf-8')
+
+    '''
+    Create a repository (bare if asked) on branch master with a committer identity, and return its path
+    '''
+    def initRepo(self, name, bare=False):
+        repo = self.path(name)
+        subprocess.check_call(['git', 'init', '-q'] + (['--bare'] if bare else []) + [repo])
+        self.git(repo, 'symbolic-ref', 'HEAD', 'refs/heads/master')
+        self.git(repo, 'config', 'user.name', 'tester')
+        self.git(repo, 'config', 'user.email', 'tester@example.com')
+        return repo
+
+    '''
+    Clone a repository into a new directory with a committer identity, and return its path
+    '''
+    def cloneRepo(self, source, name):
+        repo = self.path(name)
+        self.git(self.tmpdir, 'clone', '-q', source, repo)
+        self.git(repo, 'config', 'user.name', 'tester')
+        self.git(repo, 'config', 'user.email', 'tester@example.com')
+        return repo
+
+    '''
+    Write a file (text) in a working copy, commit it and return the new commit id.
+    'date' sets the author and commit date (a git date, e.g. "1700000000 +0000").
+    '''
+    def commitFile(self, repo, name, data, message, date=None):
+        path = os.path.join(repo, name)
+        if not isinstance(path, str):
+            #Python 2 may not know the file system encoding
+            path = path.encode('utf-8')
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(data)
+        self.git(repo, 'add', name)
+        env = None
+        if date is not None:
+            env = dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+        self.git(repo, 'commit', '-q', '-m', message, env=env)
+        return self.git(repo, 'rev-parse', 'HEAD').strip()
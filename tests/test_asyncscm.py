@@ -0,0 +1,28 @@
+import os
+import sys
+import unittest
+
+from scmtestutil import GitTestCase
+
+from scmlib.git import GitScm
+
+@unittest.skipIf(sys.version_info < (3, 7), "asyncscm needs Python 3.7")
+class AsyncCloneTest(GitTestCase):
+    '''
+    Async clones go through the mirror cache like the synchronous ones
+    '''
+    def testCloneThroughMirror(self):
+        import asyncio
+        from scmlib.asyncscm import AsyncScm
+
+        origin = self.initRepo("origin")
+        head = self.commitFile(origin, "a.txt", u"a\n", "one")
+        scm = GitScm(self.path("clone"), origin)
+        scm.setMirrorCache(self.path("mirrors"))
+        asyncio.run(AsyncScm(scm).clone())
+
+        mirror = scm.mirrors.mirrorPath(origin)
+        self.assertTrue(os.path.isdir(mirror))
+        with open(os.path.join(self.path("clone"), ".git", "objects", "info", "alternates")) as f:
+            self.assertEqual(os.path.normpath(f.read().strip()), os.path.normpath(os.path.join(mirror, "objects")))
+        self.assertEqual(self.git(self.path("clone"), 'rev-parse', 'HEAD').strip(), head)
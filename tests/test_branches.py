@@ -0,0 +1,32 @@
+from scmtestutil import GitTestCase
+
+from scmlib.git import GitScm
+
+class AheadBehindTest(GitTestCase):
+    '''
+    getBranches(aheadBehind=True) counts the commits of each branch against the main branch
+    '''
+    def setUp(self):
+        super(AheadBehindTest, self).setUp()
+        self.repo = self.initRepo("wc")
+        self.commitFile(self.repo, "a.txt", u"1\n", "one")
+        self.commitFile(self.repo, "a.txt", u"2\n", "two")
+        self.git(self.repo, 'branch', 'same')
+        self.git(self.repo, 'checkout', '-q', '-b', 'feature/x', 'HEAD~1')
+        self.commitFile(self.repo, "b.txt", u"1\n", "x one")
+        self.commitFile(self.repo, "b.txt", u"2\n", "x two")
+        self.git(self.repo, 'checkout', '-q', 'master')
+        self.commitFile(self.repo, "a.txt", u"3\n", "three")
+
+    def checkCounts(self, scm):
+        counts = dict((b['branch'], (b['ahead'], b['behind'])) for b in scm.getBranches(aheadBehind=True))
+        self.assertEqual(counts, {"master": (0, 0), "same": (0, 1), "feature/x": (2, 2)})
+
+    def testAheadBehind(self):
+        self.checkCounts(GitScm(self.repo))
+
+    def testWithoutForEachRefAtom(self):
+        #the counting used with git before 2.41
+        scm = GitScm(self.repo)
+        scm.hasAheadBehindAtom = False
+        self.checkCounts(scm)
@@ -0,0 +1,41 @@
+from scmtestutil import GitTestCase
+
+from scmlib.git import GitScm
+
+class QueryCacheTest(GitTestCase):
+    '''
+    The query cache never returns a result from before the repository changed
+    '''
+    def setUp(self):
+        super(QueryCacheTest, self).setUp()
+        self.origin = self.initRepo("origin.git", bare=True)
+        self.repo = self.initRepo("wc")
+        self.first = self.commitFile(self.repo, "a.txt", u"one\n", "one")
+        self.git(self.repo, 'remote', 'add', 'origin', self.origin)
+        self.git(self.repo, 'push', '-q', '-u', 'origin', 'master')
+        self.scm = GitScm(self.repo, self.origin)
+        self.scm.enableCache()
+
+    def testUpdateDropsCachedRemoteRefs(self):
+        self.assertEqual(self.scm.log(revision="origin/master")[0]['hash'], self.first)
+        other = self.cloneRepo(self.origin, "other")
+        second = self.commitFile(other, "a.txt", u"two\n", "two")
+        self.git(other, 'push', '-q', 'origin', 'master')
+        self.scm.update()
+        self.assertEqual(self.scm.log(revision="origin/master")[0]['hash'], second)
+
+    def testNestedRefMove(self):
+        second = self.commitFile(self.repo, "a.txt", u"two\n", "two")
+        self.git(self.repo, 'update-ref', 'refs/heads/feature/x', self.first)
+        self.assertEqual(self.scm.log(revision="feature/x")[0]['hash'], self.first)
+        self.git(self.repo, 'update-ref', 'refs/heads/feature/x', second)
+        self.assertEqual(self.scm.log(revision="feature/x")[0]['hash'], second)
+
+    def testReadOnlyBatchKeepsCache(self):
+        self.scm.log()
+        self.assertEqual(self.scm.getCacheStats()['size'], 1)
+        self.scm.runBatch([['rev-parse', 'HEAD'], ['log', '-1']]).check()
+        self.scm.log()
+        self.assertEqual(self.scm.getCacheStats()['hits'], 1)
+        self.scm.runBatch([{'args': ['tag', 'v1'], 'mutates': True}]).check()
+        self.assertEqual(self.scm.getCacheStats()['size'], 0)
@@ -0,0 +1,43 @@
+from scmtestutil import GitTestCase
+
+from scmlib.git import GitScm
+
+class CommitFilesTest(GitTestCase):
+    '''
+    commitFiles writes commits without touching the working tree, including for non-ASCII paths and messages
+    '''
+    def setUp(self):
+        super(CommitFilesTest, self).setUp()
+        self.repo = self.initRepo("wc")
+        self.base = self.commitFile(self.repo, u"d\u00e9j\u00e0/a.txt", u"a\n", "base")
+        self.commitFile(self.repo, u"keep.txt", u"k\n", "keep")
+        self.git(self.repo, 'config', 'core.quotepath', 'false')
+
+    def listTree(self, revision):
+        return self.git(self.repo, 'ls-tree', '-r', '--name-only', revision).splitlines()
+
+    def testNonAsciiPathAndMessage(self):
+        scm = GitScm(self.repo)
+        files = {
+            u"d\u00e9j\u00e0/a.txt": b"changed\n",
+            u"d\u00e9j\u00e0/n\u00e9w.txt": b"new\n",
+            u"keep.txt": None,
+        }
+        commit = scm.commitFiles("generated", files, u"r\u00e9g\u00e9n\u00e9r\u00e9\n\nd\u00e9tails", parent="master")
+        self.assertEqual(self.git(self.repo, 'rev-parse', 'refs/heads/generated').strip(), commit)
+        self.assertEqual(self.listTree(commit), [u"d\u00e9j\u00e0/a.txt", u"d\u00e9j\u00e0/n\u00e9w.txt"])
+        self.assertEqual(self.git(self.repo, 'show', u"{0}:d\u00e9j\u00e0/a.txt".format(commit)), u"changed\n")
+        self.assertEqual(self.git(self.repo, 'log', '-1', '--format=%s', commit).strip(), u"r\u00e9g\u00e9n\u00e9r\u00e9")
+        #the same contents again make no commit
+        files.pop(u"keep.txt")
+        self.assertIsNone(scm.commitFiles("generated", files, u"again"))
+        #the checked out branch and working tree are left alone
+        self.assertEqual(self.git(self.repo, 'status', '--porcelain'), u"")
+        self.assertEqual(self.listTree("master"), [u"d\u00e9j\u00e0/a.txt", u"keep.txt"])
+
+    def testByteStringPaths(self):
+        scm = GitScm(self.repo)
+        commit = scm.commitFiles("generated", {u"d\u00e9j\u00e0/a.txt".encode('utf-8'): b"bytes\n"},
+                                 u"bytes \u00e9".encode('utf-8'), parent="master")
+        self.assertEqual(self.listTree(commit), [u"d\u00e9j\u00e0/a.txt", u"keep.txt"])
+        self.assertEqual(self.git(self.repo, 'show', u"{0}:d\u00e9j\u00e0/a.txt".format(commit)), u"bytes\n")
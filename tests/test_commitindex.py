@@ -0,0 +1,62 @@
+import datetime
+import time
+
+from scmtestutil import GitTestCase
+
+from scmlib.commitindex import parseDateBound
+from scmlib.git import GitScm
+
+#one commit a day from this epoch on
+FIRST_EPOCH = 1700000000
+DAY = 24 * 3600
+
+class FixedOffset(datetime.tzinfo):
+    '''
+    Time zone at a fixed offset from UTC in minutes (datetime.timezone is Python 3 only)
+    '''
+    def __init__(self, minutes):
+        self.offset = datetime.timedelta(minutes=minutes)
+
+    def utcoffset(self, dt):
+        return self.offset
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return None
+
+class CommitIndexTest(GitTestCase):
+    '''
+    Date-bounded log queries answered by the commit index match git log
+    '''
+    def testParseDateBound(self):
+        self.assertEqual(parseDateBound(FIRST_EPOCH), FIRST_EPOCH)
+        utc = datetime.datetime(2023, 11, 14, 22, 13, 20, tzinfo=FixedOffset(0))
+        self.assertEqual(parseDateBound(utc), FIRST_EPOCH)
+        east = datetime.datetime(2023, 11, 15, 0, 13, 20, tzinfo=FixedOffset(120))
+        self.assertEqual(parseDateBound(east), FIRST_EPOCH)
+        local = datetime.datetime.fromtimestamp(FIRST_EPOCH)
+        self.assertEqual(parseDateBound(local), FIRST_EPOCH)
+        self.assertEqual(parseDateBound(local.strftime("%Y-%m-%d %H:%M:%S")), FIRST_EPOCH)
+        self.assertIsNone(parseDateBound("yesterday"))
+
+    def testDateBoundedLog(self):
+        repo = self.initRepo("wc")
+        for i in range(6):
+            self.commitFile(repo, "a.txt", u"{0}\n".format(i), "day {0}".format(i),
+                            date="{0} +0000".format(FIRST_EPOCH + i * DAY))
+        bounds = [
+            (datetime.datetime(2023, 11, 15, 22, 0, 0, tzinfo=FixedOffset(0)),
+             datetime.datetime.fromtimestamp(FIRST_EPOCH + 4 * DAY - 60)),
+            (FIRST_EPOCH + DAY - 60, None),
+            (None, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(FIRST_EPOCH + 2 * DAY + 60))),
+        ]
+        scm = GitScm(repo)
+        expected = [[c['hash'] for c in scm.log(startdate=start, enddate=end)] for start, end in bounds]
+        self.assertEqual([len(hashes) for hashes in expected], [3, 5, 3])
+
+        scm.setCommitIndex(True)
+        for (start, end), hashes in zip(bounds, expected):
+            self.assertIsNotNone(scm._queryCommitIndex(startdate=start, enddate=end))
+            self.assertEqual([c['hash'] for c in scm.log(startdate=start, enddate=end)], hashes)
@@ -0,0 +1,43 @@
+from scmtestutil import GitTestCase
+
+from scmlib.fileindex import FileIndex
+from scmlib.git import GitScm
+
+PATHS = [u"a.txt", u"a/b.txt", u"a/c.py", u"a/\u00e9/z.c", u"ab/x.py", u"b/\u00e9.txt", u"b\u00e9/y", u"z"]
+
+class FileIndexTest(GitTestCase):
+    '''
+    Prefix, glob and extension queries of FileIndex, on its own and built from a repository
+    '''
+    def checkQueries(self, index):
+        self.assertEqual(list(index), PATHS)
+        self.assertEqual(index.prefix(u"a/"), [u"a/b.txt", u"a/c.py", u"a/\u00e9/z.c"])
+        self.assertEqual(index.prefix(u"a"), PATHS[:5])
+        self.assertEqual(index.prefix(u"b"), [u"b/\u00e9.txt", u"b\u00e9/y"])
+        self.assertEqual(index.prefix(u"b/"), [u"b/\u00e9.txt"])
+        self.assertEqual(index.prefix(u"a/\u00e9"), [u"a/\u00e9/z.c"])
+        self.assertEqual(index.prefix(u"z"), [u"z"])
+        self.assertEqual(index.prefix(u"zz"), [])
+        self.assertEqual(index.prefix(u""), PATHS)
+        self.assertEqual(index.glob(u"a/*.py"), [u"a/c.py"])
+        self.assertEqual(index.extension(u".py"), [u"a/c.py", u"ab/x.py"])
+        self.assertTrue(u"a/c.py" in index)
+        self.assertFalse(u"a/c" in index)
+
+    def testFromPaths(self):
+        self.checkQueries(FileIndex.fromPaths(reversed(PATHS)))
+
+    def testUnsortedData(self):
+        self.checkQueries(FileIndex(u"\0".join(reversed(PATHS))))
+
+    def testFromRepo(self):
+        repo = self.initRepo("wc")
+        for path in PATHS:
+            self.commitFile(repo, path, u"data\n", u"add")
+        self.git(repo, 'config', 'core.quotepath', 'false')
+        scm = GitScm(repo)
+        self.checkQueries(scm.getFileIndex())
+        #asking again returns the kept index
+        self.assertIs(scm.getFileIndex(), scm.getFileIndex("HEAD"))
+        scm.setObjectReader(True)
+        self.checkQueries(scm.getFileIndex("HEAD"))
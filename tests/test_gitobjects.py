@@ -0,0 +1,44 @@
+from scmtestutil import GitTestCase
+
+from scmlib.git import GitScm
+
+class ObjectReaderTest(GitTestCase):
+    '''
+    The object reader gives the same history as git log, from loose objects and from a packed (gc'd) repo
+    '''
+    def setUp(self):
+        super(ObjectReaderTest, self).setUp()
+        self.repo = self.initRepo("wc")
+        lines = [u"line {0}\n".format(i) for i in range(200)]
+        for i in range(5):
+            #a large file changed a little each time, so the pack holds deltas
+            lines[i * 10] = u"changed {0}\n".format(i)
+            self.commitFile(self.repo, "big.txt", u"".join(lines), "change {0}".format(i))
+        self.commitFile(self.repo, "sub/b.txt", u"b\n", "add b")
+
+    '''
+    Returns the hashes, parents and messages of the log from git and from the object reader
+    '''
+    def readLogs(self):
+        scm = GitScm(self.repo)
+        expected = [(c['hash'], c['parents'], c['message']) for c in scm.log()]
+        scm.setObjectReader(True)
+        self.assertIsNotNone(scm._walkHistory())
+        found = [(c['hash'], c['parents'], c['message']) for c in scm.log()]
+        files = scm.getFiles()
+        scm.setObjectReader(False)
+        return expected, found, files
+
+    def testLooseObjects(self):
+        expected, found, files = self.readLogs()
+        self.assertEqual(len(found), 6)
+        self.assertEqual(found, expected)
+        self.assertEqual(sorted(files), ["big.txt", "sub/b.txt"])
+
+    def testPackedObjects(self):
+        self.git(self.repo, 'gc', '-q', '--aggressive')
+        self.assertEqual(self.git(self.repo, 'count-objects', '-v').split("\n")[0], "count: 0")
+        expected, found, files = self.readLogs()
+        self.assertEqual(len(found), 6)
+        self.assertEqual(found, expected)
+        self.assertEqual(sorted(files), ["big.txt", "sub/b.txt"])
@@ -0,0 +1,33 @@
+import os
+
+from scmtestutil import GitTestCase
+
+from scmlib.git import GitScm
+
+class MailmapTest(GitTestCase):
+    '''
+    Author names from the cat-file co-process and the object reader follow the mailmap settings, like git log
+    '''
+    def setUp(self):
+        super(MailmapTest, self).setUp()
+        self.repo = self.initRepo("wc")
+        self.commitFile(self.repo, "names", u"Mapped Name <tester@example.com>\n", "mailmap")
+
+    def checkAuthor(self, expected):
+        self.assertEqual(self.git(self.repo, 'log', '-1', '--format=%aN').strip(), expected)
+        scm = GitScm(self.repo)
+        self.assertEqual(scm.log(revision="HEAD")[0]['idsid'], expected)
+        scm.setObjectReader(True)
+        self.assertEqual(scm.log(revision="HEAD")[0]['idsid'], expected)
+        self.assertEqual(scm.getBranches()[0]['idsid'], expected)
+
+    def testNoMailmap(self):
+        self.checkAuthor("tester")
+
+    def testMailmapFile(self):
+        self.git(self.repo, 'config', 'mailmap.file', os.path.join(self.repo, "names"))
+        self.checkAuthor("Mapped Name")
+
+    def testMailmapBlob(self):
+        self.git(self.repo, 'config', 'mailmap.blob', "HEAD:names")
+        self.checkAuthor("Mapped Name")
@@ -0,0 +1,31 @@
+from scmtestutil import GitTestCase
+
+from scmlib.git import GitScm
+
+class StructuredPatchTest(GitTestCase):
+    '''
+    getStructuredPatch splits the diff into files and hunks
+    '''
+    def testFilesAndHunks(self):
+        repo = self.initRepo("wc")
+        lines = [u"line {0}\n".format(i) for i in range(40)]
+        self.commitFile(repo, "a.txt", u"".join(lines), "a")
+        self.commitFile(repo, "gone.txt", u"gone\n", "gone")
+        lines[2] = u"first\n"
+        lines[35] = u"second\n"
+        self.commitFile(repo, "a.txt", u"".join(lines), "change a")
+        self.git(repo, 'rm', '-q', 'gone.txt')
+        self.commitFile(repo, "new.txt", u"new\n", "new and gone")
+
+        patch = GitScm(repo).getStructuredPatch("HEAD~2", "HEAD", context=1)
+        self.assertEqual(patch.files(), ["a.txt", "gone.txt", "new.txt"])
+        self.assertEqual(patch.hunkCount, 4)
+        changed = patch.file("a.txt")
+        self.assertEqual(changed.hunkCount, 2)
+        self.assertEqual(changed.lineCounts(), (2, 2))
+        self.assertEqual((changed.hunk(1).oldStart, changed.hunk(1).newStart), (35, 35))
+        self.assertIn(u"+second\n", changed.hunk(-1).text)
+        self.assertEqual((patch.file("gone.txt").oldPath, patch.file("gone.txt").newPath), ("gone.txt", None))
+        self.assertEqual(patch.file("new.txt").lineCounts(), (1, 0))
+        self.assertIsNone(patch.file("missing.txt"))
+        self.assertEqual(u"".join(f.text for f in patch), patch.text)
@@ -0,0 +1,33 @@
+from scmtestutil import GitTestCase
+
+from scmlib.git import GitScm
+
+class LatestTagTest(GitTestCase):
+    '''
+    getLatestTag gives the same answer as 'git describe --tags'
+    '''
+    def setUp(self):
+        super(LatestTagTest, self).setUp()
+        self.repo = self.initRepo("wc")
+        self.scm = GitScm(self.repo)
+
+    def describe(self):
+        return self.git(self.repo, 'describe', '--tags').strip()
+
+    def testTags(self):
+        self.commitFile(self.repo, "a.txt", u"1\n", "one")
+        self.git(self.repo, 'tag', 'light')
+        self.assertEqual(self.scm.getLatestTag(), "light")
+        self.git(self.repo, 'tag', '-a', '-m', 'release', 'v1.0')
+        self.assertEqual(self.scm.getLatestTag(), self.describe())
+        self.commitFile(self.repo, "a.txt", u"2\n", "two")
+        self.commitFile(self.repo, "a.txt", u"3\n", "three")
+        self.assertEqual(self.scm.getLatestTag(), self.describe())
+        self.git(self.repo, 'checkout', '-q', '-b', 'side', 'HEAD~1')
+        self.git(self.repo, 'tag', 'side-light')
+        self.commitFile(self.repo, "b.txt", u"1\n", "side")
+        self.git(self.repo, 'checkout', '-q', 'master')
+        self.git(self.repo, 'merge', '-q', '--no-edit', 'side')
+        self.assertEqual(self.scm.getLatestTag(), self.describe())
+        self.assertEqual(sorted(self.scm.getTagsContaining("light")), ["light", "side-light", "v1.0"])
+        self.assertEqual(self.scm.getTagsContaining("HEAD"), [])